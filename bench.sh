@@ -0,0 +1,15 @@
+#!/bin/sh
+# Lobby load test as a regression gate, for CI or before merging: fails when
+# a metric is more than 20% worse than the committed baseline. Throughput
+# depends on the machine, so record the baseline where the gate runs (the
+# first run does it) and commit it.
+set -e
+
+BASELINE=${BENCH_BASELINE:-bench_baseline.json}
+OPTIONS="--clients 500 --duration 10"
+
+if [ ! -f "$BASELINE" ]; then
+    echo "No $BASELINE yet: recording it, commit it to turn the gate on"
+    exec python manage.py bench_lobby $OPTIONS --save-baseline "$BASELINE"
+fi
+exec python manage.py bench_lobby $OPTIONS --baseline "$BASELINE" "$@"
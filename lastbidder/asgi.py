@@ -8,30 +8,26 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
 
 import os
-import asyncio
-import threading
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-from lastbidder.lobby.routing import websocket_urlpatterns
-from lastbidder.lobby.consumer import run  # Import the run function
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lastbidder.settings')
 
-# Schedule the run() function in a separate thread
-def start_background_tasks():
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(run())
+# Sets Django up; must run before anything importing models or simplejwt
+django_asgi_app = get_asgi_application()
 
-# Start the background tasks in a separate thread
-threading.Thread(target=start_background_tasks, daemon=True).start()
+from channels.routing import ProtocolTypeRouter, URLRouter
+from lastbidder.authService.middleware import JWTAuthMiddleware
+from lastbidder.lobby.routing import websocket_urlpatterns
+from lastbidder.lobby.service import LifespanApp
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    "http": django_asgi_app,
+    "websocket": JWTAuthMiddleware(
         URLRouter(
             websocket_urlpatterns
         )
     ),
-})
\ No newline at end of file
+    # The lobby service runs on the server's loop: started here by servers
+    # with lifespan support, or by the first websocket under Daphne
+    "lifespan": LifespanApp(),
+})
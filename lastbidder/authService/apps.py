@@ -3,3 +3,7 @@ from django.apps import AppConfig
 class AuthConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'lastbidder.authService'  # Ensure this matches the app's Python path
+
+    def ready(self):
+        # Keeps the login cache in step with the accounts
+        from . import signals  # noqa: F401
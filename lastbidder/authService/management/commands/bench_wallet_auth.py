@@ -0,0 +1,46 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from eth_account import Account
+from eth_account.messages import encode_defunct
+from lastbidder.authService.siwe import issue_nonce, consume_nonce, verify, verify_batch, get_pool
+
+class Command(BaseCommand):
+    help = 'Benchmark signed-nonce wallet logins with locally generated keys'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=5000)
+        parser.add_argument('--concurrency', type=int, default=32, help='Request threads for the single verify path')
+
+    def handle(self, *args, **options):
+        count = options['logins']
+        # Only signature recovery is measured, keep the challenges in memory
+        settings.CACHES['nonces'] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'TIMEOUT': 300}
+
+        self.stdout.write(f'Signing {count} challenges...')
+        items = []
+        for _ in range(count):
+            account = Account.create()
+            nonce, message = issue_nonce(account.address)
+            signature = account.sign_message(encode_defunct(text=message)).signature.hex()
+            items.append((account.address, nonce, signature))
+
+        # Warm the pool up so worker startup is not measured
+        get_pool().submit(int).result()
+
+        start = time.perf_counter()
+        challenges = [(wallet, consume_nonce(nonce)[1], signature) for wallet, nonce, signature in items]
+        results = verify_batch(challenges)
+        elapsed = time.perf_counter() - start
+        if not all(results):
+            self.stderr.write('Some signatures failed to verify')
+        self.stdout.write(f'batch:  {count / elapsed:.0f} logins/s')
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as requests:
+            results = list(requests.map(lambda item: verify(*item), challenges))
+        elapsed = time.perf_counter() - start
+        if not all(results):
+            self.stderr.write('Some signatures failed to verify')
+        self.stdout.write(f'single: {count / elapsed:.0f} logins/s')
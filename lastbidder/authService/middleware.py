@@ -0,0 +1,73 @@
+from collections import OrderedDict
+from time import time
+from urllib.parse import parse_qs
+from channels.middleware import BaseMiddleware
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+# Subprotocol prefix carrying the access token, e.g. "bearer.<jwt>", for
+# clients that prefer not to put it in the query string
+TOKEN_SUBPROTOCOL_PREFIX = 'bearer.'
+
+class TokenCache:
+    """Small LRU of already verified access tokens, dropped at expiry."""
+
+    def __init__(self, size=4096):
+        self.size = size
+        self._tokens = OrderedDict()
+
+    def get(self, raw):
+        entry = self._tokens.get(raw)
+        if entry is None:
+            return None
+        if entry[0] <= time():
+            del self._tokens[raw]
+            return None
+        self._tokens.move_to_end(raw)
+        return entry[1]
+
+    def set(self, raw, expires, identity):
+        self._tokens[raw] = (expires, identity)
+        self._tokens.move_to_end(raw)
+        if len(self._tokens) > self.size:
+            self._tokens.popitem(last=False)
+
+token_cache = TokenCache()
+
+def decode_access_token(raw):
+    """Return ``(user_id, wallet)`` for a valid access token, or None.
+
+    The signature and expiry are checked locally, the database is never hit.
+    """
+    identity = token_cache.get(raw)
+    if identity is not None:
+        return identity
+    try:
+        token = AccessToken(raw)
+    except TokenError:
+        return None
+    identity = (str(token[api_settings.USER_ID_CLAIM]), token.get('wallet'))
+    token_cache.set(raw, token['exp'], identity)
+    return identity
+
+def get_raw_token(scope):
+    for subprotocol in scope.get('subprotocols', []):
+        if subprotocol.startswith(TOKEN_SUBPROTOCOL_PREFIX):
+            return subprotocol[len(TOKEN_SUBPROTOCOL_PREFIX):]
+    query = parse_qs(scope.get('query_string', b'').decode())
+    return query.get('token', [None])[0]
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """Binds ``user_id`` and ``wallet`` from the simplejwt access token to the scope.
+
+    Both are None when the token is missing or invalid; consumers decide
+    whether to reject the connection.
+    """
+
+    async def __call__(self, scope, receive, send):
+        raw = get_raw_token(scope)
+        identity = decode_access_token(raw) if raw else None
+        scope = dict(scope)
+        scope['user_id'], scope['wallet'] = identity or (None, None)
+        return await super().__call__(scope, receive, send)
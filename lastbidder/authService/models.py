@@ -1,3 +1,4 @@
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.db import models
 
@@ -11,6 +12,11 @@ class CustomUserManager(BaseUserManager):
         user.save(using=self._db)
         return user
 
+    def get_or_create_wallet(self, wallet):
+        # Wallet users never log in with a password: store an unusable one
+        # instead of running the password hasher, and upsert in one query
+        return self.get_or_create(wallet=wallet, defaults={'password': make_password(None)})
+
     def create_superuser(self, wallet, password=None, **extra_fields):
         extra_fields.setdefault('is_staff', True)
         extra_fields.setdefault('is_superuser', True)
@@ -0,0 +1,19 @@
+import logging
+from django.core.cache import caches
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import CustomUser
+from .views import WALLET_CACHE, WALLET_CACHE_KEY
+
+logger = logging.getLogger(__name__)
+
+@receiver(post_save, sender=CustomUser)
+def forget_wallet(sender, instance, **kwargs):
+    # Logins served from the wallet cache never read the user: drop the entry
+    # on every save so a deactivated account is looked up (and refused) again,
+    # by every worker
+    try:
+        caches[WALLET_CACHE].delete(WALLET_CACHE_KEY % instance.wallet.lower())
+    except Exception:
+        # The save stands; the entry lapses after WALLET_CACHE_TTL anyway
+        logger.exception("wallet cache invalidation failed", extra={"user": instance.pk})
@@ -0,0 +1,93 @@
+"""
+Sign-In with Ethereum style challenge/response for wallet logins.
+
+The server issues a single-use nonce embedded in a message, the wallet signs
+it with ``personal_sign`` and the server recovers the signer address. Public
+key recovery is CPU bound, so it runs in a bounded process pool; async
+callers await it without holding a thread.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import secrets
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.cache import caches
+from eth_account import Account
+from eth_account.messages import encode_defunct
+
+NONCE_CACHE_KEY = 'siwe_nonce:%s'
+NONCE_TTL = 300  # seconds a challenge stays valid
+
+MESSAGE_TEMPLATE = (
+    "LastBidder wants you to sign in with your Ethereum account:\n"
+    "{wallet}\n\n"
+    "Nonce: {nonce}\n"
+    "Issued At: {issued_at}"
+)
+
+def issue_nonce(wallet):
+    """Create a challenge for ``wallet`` and return ``(nonce, message)``."""
+    nonce = secrets.token_hex(16)
+    issued_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    message = MESSAGE_TEMPLATE.format(wallet=wallet, nonce=nonce, issued_at=issued_at)
+    caches['nonces'].set(NONCE_CACHE_KEY % nonce, (wallet.lower(), message), NONCE_TTL)
+    return nonce, message
+
+def consume_nonce(nonce):
+    """Return ``(wallet, message)`` for ``nonce`` and invalidate it, or None.
+
+    Only the caller whose delete succeeds gets the challenge, so a nonce can
+    never be used twice even under concurrent requests.
+    """
+    store = caches['nonces']
+    key = NONCE_CACHE_KEY % nonce
+    challenge = store.get(key)
+    if challenge is None or not store.delete(key):
+        return None
+    return challenge
+
+async def aconsume_nonce(nonce):
+    """Async :func:`consume_nonce`."""
+    store = caches['nonces']
+    key = NONCE_CACHE_KEY % nonce
+    challenge = await store.aget(key)
+    if challenge is None or not await store.adelete(key):
+        return None
+    return challenge
+
+def recover_signer(message, signature):
+    """Address that produced ``signature`` over ``message``, or None."""
+    try:
+        return Account.recover_message(encode_defunct(text=message), signature=signature)
+    except Exception:
+        return None
+
+def _verify(item):
+    wallet, message, signature = item
+    signer = recover_signer(message, signature)
+    return signer is not None and signer.lower() == wallet.lower()
+
+_pool = None
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        workers = getattr(settings, 'WALLET_AUTH_WORKERS', None) or os.cpu_count()
+        # spawn: the server process runs threads and an event loop, never fork it
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+def verify(wallet, message, signature):
+    """Check that ``wallet`` signed ``message``, off the calling thread."""
+    return get_pool().submit(_verify, (wallet, message, signature)).result()
+
+async def averify(wallet, message, signature):
+    """Async :func:`verify`: the event loop keeps serving while the pool works."""
+    return await asyncio.wrap_future(get_pool().submit(_verify, (wallet, message, signature)))
+
+def verify_batch(items, chunksize=64):
+    """Verify many ``(wallet, message, signature)`` triples, in order."""
+    return list(get_pool().map(_verify, items, chunksize=chunksize))
@@ -1,3 +1,211 @@
-from django.test import TestCase
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from time import time
+from unittest import mock
+from channels.testing import WebsocketCommunicator
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from eth_account import Account
+from eth_account.messages import encode_defunct
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from lastbidder.asgi import application
+from lastbidder.lobby.leaderboard import InMemoryLeaderboard
+from lastbidder.lobby.presence import InMemoryPresence
+from lastbidder.lobby.service import service
+from .middleware import JWTAuthMiddleware, TokenCache, decode_access_token, token_cache
+from .models import CustomUser
+from .siwe import issue_nonce
 
-# Create your tests here.
+LOCAL_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-default'},
+    'nonces': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-nonces'},
+}
+
+
+def access_token(user_id=1, wallet='0xabc', lifetime=None):
+    token = AccessToken()
+    token[api_settings.USER_ID_CLAIM] = user_id
+    token['wallet'] = wallet
+    if lifetime is not None:
+        token.set_exp(lifetime=lifetime)
+    return str(token)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class ConnectViewTests(TestCase):
+    def setUp(self):
+        # Recover signatures in threads, a process pool is slow to start
+        pool = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(pool.shutdown)
+        patcher = mock.patch('lastbidder.authService.siwe.get_pool', return_value=pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.account = Account.create()
+
+    def login(self, account=None):
+        account = account or self.account
+        nonce, message = issue_nonce(self.account.address)
+        signature = account.sign_message(encode_defunct(text=message)).signature.hex()
+        return {'walletAddress': self.account.address, 'nonce': nonce, 'signature': signature}
+
+    async def connect(self, payload):
+        return await self.async_client.post('/auth/connect/', payload, content_type='application/json')
+
+    async def test_signed_nonce_logs_in(self):
+        response = await self.connect(self.login())
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json())
+        self.assertEqual(response.json()['message'], 'User registered successfully.')
+        # The second login is served from the wallet cache
+        response = await self.connect(self.login())
+        self.assertEqual(response.json()['message'], 'User logged in successfully.')
+        self.assertEqual(await CustomUser.objects.filter(wallet=self.account.address.lower()).acount(), 1)
+
+    async def test_wallet_case_does_not_make_another_account(self):
+        payload = self.login()
+        user_id = (await self.connect(payload)).json()['userId']
+        for cached in (True, False):
+            if not cached:
+                await caches['nonces'].aclear()
+            payload = self.login()
+            payload['walletAddress'] = self.account.address.lower()
+            response = await self.connect(payload)
+            self.assertEqual(response.json()['userId'], user_id)
+            self.assertEqual(response.json()['message'], 'User logged in successfully.')
+        self.assertEqual(await CustomUser.objects.acount(), 1)
+
+    async def test_existing_lowercase_account_is_reused(self):
+        # Accounts registered before logins were signed are stored lowercase
+        user = await CustomUser.objects.acreate(wallet=self.account.address.lower())
+        response = await self.connect(self.login())
+        self.assertEqual(response.json()['userId'], str(user.id))
+        self.assertEqual(response.json()['message'], 'User logged in successfully.')
+        self.assertEqual(await CustomUser.objects.acount(), 1)
+
+    def test_user_save_survives_a_cache_error(self):
+        with mock.patch('lastbidder.authService.signals.caches') as caches_:
+            caches_.__getitem__.return_value.delete.side_effect = ConnectionError('redis down')
+            with self.assertLogs('lastbidder.authService.signals', 'ERROR'):
+                CustomUser.objects.create(wallet='0xabc')
+        self.assertTrue(CustomUser.objects.filter(wallet='0xabc').exists())
+
+    async def test_nonce_is_single_use(self):
+        payload = self.login()
+        self.assertEqual((await self.connect(payload)).status_code, 200)
+        self.assertEqual((await self.connect(payload)).status_code, 400)
+
+    async def test_signature_from_another_wallet_is_refused(self):
+        response = await self.connect(self.login(Account.create()))
+        self.assertEqual(response.status_code, 401)
+
+    async def test_bad_requests(self):
+        self.assertEqual((await self.connect({'walletAddress': 'nope'})).status_code, 400)
+        response = await self.async_client.post('/auth/connect/', 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_deactivated_account_is_refused(self):
+        self.assertEqual((await self.connect(self.login())).status_code, 200)
+        user = await CustomUser.objects.aget(wallet=self.account.address.lower())
+        user.is_active = False
+        # Saving drops the cached login, so the account is read again
+        await user.asave()
+        response = await self.connect(self.login())
+        self.assertEqual(response.status_code, 403)
+
+
+class JWTAuthMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        self.scopes = []
+        self.addCleanup(token_cache._tokens.clear)
+
+    async def app(self, scope, receive, send):
+        self.scopes.append(scope)
+        await receive()
+        await send({'type': 'websocket.close', 'code': 1000})
+
+    async def identity(self, path='/lobby', subprotocols=None):
+        communicator = WebsocketCommunicator(JWTAuthMiddleware(self.app), path, subprotocols=subprotocols)
+        await communicator.connect()
+        scope = self.scopes.pop()
+        return scope['user_id'], scope['wallet']
+
+    async def test_token_in_subprotocol(self):
+        token = access_token(7, '0x77')
+        identity = await self.identity(subprotocols=['lastbidder.json', 'bearer.' + token])
+        self.assertEqual(identity, ('7', '0x77'))
+
+    async def test_token_in_query_string(self):
+        self.assertEqual(await self.identity('/lobby?token=' + access_token(7, '0x77')), ('7', '0x77'))
+
+    async def test_bad_or_missing_token_is_anonymous(self):
+        expired = access_token(lifetime=-timedelta(minutes=1))
+        # A valid header and payload under the signature of another token
+        forged = access_token(2).rsplit('.', 1)[0] + '.' + access_token(3).rsplit('.', 1)[1]
+        for path in ('/lobby?token=' + expired, '/lobby?token=' + forged, '/lobby?token=junk', '/lobby'):
+            self.assertEqual(await self.identity(path), (None, None))
+
+    def test_verified_tokens_are_cached(self):
+        token = access_token(7, '0x77')
+        with mock.patch('lastbidder.authService.middleware.AccessToken', wraps=AccessToken) as decode:
+            self.assertEqual(decode_access_token(token), ('7', '0x77'))
+            self.assertEqual(decode_access_token(token), ('7', '0x77'))
+        self.assertEqual(decode.call_count, 1)
+
+    def test_cache_drops_expired_and_least_recent_tokens(self):
+        cache = TokenCache(size=2)
+        cache.set('old', time() - 1, ('1', None))
+        self.assertIsNone(cache.get('old'))
+        cache.set('a', time() + 60, ('1', None))
+        cache.set('b', time() + 60, ('2', None))
+        cache.get('a')
+        cache.set('c', time() + 60, ('3', None))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), ('1', None))
+
+
+class AsgiImportTests(SimpleTestCase):
+    def test_application_imports_in_a_fresh_process(self):
+        # The test runner has already set Django up, so import it where
+        # nothing has, the way Daphne does
+        env = {k: v for k, v in os.environ.items() if k != 'DJANGO_SETTINGS_MODULE'}
+        result = subprocess.run([sys.executable, '-c', 'import lastbidder.asgi'],
+            env=env, capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    CACHES=LOCAL_CACHES, LOBBY_CAPTURE='', WEB3_PROVIDER_URL='')
+class LobbyAuthTests(TestCase):
+    def setUp(self):
+        for target, value in (
+            ('lastbidder.lobby.presence._presence', InMemoryPresence()),
+            ('lastbidder.lobby.leaderboard._leaderboard', InMemoryLeaderboard()),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def communicator(self, path='/lobby', subprotocols=None):
+        return WebsocketCommunicator(application, path, subprotocols=subprotocols)
+
+    async def test_bad_or_missing_token_is_refused(self):
+        expired = access_token(lifetime=-timedelta(minutes=1))
+        forged = access_token(2).rsplit('.', 1)[0] + '.' + access_token(3).rsplit('.', 1)[1]
+        for path in ('/lobby?token=' + expired, '/lobby?token=' + forged, '/lobby'):
+            self.assertEqual(await self.communicator(path).connect(), (False, 4401))
+
+    async def test_token_subprotocol_is_never_accepted(self):
+        token = 'bearer.' + access_token(7, '0x77')
+        try:
+            for offered, accepted in ((['lastbidder.json', token], 'lastbidder.json'), ([token], None)):
+                communicator = self.communicator(subprotocols=offered)
+                connected, subprotocol = await communicator.connect()
+                self.assertTrue(connected)
+                self.assertEqual(subprotocol, accepted)
+                await communicator.disconnect()
+        finally:
+            await service.shutdown()
@@ -1,6 +1,8 @@
 from django.urls import path
-from .views import ConnectView
+from .views import ConnectView, LeaderboardView, NonceView
 
 urlpatterns = [
+    path('nonce/', NonceView.as_view(), name='nonce'),  # Challenge to sign before connecting
     path('connect/', ConnectView.as_view(), name='connect'),  # Single endpoint for MetaMask connection
+    path('leaderboard/', LeaderboardView.as_view(), name='leaderboard'),  # Biggest winners, ?board=wins|prizes
 ]
@@ -1,59 +1,140 @@
-from django.shortcuts import render
+import json
+from channels.db import database_sync_to_async
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import AllowAny
 from .models import CustomUser
 from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework.exceptions import AuthenticationFailed
 from web3 import Web3
 from django.http import JsonResponse
-from eth_account import Account
+from django.core.cache import cache, caches
 from lastbidder import shared_data
+from lastbidder.lobby.leaderboard import BOARDS, get_leaderboard
+from .siwe import issue_nonce, aconsume_nonce, averify
 
 w3 = Web3()
 
-class ConnectView(APIView):
+# wallet -> user id of an active account, so repeated logins skip the
+# database; saving the user drops the entry (see signals.py). Kept in the
+# Redis cache shared with the nonces, so the drop reaches every worker
+WALLET_CACHE = 'nonces'
+WALLET_CACHE_KEY = 'wallet_user:%s'
+WALLET_CACHE_TTL = 300
+
+# Top of a board, shared by every visitor for a few seconds
+LEADERBOARD_CACHE_KEY = 'leaderboard:%s:%d'
+LEADERBOARD_CACHE_TTL = 5
+LEADERBOARD_MAX_LIMIT = 100
+
+class NonceView(APIView):
     permission_classes = [AllowAny]
 
     def post(self, request):
-        data = request.data
+        wallet = request.data.get('walletAddress')
+
+        if not wallet or not Web3.is_address(wallet):
+            return Response({'error': 'A valid wallet is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        wallet = Web3.to_checksum_address(wallet)
+
+        # Challenge the wallet has to personal_sign before calling connect/
+        nonce, message = issue_nonce(wallet)
+        return Response({'nonce': nonce, 'message': message}, status=status.HTTP_200_OK)
+
+# A plain async view rather than a DRF one: under ASGI a sync view holds a
+# thread-sensitive thread while the signature is recovered, which serializes
+# every login. This one awaits the recovery pool on the event loop.
+@method_decorator(csrf_exempt, name='dispatch')
+class ConnectView(View):
+
+    async def post(self, request):
+        try:
+            data = json.loads(request.body) if request.content_type == 'application/json' else request.POST
+        except ValueError:
+            return JsonResponse({'error': 'Invalid JSON.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Wallet  is required.'}, status=status.HTTP_400_BAD_REQUEST)
         wallet = data.get('walletAddress')
         
         if not wallet :
-            return Response({'error': 'Wallet  is required.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        #if not Account.is_address(wallet):
-        #    return JsonResponse({'success': False, 'message': 'Invalid wallet address'}, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse({'error': 'Wallet  is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        #try:
-        #    # Hash the message as Ethereum does with personal_sign
-        #    message_hash = Account.HashMessage(text=message)
+        if not isinstance(wallet, str) or not Web3.is_address(wallet):
+            return JsonResponse({'error': 'Invalid wallet address.'}, status=status.HTTP_400_BAD_REQUEST)
+        # One spelling per wallet for the cache key, the account and the token,
+        # whatever case the client sent: lowercase, as the stored accounts,
+        # the ledger, the leaderboard and the indexer all use
+        wallet = wallet.lower()
 
-        #    # Recover the address from the signature
-        #    recovered_address = Account.recoverHash(message_hash, signature=signature)
+        nonce = data.get('nonce')
+        signature = data.get('signature')
+        if not isinstance(nonce, str) or not isinstance(signature, str) or not nonce or not signature:
+            return JsonResponse({'error': 'Nonce and signature are required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        #    # Check if the recovered address matches the one sent by the client
-        #    if recovered_address.lower() != wallet.lower():
-        #        return JsonResponse({'success': False, 'message': 'Signature mismatch'}, status=status.HTTP_400_BAD_REQUEST)
+        # The challenge is single use: it is gone even if verification fails
+        challenge = await aconsume_nonce(nonce)
+        if challenge is None or challenge[0] != wallet:
+            return JsonResponse({'error': 'Unknown or expired nonce.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        #except Exception as e:
-        #    return JsonResponse({'success': False, 'message': f'Error verifying signature: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if not await averify(wallet, challenge[1], signature):
+            return JsonResponse({'error': 'Signature mismatch.'}, status=status.HTTP_401_UNAUTHORIZED)
 
-        # Check if the wallet address is already registered
-        user = CustomUser.objects.filter(wallet=wallet).first()
+        # Repeated logins are served from the cache, new wallets are registered
+        user_id = await caches[WALLET_CACHE].aget(WALLET_CACHE_KEY % wallet)
+        created = False
+        if user_id is None:
+            user, created = await database_sync_to_async(CustomUser.objects.get_or_create_wallet)(wallet)
+            if not user.is_active:
+                return JsonResponse({'error': 'Account disabled.'}, status=status.HTTP_403_FORBIDDEN)
+            user_id = user.id
+            await caches[WALLET_CACHE].aset(WALLET_CACHE_KEY % wallet, user_id, WALLET_CACHE_TTL)
+        else:
+            user = CustomUser(id=user_id, wallet=wallet)
 
-        if user is None:
-            # Register the user if not already registered
-            user = CustomUser.objects.create_user(wallet=wallet, password='defaultpassword')
-        
-        shared_data[user.id] = wallet
+        shared_data[user_id] = wallet
 
         # Generate JWT tokens
         refresh = RefreshToken.for_user(user)
-        return Response({
+        refresh['wallet'] = wallet  # Read back by the websocket JWT middleware
+        return JsonResponse({
             'refresh': str(refresh),
             'access': str(refresh.access_token),
-            'userId': str(user.id),
-            'message': 'User logged in successfully.' if user else 'User registered successfully.'
+            'userId': str(user_id),
+            'message': 'User registered successfully.' if created else 'User logged in successfully.'
         }, status=status.HTTP_200_OK)
+
+class LeaderboardView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        board = request.query_params.get('board', 'wins')
+        if board not in BOARDS:
+            return Response({'error': 'Unknown board.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= LEADERBOARD_MAX_LIMIT:
+            return Response({'error': f'Limit must be between 1 and {LEADERBOARD_MAX_LIMIT}.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        leaderboard = get_leaderboard()
+        key = LEADERBOARD_CACHE_KEY % (board, limit)
+        top = cache.get(key)
+        if top is None:
+            top = [
+                {'rank': rank, 'wallet': wallet, 'score': score}
+                for rank, (wallet, score) in enumerate(leaderboard.top(board, limit), 1)
+            ]
+            cache.set(key, top, LEADERBOARD_CACHE_TTL)
+        data = {'board': board, 'top': top}
+
+        # The caller's own position is a single O(log n) lookup, not cached
+        wallet = request.query_params.get('wallet')
+        if wallet:
+            ranked = leaderboard.rank(board, wallet.lower())
+            data['wallet'] = {'wallet': wallet.lower(), 'rank': ranked[0], 'score': ranked[1]} if ranked else None
+        return Response(data, status=status.HTTP_200_OK)
@@ -0,0 +1,62 @@
+"""
+Events and calls of the LastBidderWin contract (smart-contracts/LastBidderWin.sol).
+"""
+
+from functools import lru_cache
+from eth_abi import decode, encode
+from web3 import Web3
+
+# name -> ((argument, type, indexed), ...), in declaration order
+EVENTS = {
+    'TicketsPurchased': (('buyer', 'address', True), ('amount', 'uint256', False)),
+    'ClockCreated': (('clockId', 'uint256', True), ('prize', 'uint256', False)),
+    'ParticipationRecorded': (('clockId', 'uint256', True), ('participant', 'address', True)),
+    'ClockFinalized': (('clockId', 'uint256', True), ('winner', 'address', False), ('prize', 'uint256', False)),
+}
+
+@lru_cache(maxsize=None)
+def topic(name):
+    """Topic 0 of event ``name``."""
+    signature = '%s(%s)' % (name, ','.join(kind for _, kind, _ in EVENTS[name]))
+    return Web3.to_hex(Web3.keccak(text=signature))
+
+@lru_cache(maxsize=None)
+def topics():
+    """Topic 0 -> event name, for every contract event."""
+    return {topic(name): name for name in EVENTS}
+
+def _hex(value):
+    if isinstance(value, (bytes, bytearray)):
+        return '0x' + bytes(value).hex()
+    value = value.lower()
+    return value if value.startswith('0x') else '0x' + value
+
+def _decode_topic(kind, value):
+    word = int(_hex(value), 16)
+    if kind == 'address':
+        return Web3.to_checksum_address('0x%040x' % word)
+    return word
+
+def decode_log(log):
+    """Return ``(event name, args)`` for a raw JSON-RPC log, or None if unknown."""
+    if not log.get('topics'):
+        return None
+    name = topics().get(_hex(log['topics'][0]))
+    if name is None:
+        return None
+    indexed = [arg for arg in EVENTS[name] if arg[2]]
+    plain = [arg for arg in EVENTS[name] if not arg[2]]
+    args = {
+        arg: _decode_topic(kind, value)
+        for (arg, kind, _), value in zip(indexed, log['topics'][1:])
+    }
+    if plain:
+        values = decode([kind for _, kind, _ in plain], bytes.fromhex(_hex(log['data'])[2:]))
+        for (arg, kind, _), value in zip(plain, values):
+            args[arg] = Web3.to_checksum_address(value) if kind == 'address' else value
+    return name, args
+
+def encode_call(name, types, values):
+    """Calldata, as 0x hex, of calling ``name(types...)`` with ``values``."""
+    selector = Web3.keccak(text='%s(%s)' % (name, ','.join(types)))[:4]
+    return '0x' + (bytes(selector) + encode(list(types), list(values))).hex()
@@ -0,0 +1,31 @@
+from django.contrib import admin
+from .models import TicketPurchase, ClockCreation, Participation, ClockFinalization, IndexerCheckpoint, PendingTx
+
+@admin.register(TicketPurchase)
+class TicketPurchaseAdmin(admin.ModelAdmin):
+    list_display = ('buyer', 'amount', 'block_number')
+    search_fields = ('buyer',)
+
+@admin.register(ClockCreation)
+class ClockCreationAdmin(admin.ModelAdmin):
+    list_display = ('clock_id', 'prize', 'block_number')
+
+@admin.register(Participation)
+class ParticipationAdmin(admin.ModelAdmin):
+    list_display = ('clock_id', 'participant', 'block_number')
+    search_fields = ('participant',)
+
+@admin.register(ClockFinalization)
+class ClockFinalizationAdmin(admin.ModelAdmin):
+    list_display = ('clock_id', 'winner', 'prize', 'block_number')
+    search_fields = ('winner',)
+
+@admin.register(IndexerCheckpoint)
+class IndexerCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('contract', 'block_number', 'updated_at')
+
+@admin.register(PendingTx)
+class PendingTxAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'clock_id', 'status', 'nonce', 'gas_price', 'attempts', 'tx_hash', 'created_at')
+    list_filter = ('kind', 'status')
+    search_fields = ('tx_hash',)
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+class ChainConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'lastbidder.chain'
+
+    def ready(self):
+        # Settles on chain the rounds the lobby closes
+        from . import settlement  # noqa: F401
@@ -0,0 +1,173 @@
+from channels.db import database_sync_to_async
+from django.db import transaction
+from lastbidder.lobby.leaderboard import get_leaderboard
+from .abi import decode_log, topics
+from .models import TicketPurchase, ClockCreation, Participation, ClockFinalization, IndexerCheckpoint
+from .rpc import RpcError
+
+# event -> (model, {event argument: model field})
+EVENT_MODELS = {
+    'TicketsPurchased': (TicketPurchase, {'buyer': 'buyer', 'amount': 'amount'}),
+    'ClockCreated': (ClockCreation, {'clockId': 'clock_id', 'prize': 'prize'}),
+    'ParticipationRecorded': (Participation, {'clockId': 'clock_id', 'participant': 'participant'}),
+    'ClockFinalized': (ClockFinalization, {'clockId': 'clock_id', 'winner': 'winner', 'prize': 'prize'}),
+}
+
+def to_row(log):
+    """Build the unsaved model instance for a raw log, or None if it is not ours."""
+    event = decode_log(log)
+    if event is None or log.get('removed'):
+        return None
+    name, args = event
+    model, fields = EVENT_MODELS[name]
+    values = {
+        field: args[arg].lower() if isinstance(args[arg], str) else args[arg]
+        for arg, field in fields.items()
+    }
+    return model(
+        block_number=int(log['blockNumber'], 16),
+        block_hash=log['blockHash'],
+        tx_hash=log['transactionHash'],
+        log_index=int(log['logIndex'], 16),
+        **values,
+    )
+
+class ChainIndexer:
+    """Copies LastBidderWin logs into the database, one block range at a time.
+
+    Each :meth:`step` asks the node for ``ranges_per_call`` consecutive ranges
+    of ``batch_blocks`` blocks in one batched ``eth_getLogs`` request, then
+    stores the events and the new checkpoint in a single transaction, so a
+    restarted indexer resumes where it stopped and replaying a range is a
+    no-op. Only blocks ``confirmations`` deep are indexed; if the checkpoint
+    block is no longer on the chain, at least the last ``reorg_depth`` blocks
+    are rolled back and indexed again. Prizes of new and rolled back
+    ``ClockFinalized`` events are applied to the leaderboard.
+    """
+
+    def __init__(self, rpc, contract_address, start_block=0, batch_blocks=2000, ranges_per_call=4,
+                 confirmations=2, reorg_depth=64):
+        self.rpc = rpc
+        self.contract_address = contract_address.lower()
+        self.start_block = start_block
+        self.batch_blocks = batch_blocks
+        self.ranges_per_call = ranges_per_call
+        self.confirmations = confirmations
+        self.reorg_depth = reorg_depth
+
+    def checkpoint(self):
+        return IndexerCheckpoint.objects.filter(contract=self.contract_address).first()
+
+    async def head(self):
+        return int(await self.rpc.call('eth_blockNumber', []), 16) - self.confirmations
+
+    async def block_hash(self, number):
+        block = await self.rpc.call('eth_getBlockByNumber', [hex(number), False])
+        return block['hash'] if block else None
+
+    async def step(self):
+        """Index the next ranges; returns the number of blocks covered, 0 when caught up."""
+        checkpoint = await database_sync_to_async(self.checkpoint)()
+        if checkpoint is not None:
+            if await self.block_hash(checkpoint.block_number) != checkpoint.block_hash:
+                await self.rollback(checkpoint.block_number)
+                return await self.step()
+            start = checkpoint.block_number + 1
+        else:
+            start = self.start_block
+        head = await self.head()
+        if start > head:
+            return 0
+
+        ranges = []
+        low = start
+        while low <= head and len(ranges) < self.ranges_per_call:
+            high = min(low + self.batch_blocks - 1, head)
+            ranges.append((low, high))
+            low = high + 1
+        query = {'address': self.contract_address, 'topics': [list(topics())]}
+        calls = [('eth_getLogs', [dict(query, fromBlock=hex(low), toBlock=hex(high))]) for low, high in ranges]
+        calls.append(('eth_getBlockByNumber', [hex(ranges[-1][1]), False]))
+        *results, last_block = await self.rpc.batch(calls)
+
+        logs, end = [], None
+        for (low, high), result in zip(ranges, results):
+            if isinstance(result, RpcError):
+                break
+            logs.extend(result)
+            end = high
+        if end is None:
+            # Usually "too many results": retry with smaller ranges
+            if self.batch_blocks == 1:
+                raise results[0]
+            self.batch_blocks = max(1, self.batch_blocks // 2)
+            return await self.step()
+        if end == ranges[-1][1] and last_block and not isinstance(last_block, RpcError):
+            end_hash = last_block['hash']
+        else:
+            end_hash = await self.block_hash(end)
+
+        rows = [row for row in map(to_row, logs) if row is not None]
+        await database_sync_to_async(self.store)(rows, end, end_hash)
+        return end - start + 1
+
+    def store(self, rows, block_number, block_hash):
+        by_model = {}
+        for row in rows:
+            by_model.setdefault(type(row), []).append(row)
+        finalized = by_model.get(ClockFinalization, [])
+        with transaction.atomic():
+            if finalized:
+                # Only prizes not stored yet go to the leaderboard, so replays stay no-ops
+                stored = set(ClockFinalization.objects.filter(
+                    tx_hash__in={row.tx_hash for row in finalized},
+                ).values_list('tx_hash', 'log_index'))
+                finalized = [row for row in finalized if (row.tx_hash, row.log_index) not in stored]
+            for model, objs in by_model.items():
+                model.objects.bulk_create(objs, batch_size=1000, ignore_conflicts=True)
+            IndexerCheckpoint.objects.update_or_create(
+                contract=self.contract_address,
+                defaults={'block_number': block_number, 'block_hash': block_hash},
+            )
+        self.update_leaderboard(finalized, 1)
+
+    def update_leaderboard(self, finalized, sign):
+        leaderboard = get_leaderboard()
+        for row in finalized:
+            leaderboard.add('prizes', row.winner, sign * int(row.prize))
+
+    def latest_event(self, block_number):
+        """Most recent stored event at or below ``block_number``."""
+        events = [
+            model.objects.filter(block_number__lte=block_number).order_by('-block_number').first()
+            for model, _ in EVENT_MODELS.values()
+        ]
+        return max(filter(None, events), key=lambda event: event.block_number, default=None)
+
+    async def rollback(self, block_number):
+        """Forget everything above the last block still on the chain.
+
+        Starts ``reorg_depth`` blocks back and keeps going back while the
+        stored events below that point belong to orphaned blocks.
+        """
+        keep = block_number - self.reorg_depth
+        while keep >= self.start_block:
+            event = await database_sync_to_async(self.latest_event)(keep)
+            if event is None or await self.block_hash(event.block_number) == event.block_hash:
+                break
+            keep = event.block_number - 1
+        keep_hash = await self.block_hash(keep) if keep >= self.start_block else None
+        await database_sync_to_async(self._rollback)(keep, keep_hash)
+
+    def _rollback(self, keep, keep_hash):
+        orphaned = list(ClockFinalization.objects.filter(block_number__gt=keep))
+        with transaction.atomic():
+            for model, _ in EVENT_MODELS.values():
+                model.objects.filter(block_number__gt=keep).delete()
+            if keep_hash is None:
+                IndexerCheckpoint.objects.filter(contract=self.contract_address).delete()
+            else:
+                IndexerCheckpoint.objects.filter(contract=self.contract_address).update(
+                    block_number=keep, block_hash=keep_hash,
+                )
+        self.update_leaderboard(orphaned, -1)
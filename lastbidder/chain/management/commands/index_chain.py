@@ -0,0 +1,58 @@
+import asyncio
+import time
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from lastbidder.chain.indexer import ChainIndexer
+from lastbidder.chain.rpc import JsonRpcClient
+
+class Command(BaseCommand):
+    help = 'Index LastBidderWin events into the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from-block', type=int, default=settings.CHAIN_START_BLOCK,
+                            help='First block to index when there is no checkpoint yet')
+        parser.add_argument('--batch-blocks', type=int, default=2000)
+        parser.add_argument('--ranges-per-call', type=int, default=4)
+        parser.add_argument('--confirmations', type=int, default=2)
+        parser.add_argument('--reorg-depth', type=int, default=64)
+        parser.add_argument('--follow', action='store_true', help='Keep polling for new blocks')
+        parser.add_argument('--poll-interval', type=float, default=2.0)
+
+    def handle(self, *args, **options):
+        address = settings.CONTRACT_ADDRESS
+        # The zero address is the placeholder of .env, as for the receipt verifier
+        if not settings.WEB3_PROVIDER_URL or not address or not int(address, 16):
+            raise CommandError('WEB3_PROVIDER_URL and CONTRACT_ADDRESS must be set')
+        asyncio.run(self.index(options))
+
+    async def index(self, options):
+        rpc = JsonRpcClient(settings.WEB3_PROVIDER_URL)
+        indexer = ChainIndexer(
+            rpc, settings.CONTRACT_ADDRESS,
+            start_block=options['from_block'],
+            batch_blocks=options['batch_blocks'],
+            ranges_per_call=options['ranges_per_call'],
+            confirmations=options['confirmations'],
+            reorg_depth=options['reorg_depth'],
+        )
+        blocks = 0
+        start = time.perf_counter()
+        try:
+            while True:
+                indexed = await indexer.step()
+                blocks += indexed
+                if indexed:
+                    continue
+                elapsed = max(time.perf_counter() - start, 1e-9)
+                checkpoint = await database_sync_to_async(indexer.checkpoint)()
+                self.stdout.write(
+                    f'at block {checkpoint.block_number if checkpoint else "-"}: '
+                    f'{blocks} blocks in {elapsed:.1f}s ({blocks / elapsed:.0f} blocks/s)'
+                )
+                if not options['follow']:
+                    break
+                await asyncio.sleep(options['poll_interval'])
+                blocks, start = 0, time.perf_counter()
+        finally:
+            await rpc.close()
@@ -0,0 +1,55 @@
+import asyncio
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from lastbidder.chain.abi import encode_call
+from lastbidder.chain.models import PendingTx
+from lastbidder.chain.submitter import get_submitter
+
+class Command(BaseCommand):
+    help = 'Sign and send the queued backend transactions (finalizeClock, prize mints)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--finalize', type=int, action='append', default=[], metavar='CLOCK_ID',
+                            help='Queue finalizeClock for this clock first, repeatable')
+        parser.add_argument('--follow', action='store_true',
+                            help='Keep sending as rounds queue transactions, instead of stopping once all are mined')
+
+    def handle(self, *args, **options):
+        if get_submitter() is None:
+            raise CommandError('WEB3_PROVIDER_URL and CHAIN_SIGNER_KEY must be set')
+        if options['finalize'] and not settings.CONTRACT_ADDRESS:
+            raise CommandError('CONTRACT_ADDRESS must be set to finalize clocks')
+        PendingTx.objects.bulk_create([
+            PendingTx(kind=PendingTx.FINALIZE, clock_id=clock_id, to=settings.CONTRACT_ADDRESS.lower(),
+                      data=encode_call('finalizeClock', ['uint256'], [clock_id]))
+            for clock_id in options['finalize']
+        ])
+        asyncio.run(self.submit(options))
+
+    async def submit(self, options):
+        submitter = get_submitter()
+        await submitter.sync()
+        self.stdout.write(f'{submitter.address} on chain {submitter.chain_id}, next nonce {submitter.next_nonce}')
+        try:
+            last = None
+            while True:
+                try:
+                    pending = await submitter.step()
+                except Exception as e:
+                    # The node may be restarting: keep the queue and try again
+                    self.stderr.write(f'round failed: {e}')
+                    pending = None
+                counts = await database_sync_to_async(self.counts)()
+                if counts != last:
+                    self.stdout.write(', '.join(f'{status} {count}' for status, count in sorted(counts.items())))
+                    last = counts
+                if pending == 0 and not options['follow']:
+                    break
+                await asyncio.sleep(submitter.interval)
+        finally:
+            await submitter.rpc.close()
+
+    def counts(self):
+        return dict(PendingTx.objects.values_list('status').annotate(count=Count('id')))
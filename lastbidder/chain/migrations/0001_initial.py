@@ -0,0 +1,101 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClockCreation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('block_number', models.BigIntegerField(db_index=True)),
+                ('block_hash', models.CharField(max_length=66)),
+                ('tx_hash', models.CharField(max_length=66)),
+                ('log_index', models.IntegerField()),
+                ('clock_id', models.DecimalField(db_index=True, decimal_places=0, max_digits=78)),
+                ('prize', models.DecimalField(decimal_places=0, max_digits=78)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ClockFinalization',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('block_number', models.BigIntegerField(db_index=True)),
+                ('block_hash', models.CharField(max_length=66)),
+                ('tx_hash', models.CharField(max_length=66)),
+                ('log_index', models.IntegerField()),
+                ('clock_id', models.DecimalField(db_index=True, decimal_places=0, max_digits=78)),
+                ('winner', models.CharField(db_index=True, max_length=42)),
+                ('prize', models.DecimalField(decimal_places=0, max_digits=78)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='IndexerCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('contract', models.CharField(max_length=42, unique=True)),
+                ('block_number', models.BigIntegerField()),
+                ('block_hash', models.CharField(max_length=66)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Participation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('block_number', models.BigIntegerField(db_index=True)),
+                ('block_hash', models.CharField(max_length=66)),
+                ('tx_hash', models.CharField(max_length=66)),
+                ('log_index', models.IntegerField()),
+                ('clock_id', models.DecimalField(db_index=True, decimal_places=0, max_digits=78)),
+                ('participant', models.CharField(db_index=True, max_length=42)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='TicketPurchase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('block_number', models.BigIntegerField(db_index=True)),
+                ('block_hash', models.CharField(max_length=66)),
+                ('tx_hash', models.CharField(max_length=66)),
+                ('log_index', models.IntegerField()),
+                ('buyer', models.CharField(db_index=True, max_length=42)),
+                ('amount', models.DecimalField(decimal_places=0, max_digits=78)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='ticketpurchase',
+            constraint=models.UniqueConstraint(fields=('tx_hash', 'log_index'), name='ticketpurchase_unique_log'),
+        ),
+        migrations.AddConstraint(
+            model_name='participation',
+            constraint=models.UniqueConstraint(fields=('tx_hash', 'log_index'), name='participation_unique_log'),
+        ),
+        migrations.AddConstraint(
+            model_name='clockfinalization',
+            constraint=models.UniqueConstraint(fields=('tx_hash', 'log_index'), name='clockfinalization_unique_log'),
+        ),
+        migrations.AddConstraint(
+            model_name='clockcreation',
+            constraint=models.UniqueConstraint(fields=('tx_hash', 'log_index'), name='clockcreation_unique_log'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chain', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingTx',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('finalize', 'finalizeClock'), ('mint', 'prize mint')], max_length=16)),
+                ('clock_id', models.BigIntegerField(db_index=True)),
+                ('round_id', models.UUIDField(blank=True, null=True)),
+                ('to', models.CharField(max_length=42)),
+                ('data', models.TextField()),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('sent', 'sent'), ('mined', 'mined'), ('reverted', 'reverted'), ('failed', 'failed')], db_index=True, default='queued', max_length=8)),
+                ('sender', models.CharField(blank=True, db_index=True, default='', max_length=42)),
+                ('nonce', models.BigIntegerField(blank=True, null=True)),
+                ('gas', models.BigIntegerField(blank=True, null=True)),
+                ('gas_price', models.DecimalField(blank=True, decimal_places=0, max_digits=78, null=True)),
+                ('tx_hash', models.CharField(blank=True, max_length=66, null=True)),
+                ('hashes', models.TextField(blank=True, default='')),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='pendingtx',
+            constraint=models.UniqueConstraint(fields=('kind', 'round_id'), name='pendingtx_unique_round_call'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chain', '0002_pendingtx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pendingtx',
+            name='kind',
+            field=models.CharField(choices=[('finalize', 'finalizeClock'), ('mint', 'prize mint'), ('filler', 'nonce filler')], max_length=16),
+        ),
+    ]
@@ -0,0 +1,87 @@
+from django.db import models
+
+# uint256 values do not fit in a BigIntegerField
+UINT256_DIGITS = 78
+
+class ChainEvent(models.Model):
+    """A decoded LastBidderWin log, unique by its position in the chain."""
+    block_number = models.BigIntegerField(db_index=True)
+    block_hash = models.CharField(max_length=66)
+    tx_hash = models.CharField(max_length=66)
+    log_index = models.IntegerField()
+
+    class Meta:
+        abstract = True
+        constraints = [
+            models.UniqueConstraint(fields=['tx_hash', 'log_index'], name='%(class)s_unique_log'),
+        ]
+
+class TicketPurchase(ChainEvent):
+    buyer = models.CharField(max_length=42, db_index=True)
+    amount = models.DecimalField(max_digits=UINT256_DIGITS, decimal_places=0)
+
+class ClockCreation(ChainEvent):
+    clock_id = models.DecimalField(max_digits=UINT256_DIGITS, decimal_places=0, db_index=True)
+    prize = models.DecimalField(max_digits=UINT256_DIGITS, decimal_places=0)
+
+class Participation(ChainEvent):
+    clock_id = models.DecimalField(max_digits=UINT256_DIGITS, decimal_places=0, db_index=True)
+    participant = models.CharField(max_length=42, db_index=True)
+
+class ClockFinalization(ChainEvent):
+    clock_id = models.DecimalField(max_digits=UINT256_DIGITS, decimal_places=0, db_index=True)
+    winner = models.CharField(max_length=42, db_index=True)
+    prize = models.DecimalField(max_digits=UINT256_DIGITS, decimal_places=0)
+
+class IndexerCheckpoint(models.Model):
+    """Last block fully indexed for a contract, and its hash to detect reorgs."""
+    contract = models.CharField(max_length=42, unique=True)
+    block_number = models.BigIntegerField()
+    block_hash = models.CharField(max_length=66)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.contract}@{self.block_number}'
+
+class PendingTx(models.Model):
+    """A transaction sent by the backend (lastbidder.chain.submitter), from queued to mined.
+
+    A transaction keeps its nonce once it has one: fee bumps re-sign the same
+    call for the same nonce, ``hashes`` lists every version that was sent.
+    """
+    FINALIZE = 'finalize'
+    MINT = 'mint'
+    FILLER = 'filler'  # Zero-value self-transfer taking a nonce refused by the node, clock 0
+    KINDS = [(FINALIZE, 'finalizeClock'), (MINT, 'prize mint'), (FILLER, 'nonce filler')]
+
+    QUEUED = 'queued'  # No nonce yet
+    SENT = 'sent'  # Signed with a nonce, waiting to be mined
+    MINED = 'mined'
+    REVERTED = 'reverted'  # Mined, but the call failed
+    FAILED = 'failed'  # Never mined: rejected by gas estimation or the node, or the nonce went to another transaction
+    STATUSES = [(status, status) for status in (QUEUED, SENT, MINED, REVERTED, FAILED)]
+
+    kind = models.CharField(max_length=16, choices=KINDS)
+    clock_id = models.BigIntegerField(db_index=True)
+    round_id = models.UUIDField(null=True, blank=True)
+    to = models.CharField(max_length=42)
+    data = models.TextField()  # Calldata, 0x hex
+    status = models.CharField(max_length=8, choices=STATUSES, default=QUEUED, db_index=True)
+    sender = models.CharField(max_length=42, blank=True, default='', db_index=True)  # Account of the nonce
+    nonce = models.BigIntegerField(null=True, blank=True)
+    gas = models.BigIntegerField(null=True, blank=True)
+    gas_price = models.DecimalField(max_digits=UINT256_DIGITS, decimal_places=0, null=True, blank=True)
+    tx_hash = models.CharField(max_length=66, null=True, blank=True)  # Latest version
+    hashes = models.TextField(blank=True, default='')  # Every version, space separated
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)  # None while the node has not accepted it
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'round_id'], name='pendingtx_unique_round_call'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} clock {self.clock_id} ({self.status})'
@@ -0,0 +1,65 @@
+import asyncio
+import itertools
+import aiohttp
+
+class RpcError(Exception):
+    pass
+
+class JsonRpcClient:
+    """Minimal async JSON-RPC client that sends many calls in one request."""
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._ids = itertools.count(1)
+        self._sessions = {}
+
+    def _session(self):
+        # aiohttp sessions are bound to the loop that created them
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(timeout=self.timeout)
+            self._sessions[loop] = session
+        return session
+
+    async def call(self, method, params):
+        result, = await self.batch([(method, params)])
+        if isinstance(result, RpcError):
+            raise result
+        return result
+
+    async def batch(self, calls):
+        """Run ``[(method, params), ...]`` in one HTTP round trip.
+
+        Results come back in the order of ``calls``; a call that failed is
+        returned as an :class:`RpcError` instead of raising.
+        """
+        if not calls:
+            return []
+        payload = [
+            {'jsonrpc': '2.0', 'id': next(self._ids), 'method': method, 'params': params}
+            for method, params in calls
+        ]
+        async with self._session().post(self.url, json=payload) as response:
+            response.raise_for_status()
+            replies = await response.json(content_type=None)
+        if isinstance(replies, dict):
+            # Some nodes answer a failed batch with a single error object
+            raise RpcError(replies.get('error'))
+        by_id = {reply.get('id'): reply for reply in replies}
+        results = []
+        for request in payload:
+            reply = by_id.get(request['id'])
+            if reply is None:
+                results.append(RpcError('missing reply'))
+            elif 'error' in reply:
+                results.append(RpcError(reply['error']))
+            else:
+                results.append(reply.get('result'))
+        return results
+
+    async def close(self):
+        sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            await session.close()
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.dispatch import receiver
+from web3 import Web3
+from lastbidder.lobby.signals import rounds_closed
+from .abi import encode_call
+from .models import ClockCreation, ClockFinalization, PendingTx
+
+def contract_configured(address):
+    return bool(address) and int(address, 16) != 0
+
+def open_clocks(clock_ids):
+    """The ids among ``clock_ids`` that finalizeClock can still settle.
+
+    LastBidderWin only knows the clocks it created, and finalizes each of
+    them once: a clock qualifies with an indexed ``ClockCreated``, no
+    ``ClockFinalized`` and no finalizeClock already queued, sent or mined.
+    """
+    created = ClockCreation.objects.filter(clock_id__in=clock_ids).values_list('clock_id', flat=True)
+    finalized = ClockFinalization.objects.filter(clock_id__in=clock_ids).values_list('clock_id', flat=True)
+    queued = PendingTx.objects.filter(
+        kind=PendingTx.FINALIZE, clock_id__in=clock_ids,
+        status__in=(PendingTx.QUEUED, PendingTx.SENT, PendingTx.MINED),
+    ).values_list('clock_id', flat=True)
+    return {int(clock_id) for clock_id in created} - {int(clock_id) for clock_id in finalized} - set(queued)
+
+def round_calls(rounds):
+    """Unsaved transactions that settle on chain the ``(clock_id, round_id, wallet)`` rounds.
+
+    ``finalizeClock`` on LastBidderWin for the clocks it can still finalize,
+    and minting the prize NFT to the winner with the round as token id when
+    ``settings.PRIZE_NFT_ADDRESS`` is set. Rounds nobody bid on get nothing:
+    there is no one to pay.
+    """
+    rounds = [(clock_id, round_id, wallet) for clock_id, round_id, wallet in rounds if wallet]
+    finalizable = set()
+    if rounds and contract_configured(settings.CONTRACT_ADDRESS):
+        finalizable = open_clocks({clock_id for clock_id, _, _ in rounds})
+    calls = []
+    for clock_id, round_id, wallet in rounds:
+        if clock_id in finalizable:
+            # One-shot on chain: the first round to close settles the clock
+            finalizable.discard(clock_id)
+            calls.append(PendingTx(
+                kind=PendingTx.FINALIZE, clock_id=clock_id, round_id=round_id, to=settings.CONTRACT_ADDRESS.lower(),
+                data=encode_call('finalizeClock', ['uint256'], [clock_id]),
+            ))
+        if contract_configured(settings.PRIZE_NFT_ADDRESS):
+            calls.append(PendingTx(
+                kind=PendingTx.MINT, clock_id=clock_id, round_id=round_id, to=settings.PRIZE_NFT_ADDRESS.lower(),
+                data=encode_call('mint', ['address', 'uint256'], [Web3.to_checksum_address(wallet), round_id.int]),
+            ))
+    return calls
+
+@receiver(rounds_closed)
+def queue_settlement(sender, rounds, **kwargs):
+    """Queue the settlement of closed rounds for the transaction submitter."""
+    PendingTx.objects.bulk_create(round_calls(rounds), ignore_conflicts=True)
@@ -0,0 +1,267 @@
+import asyncio
+import heapq
+import logging
+import math
+from datetime import datetime, timezone
+from channels.db import database_sync_to_async
+from django.conf import settings
+from eth_account import Account
+from web3 import Web3
+from lastbidder.metrics import Counter
+from .models import PendingTx
+from .rpc import JsonRpcClient, RpcError
+
+logger = logging.getLogger(__name__)
+
+SAVED_FIELDS = ['status', 'sender', 'nonce', 'gas', 'gas_price', 'tx_hash', 'hashes', 'attempts', 'error', 'sent_at']
+
+# A plain transfer, what a filler costs
+FILLER_GAS = 21000
+
+TRANSACTIONS = Counter('chain_transactions_total', 'Backend transactions, by what happened to them', ['event'])
+
+class TxSubmitter:
+    """Sends the queued :class:`PendingTx` rows from one account, many per round trip.
+
+    The account's next nonce is read from the node once, then kept here, so
+    a transaction costs no nonce lookup. Every :meth:`step` takes three
+    batched JSON-RPC requests, four when it fills a gap: the gas price, the
+    account's mined nonce and the receipts of everything sent; gas estimates
+    of up to ``batch_size`` queued transactions; and
+    ``eth_sendRawTransaction`` for everything signed this round, queued
+    transactions getting consecutive nonces. A call that reverts in
+    estimation fails without spending gas or a nonce. A new transaction the
+    node refuses fails too, and its nonce goes to the next one queued so
+    later nonces are not stuck behind a gap; a nonce no queued transaction
+    takes in the same step is filled at once with a zero-value transfer to
+    the account itself. One refused for a nonce too low (the account was
+    used elsewhere) is queued again and the next nonce is read from the node.
+
+    A transaction not mined ``resubmit_after`` seconds after it was sent is
+    signed again for the same nonce, its gas price raised by ``fee_bump``
+    (at least to the node's price, never above ``max_gas_price``). Rows are
+    saved with their nonce and hash before they are sent, so a restart
+    sends again what the node may have missed rather than leaving a gap.
+    Run a single submitter per account.
+    """
+
+    def __init__(self, rpc, private_key, batch_size=50, interval=1.0, resubmit_after=30, fee_bump=1.2,
+                 max_gas_price=None, gas_margin=1.2):
+        self.rpc = rpc
+        self.account = Account.from_key(private_key)
+        self.address = self.account.address
+        self.batch_size = batch_size
+        self.interval = interval
+        self.resubmit_after = resubmit_after
+        self.fee_bump = fee_bump
+        self.max_gas_price = max_gas_price
+        self.gas_margin = gas_margin
+        self.chain_id = None
+        self.next_nonce = None
+        self.free_nonces = []  # Heap of nonces below next_nonce given back by refused transactions
+
+    async def sync(self):
+        """Read the chain id and the next nonce of the account from the node."""
+        chain_id, pending = await self.rpc.batch([
+            ('eth_chainId', []),
+            ('eth_getTransactionCount', [self.address, 'pending']),
+        ])
+        for reply in (chain_id, pending):
+            if isinstance(reply, RpcError):
+                raise reply
+        self.chain_id = int(chain_id, 16)
+        pending = int(pending, 16)
+        held = await database_sync_to_async(self.forget_unseen)(pending)
+        self.next_nonce = max(held, default=pending - 1) + 1
+        # Gaps left by refused transactions, before a restart or a resync
+        self.free_nonces = [nonce for nonce in range(pending, self.next_nonce) if nonce not in held]
+
+    def forget_unseen(self, pending):
+        """Mark the transactions the node does not know about as not sent; return the nonces they hold.
+
+        Only transactions still waiting hold nonces past the node's count: a
+        reset dev chain starts again from zero, whatever was mined before.
+        """
+        unseen = PendingTx.objects.filter(sender=self.address, status=PendingTx.SENT, nonce__gte=pending)
+        unseen.update(sent_at=None)
+        return set(unseen.values_list('nonce', flat=True))
+
+    def load(self):
+        sent = list(PendingTx.objects.filter(status=PendingTx.SENT, sender=self.address).order_by('nonce'))
+        queued = list(PendingTx.objects.filter(status=PendingTx.QUEUED).order_by('id')[:self.batch_size])
+        return sent, queued
+
+    def save(self, txs):
+        PendingTx.objects.bulk_update(txs, SAVED_FIELDS)
+
+    def sign(self, tx, gas_price):
+        """Sign ``tx`` at ``gas_price`` and return the raw transaction."""
+        signed = self.account.sign_transaction({
+            'nonce': tx.nonce,
+            'to': Web3.to_checksum_address(tx.to),
+            'data': tx.data,
+            'value': 0,
+            'gas': tx.gas,
+            'gasPrice': gas_price,
+            'chainId': self.chain_id,
+        })
+        tx.gas_price = gas_price
+        tx.tx_hash = Web3.to_hex(signed.hash)
+        if tx.tx_hash not in tx.hashes.split():
+            tx.hashes = f'{tx.hashes} {tx.tx_hash}'.strip()
+        tx.attempts += 1
+        # eth-account 0.13 renamed rawTransaction
+        return Web3.to_hex(getattr(signed, 'raw_transaction', None) or signed.rawTransaction)
+
+    def capped(self, gas_price):
+        return gas_price if self.max_gas_price is None else min(gas_price, self.max_gas_price)
+
+    async def step(self):
+        """Check, bump and send once; returns the number of transactions still open."""
+        if self.next_nonce is None:
+            await self.sync()
+        sent, queued = await database_sync_to_async(self.load)()
+        hashes = [(tx, tx_hash) for tx in sent for tx_hash in tx.hashes.split()]
+        # The mined nonce is read before the receipts: a nonce seen mined has its receipt
+        replies = await self.rpc.batch([
+            ('eth_gasPrice', []),
+            ('eth_getTransactionCount', [self.address, 'latest']),
+        ] + [('eth_getTransactionReceipt', [tx_hash]) for _, tx_hash in hashes])
+        for reply in replies[:2]:
+            if isinstance(reply, RpcError):
+                raise reply
+        gas_price, mined_nonce = int(replies[0], 16), int(replies[1], 16)
+        receipts = {
+            tx.pk: receipt for (tx, _), receipt in zip(hashes, replies[2:])
+            if receipt is not None and not isinstance(receipt, RpcError)
+        }
+
+        now = datetime.now(timezone.utc)
+        changed, outbox = [], []
+        for tx in sent:
+            receipt = receipts.get(tx.pk)
+            if receipt is not None:
+                ok = int(receipt.get('status', '0x0'), 16) == 1
+                tx.status = PendingTx.MINED if ok else PendingTx.REVERTED
+                tx.tx_hash = receipt['transactionHash']
+                TRANSACTIONS.labels(tx.status).inc()
+                changed.append(tx)
+            elif tx.nonce < mined_nonce:
+                tx.status = PendingTx.FAILED
+                tx.error = 'Nonce used by another transaction'
+                TRANSACTIONS.labels(tx.status).inc()
+                changed.append(tx)
+            elif tx.sent_at is None:
+                # The node never took it: same nonce, same price
+                outbox.append((tx, self.sign(tx, int(tx.gas_price))))
+            elif (now - tx.sent_at).total_seconds() >= self.resubmit_after:
+                price = self.capped(max(gas_price, math.ceil(int(tx.gas_price) * self.fee_bump)))
+                if price > tx.gas_price:
+                    TRANSACTIONS.labels('bumped').inc()
+                    outbox.append((tx, self.sign(tx, price)))
+
+        if queued:
+            estimates = await self.rpc.batch([
+                ('eth_estimateGas', [{'from': self.address, 'to': tx.to, 'data': tx.data}]) for tx in queued
+            ])
+            for tx, estimate in zip(queued, estimates):
+                if isinstance(estimate, RpcError):
+                    if 'revert' in str(estimate).lower():
+                        tx.status = PendingTx.FAILED
+                        tx.error = str(estimate)
+                        TRANSACTIONS.labels(tx.status).inc()
+                        changed.append(tx)
+                    # Anything else is the node's problem: estimate again next round
+                    continue
+                tx.gas = math.ceil(int(estimate, 16) * self.gas_margin)
+                tx.sender = self.address
+                if self.free_nonces:
+                    tx.nonce = heapq.heappop(self.free_nonces)
+                else:
+                    tx.nonce = self.next_nonce
+                    self.next_nonce += 1
+                tx.status = PendingTx.SENT
+                outbox.append((tx, self.sign(tx, self.capped(gas_price))))
+
+        # Nonces and hashes are stored before the node sees them
+        await database_sync_to_async(self.save)(changed + [tx for tx, _ in outbox])
+        await self.send(outbox, queued, now)
+
+        fillers = []
+        if self.free_nonces and self.next_nonce is not None:
+            # Nonces after the gaps are in the node's pool already, and are
+            # never mined until the gaps are filled
+            fillers = await database_sync_to_async(self.fill_gaps)(self.capped(gas_price))
+            outbox = [(tx, self.sign(tx, int(tx.gas_price))) for tx in fillers]
+            await database_sync_to_async(self.save)(fillers)
+            await self.send(outbox, (), now)
+        return sum(tx.status in (PendingTx.QUEUED, PendingTx.SENT) for tx in sent + queued + fillers)
+
+    async def send(self, outbox, queued, now):
+        """Send the signed ``(tx, raw)`` pairs in one batch; new ``queued`` ones the node refuses are released."""
+        if not outbox:
+            return
+        results = await self.rpc.batch([('eth_sendRawTransaction', [raw]) for _, raw in outbox])
+        for (tx, _), result in zip(outbox, results):
+            if isinstance(result, RpcError) and 'already known' not in str(result).lower():
+                tx.error = str(result)
+                logger.warning("transaction rejected", extra={"kind": tx.kind, "nonce": tx.nonce, "error": tx.error})
+                if tx in queued:
+                    self.release(tx)
+                # A version already sent, or a filler, is sent again next round;
+                # a nonce the node calls too low resolves through the receipts
+                continue
+            tx.sent_at = now
+            tx.error = ''
+            TRANSACTIONS.labels('sent').inc()
+        await database_sync_to_async(self.save)([tx for tx, _ in outbox])
+
+    def fill_gaps(self, gas_price):
+        """Create a filler for every free nonce, return the new (unsigned) rows."""
+        free = sorted(self.free_nonces)
+        self.free_nonces = []
+        while free and free[-1] == self.next_nonce - 1:
+            # Nothing waits behind the last nonce: hand it out again instead
+            free.pop()
+            self.next_nonce -= 1
+        fillers = []
+        for nonce in free:
+            fillers.append(PendingTx.objects.create(
+                kind=PendingTx.FILLER, clock_id=0, to=self.address.lower(), data='0x',
+                status=PendingTx.SENT, sender=self.address, nonce=nonce, gas=FILLER_GAS, gas_price=gas_price,
+            ))
+            TRANSACTIONS.labels('filler').inc()
+        return fillers
+
+    def release(self, tx):
+        """Take back the nonce of a new transaction the node refused."""
+        if 'nonce too low' in tx.error.lower():
+            # The account was used elsewhere: try again under a nonce read from the node
+            tx.status = PendingTx.QUEUED
+            tx.tx_hash = None
+            tx.hashes = ''
+            self.next_nonce = None
+        else:
+            tx.status = PendingTx.FAILED
+            TRANSACTIONS.labels(tx.status).inc()
+            heapq.heappush(self.free_nonces, tx.nonce)
+        tx.nonce = None
+
+    async def run(self):
+        """Submission loop."""
+        while True:
+            try:
+                await self.step()
+            except Exception:
+                logger.exception("transaction round failed")
+            await asyncio.sleep(self.interval)
+
+_submitter = None
+
+def get_submitter():
+    """Return the transaction submitter, or None while no node or signer key is configured."""
+    global _submitter
+    if _submitter is None and settings.WEB3_PROVIDER_URL and settings.CHAIN_SIGNER_KEY:
+        options = {key.lower(): value for key, value in getattr(settings, 'CHAIN_SUBMITTER', {}).items()}
+        _submitter = TxSubmitter(JsonRpcClient(settings.WEB3_PROVIDER_URL), settings.CHAIN_SIGNER_KEY, **options)
+    return _submitter
@@ -0,0 +1,411 @@
+import asyncio
+import rlp
+from asgiref.sync import async_to_sync
+import uuid
+from datetime import datetime, timezone
+from unittest import mock
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from eth_account import Account
+from eth_abi import encode
+from lastbidder.lobby.leaderboard import InMemoryLeaderboard
+from lastbidder.lobby.ledger import BidLedger
+from .abi import topic
+from .indexer import ChainIndexer
+from .models import ClockCreation, ClockFinalization, IndexerCheckpoint, PendingTx
+from .rpc import RpcError
+from .submitter import TxSubmitter
+from .verifier import ReceiptVerifier
+
+CONTRACT = '0x' + '11' * 20
+NFT = '0x' + '22' * 20
+WALLET = '0x' + 'ab' * 20
+
+class StubRpc:
+    """JSON-RPC node answering each method with ``handlers[method](*params)``.
+
+    A handler may return an :class:`RpcError` to fail its call; ``calls``
+    records every call made.
+    """
+
+    def __init__(self, **handlers):
+        self.handlers = handlers
+        self.calls = []
+
+    async def batch(self, calls):
+        self.calls.extend(calls)
+        return [self.handlers[method](*params) for method, params in calls]
+
+    async def call(self, method, params):
+        result, = await self.batch([(method, params)])
+        if isinstance(result, RpcError):
+            raise result
+        return result
+
+def word(value):
+    return '0x%064x' % value
+
+def event(model, n, **fields):
+    return model(block_number=n, block_hash='0x' + '00' * 32, tx_hash='0x%064x' % n, log_index=0, **fields)
+
+@override_settings(CONTRACT_ADDRESS=CONTRACT, PRIZE_NFT_ADDRESS=NFT)
+class SettlementTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('lastbidder.lobby.ledger.get_leaderboard', return_value=InMemoryLeaderboard())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def close(self, *clock_ids):
+        """Close one round won by WALLET on each clock, through the ledger."""
+        now = datetime.now(timezone.utc)
+        rounds = [(uuid.uuid4(), clock_id, now, now) for clock_id in clock_ids]
+        bids = [(round_id, clock_id, 'user', WALLET, None, now, now) for round_id, clock_id, _, _ in rounds]
+        closed = [(round_id, now, 'user', WALLET, clock_id) for round_id, clock_id, _, _ in rounds]
+        BidLedger()._write(rounds, bids, closed)
+
+    def queued(self, kind):
+        return sorted(PendingTx.objects.filter(kind=kind).values_list('clock_id', flat=True))
+
+    def test_finalizes_created_clocks_once(self):
+        event(ClockCreation, 1, clock_id=1, prize=1).save()
+        self.close(1, 1, 7)
+        self.close(1)
+        # Clock 7 was never created on chain, clock 1 is finalized by its first round only
+        self.assertEqual(self.queued(PendingTx.FINALIZE), [1])
+        self.assertEqual(self.queued(PendingTx.MINT), [1, 1, 1, 7])
+
+    def test_skips_finalized_clocks(self):
+        event(ClockCreation, 1, clock_id=3, prize=1).save()
+        event(ClockFinalization, 2, clock_id=3, winner=WALLET, prize=1).save()
+        self.close(3)
+        self.assertEqual(self.queued(PendingTx.FINALIZE), [])
+
+    def test_retries_after_failure(self):
+        event(ClockCreation, 1, clock_id=4, prize=1).save()
+        self.close(4)
+        PendingTx.objects.filter(kind=PendingTx.FINALIZE).update(status=PendingTx.FAILED)
+        self.close(4)
+        self.assertEqual(self.queued(PendingTx.FINALIZE), [4, 4])
+
+    def test_nothing_without_winner(self):
+        event(ClockCreation, 1, clock_id=1, prize=1).save()
+        now = datetime.now(timezone.utc)
+        round_id = uuid.uuid4()
+        BidLedger()._write([(round_id, 1, now, now)], [], [(round_id, now, None, None, 1)])
+        self.assertFalse(PendingTx.objects.exists())
+
+def participation(clock_id, wallet, status=1):
+    return {
+        'status': hex(status),
+        'logs': [{
+            'address': CONTRACT,
+            'topics': [topic('ParticipationRecorded'), word(clock_id), word(int(wallet, 16))],
+            'data': '0x',
+        }],
+    }
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ReceiptVerifierTests(TestCase):
+    def setUp(self):
+        self.receipts = {}
+        self.rpc = StubRpc(eth_getTransactionReceipt=self.receipts.get)
+        self.verifier = ReceiptVerifier(self.rpc, CONTRACT, max_pending=2)
+        patcher = mock.patch('lastbidder.chain.verifier.ledger')
+        self.ledger = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_verdicts_reach_the_ledger(self):
+        good, other_clock, reverted = word(1), word(2), word(3)
+        self.receipts.update({
+            good: participation(1, WALLET),
+            other_clock: participation(9, WALLET),
+            reverted: participation(1, WALLET, status=0),
+        })
+        self.verifier.max_pending = 10
+        for tx_hash in (good, other_clock, reverted, word(4)):
+            self.assertTrue(self.verifier.submit(tx_hash, WALLET, 1, None))
+        asyncio.run(self.verifier.verify_round())
+        self.ledger.record_verdict.assert_has_calls([
+            mock.call(good, True), mock.call(other_clock, False), mock.call(reverted, False),
+        ])
+        # Not mined yet: still pending, one batched call for all four
+        self.assertEqual(list(self.verifier._pending), [word(4)])
+        self.assertEqual(len(self.rpc.calls), 4)
+
+    def test_unmined_transactions_time_out_rejected(self):
+        self.verifier.timeout = 0
+        self.verifier.submit(word(1), WALLET, 1, None)
+        asyncio.run(self.verifier.verify_round())
+        self.ledger.record_verdict.assert_called_once_with(word(1), False)
+        self.assertEqual(self.rpc.calls, [])
+
+    def test_transaction_backs_one_bid(self):
+        tx_hash = '0x' + 'ab' * 32
+        self.assertTrue(self.verifier.submit(tx_hash, WALLET, 1, None))
+        self.assertFalse(self.verifier.submit(tx_hash.upper().replace('0X', '0x'), WALLET, 1, None))
+        self.verifier.withdraw(tx_hash)
+        self.assertTrue(self.verifier.submit(tx_hash, WALLET, 1, None))
+
+    def test_transactions_withdrawn_during_the_round_are_skipped(self):
+        mined, unmined = word(1), word(2)
+        self.receipts[mined] = participation(1, WALLET)
+        batch = self.rpc.batch
+
+        async def withdraw_during_batch(calls):
+            self.verifier.withdraw(mined)
+            self.verifier.withdraw(unmined)
+            return await batch(calls)
+        self.rpc.batch = withdraw_during_batch
+        self.verifier.submit(mined, WALLET, 1, None)
+        self.verifier.submit(unmined, WALLET, 1, None)
+        asyncio.run(self.verifier.verify_round())
+        self.ledger.record_verdict.assert_not_called()
+        self.assertEqual(list(self.verifier._pending), [])
+
+    def test_pending_queue_is_bounded(self):
+        self.verifier.submit(word(1), WALLET, 1, None)
+        self.verifier.submit(word(2), WALLET, 1, None)
+        with self.assertRaises(RuntimeError):
+            self.verifier.submit(word(3), WALLET, 1, None)
+
+
+class StubChain:
+    """Blocks ``0..head`` and the contract logs in them; forks rewrite the tail."""
+
+    def __init__(self, head):
+        self.hashes = ['0x%064x' % n for n in range(head + 1)]
+        self.logs = []
+
+    def fork(self, block, head):
+        """Replace every block from ``block`` on, dropping their logs."""
+        self.hashes[block:] = ['0x%063xf' % n for n in range(block, head + 1)]
+        self.logs = [log for log in self.logs if int(log['blockNumber'], 16) < block]
+
+    def emit(self, block, name, indexed, types=(), values=()):
+        self.logs.append({
+            'address': CONTRACT,
+            'topics': [topic(name)] + [word(value) for value in indexed],
+            'data': '0x' + encode(list(types), list(values)).hex(),
+            'blockNumber': hex(block),
+            'blockHash': self.hashes[block],
+            'transactionHash': '0x%062x%02x' % (block, len(self.logs)),
+            'logIndex': '0x0',
+        })
+
+    def rpc(self):
+        return StubRpc(
+            eth_blockNumber=lambda: hex(len(self.hashes) - 1),
+            eth_getBlockByNumber=lambda number, full: (
+                {'hash': self.hashes[int(number, 16)]} if int(number, 16) < len(self.hashes) else None),
+            eth_getLogs=lambda query: [
+                log for log in self.logs
+                if int(query['fromBlock'], 16) <= int(log['blockNumber'], 16) <= int(query['toBlock'], 16)
+            ],
+        )
+
+
+class ChainIndexerTests(TestCase):
+    def setUp(self):
+        self.leaderboard = InMemoryLeaderboard()
+        patcher = mock.patch('lastbidder.chain.indexer.get_leaderboard', return_value=self.leaderboard)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.chain = StubChain(10)
+        self.chain.emit(3, 'ClockCreated', [1], ['uint256'], [100])
+        self.chain.emit(6, 'ClockCreated', [2], ['uint256'], [100])
+        self.chain.emit(9, 'ClockFinalized', [1], ['address', 'uint256'], [WALLET, 3 * 10 ** 18])
+
+    def index(self, reorg_depth):
+        indexer = ChainIndexer(self.chain.rpc(), CONTRACT, confirmations=0, reorg_depth=reorg_depth)
+        # From the test thread, so the indexer's queries use the test transaction
+        while async_to_sync(indexer.step)():
+            pass
+
+    def stored(self):
+        return (sorted(int(clock_id) for clock_id in ClockCreation.objects.values_list('clock_id', flat=True)),
+                list(ClockFinalization.objects.values_list('block_number', flat=True)))
+
+    def test_indexes_up_to_the_head(self):
+        self.index(reorg_depth=2)
+        self.assertEqual(self.stored(), ([1, 2], [9]))
+        self.assertEqual(IndexerCheckpoint.objects.get().block_number, 10)
+        self.assertEqual(self.leaderboard.rank('prizes', WALLET), (1, 3 * 10 ** 18))
+
+    def test_reorg_rolls_back_orphaned_events(self):
+        self.index(reorg_depth=2)
+        self.chain.fork(9, 12)
+        self.chain.emit(11, 'ClockFinalized', [1], ['address', 'uint256'], [WALLET, 5])
+        self.index(reorg_depth=2)
+        self.assertEqual(self.stored(), ([1, 2], [11]))
+        checkpoint = IndexerCheckpoint.objects.get()
+        self.assertEqual((checkpoint.block_number, checkpoint.block_hash), (12, self.chain.hashes[12]))
+        # The orphaned prize came off the leaderboard
+        self.assertEqual(self.leaderboard.rank('prizes', WALLET), (1, 5))
+
+    def test_rollback_goes_past_the_reorg_depth_for_orphaned_events(self):
+        self.index(reorg_depth=1)
+        # Forks below the depth looked at first: clock 2 was never created
+        self.chain.fork(5, 10)
+        self.index(reorg_depth=1)
+        self.assertEqual(self.stored(), ([1], []))
+        self.assertIsNone(self.leaderboard.rank('prizes', WALLET))
+
+    @override_settings(WEB3_PROVIDER_URL='http://node:8545', CONTRACT_ADDRESS='0x' + '0' * 40)
+    def test_refuses_the_zero_address(self):
+        with self.assertRaises(CommandError):
+            call_command('index_chain')
+
+
+class StubNode:
+    """Nonces, gas price and receipts of one account, as a node would report them."""
+
+    def __init__(self, pending=0):
+        self.pending = pending
+        self.mined = pending
+        self.gas_price = 10
+        self.receipts = {}
+        self.sent = []
+        self.reverts = set()
+        self.refusals = {}  # Calldata -> error of eth_sendRawTransaction
+
+    def transaction_count(self, address, tag):
+        return hex(self.pending if tag == 'pending' else self.mined)
+
+    def estimate(self, call):
+        if call['data'] in self.reverts:
+            return RpcError('execution reverted')
+        return hex(100000)
+
+    def send(self, raw):
+        # Legacy transaction: nonce, gas price, gas, to, value, data, v, r, s
+        fields = rlp.decode(bytes.fromhex(raw[2:]))
+        nonce, gas_price = (int.from_bytes(field, 'big') for field in fields[:2])
+        data = '0x' + fields[5].hex()
+        if data in self.refusals:
+            return RpcError(self.refusals[data])
+        self.sent.append((nonce, gas_price))
+        # Past a gap the node holds the transaction, but does not count it
+        if nonce == self.pending:
+            self.pending += 1
+        return '0x'
+
+    def rpc(self):
+        return StubRpc(
+            eth_chainId=lambda: hex(1337),
+            eth_getTransactionCount=self.transaction_count,
+            eth_gasPrice=lambda: hex(self.gas_price),
+            eth_getTransactionReceipt=self.receipts.get,
+            eth_estimateGas=self.estimate,
+            eth_sendRawTransaction=self.send,
+        )
+
+
+class TxSubmitterTests(TestCase):
+    def setUp(self):
+        self.node = StubNode(pending=5)
+        self.submitter = TxSubmitter(self.node.rpc(), Account.create().key, resubmit_after=3600, fee_bump=1.5,
+                                     max_gas_price=20)
+
+    def queue(self, *clock_ids):
+        return [PendingTx.objects.create(kind=PendingTx.FINALIZE, clock_id=clock_id, to=CONTRACT,
+                                         data=word(clock_id)) for clock_id in clock_ids]
+
+    def step(self):
+        # From the test thread, so the submitter's queries use the test transaction
+        return async_to_sync(self.submitter.step)()
+
+    def rows(self):
+        return list(PendingTx.objects.order_by('clock_id').values_list('clock_id', 'status', 'nonce'))
+
+    def test_queued_transactions_get_consecutive_nonces(self):
+        self.queue(1, 2)
+        self.node.reverts.add(word(3))
+        self.queue(3)
+        self.assertEqual(self.step(), 2)
+        # The reverted call spent neither gas nor a nonce
+        self.assertEqual(self.rows(), [(1, PendingTx.SENT, 5), (2, PendingTx.SENT, 6), (3, PendingTx.FAILED, None)])
+        self.assertEqual(self.node.sent, [(5, 10), (6, 10)])
+        self.assertEqual(self.submitter.next_nonce, 7)
+
+    def test_receipts_and_nonces_taken_by_others(self):
+        first, second = self.queue(1, 2)
+        self.step()
+        first.refresh_from_db()
+        self.node.receipts[first.tx_hash] = {'status': '0x1', 'transactionHash': first.tx_hash}
+        # Nonce 6 was mined, but not by the second transaction
+        self.node.mined = 7
+        self.assertEqual(self.step(), 0)
+        self.assertEqual(self.rows(), [(1, PendingTx.MINED, 5), (2, PendingTx.FAILED, 6)])
+
+    def test_stuck_transaction_is_bumped_for_the_same_nonce(self):
+        tx, = self.queue(1)
+        self.step()
+        self.submitter.resubmit_after = 0
+        self.step()
+        self.step()
+        tx.refresh_from_db()
+        # 10, then 15, then capped at 20; every version is watched for a receipt
+        self.assertEqual(self.node.sent, [(5, 10), (5, 15), (5, 20)])
+        self.assertEqual((int(tx.gas_price), len(tx.hashes.split())), (20, 3))
+        # At the cap there is nothing left to bump
+        self.step()
+        self.assertEqual(len(self.node.sent), 3)
+
+    def test_restart_resends_what_the_node_lost(self):
+        self.queue(1, 2)
+        self.step()
+        # The node restarted without its mempool
+        self.node.pending = 5
+        self.node.sent.clear()
+        restarted = TxSubmitter(self.node.rpc(), self.submitter.account.key)
+        async_to_sync(restarted.step)()
+        # Same nonces, no gap, and the next transaction goes after them
+        self.assertEqual(sorted(self.node.sent), [(5, 10), (6, 10)])
+        self.assertEqual(restarted.next_nonce, 7)
+
+    def test_gap_nobody_takes_is_filled_in_the_same_step(self):
+        self.node.refusals[word(1)] = 'insufficient funds for gas * price + value'
+        self.queue(1, 2)
+        self.assertEqual(self.step(), 2)
+        self.assertEqual(self.rows(), [
+            (0, PendingTx.SENT, 5), (1, PendingTx.FAILED, None), (2, PendingTx.SENT, 6),
+        ])
+        filler = PendingTx.objects.get(kind=PendingTx.FILLER)
+        self.assertEqual((filler.to, filler.data, filler.gas), (self.submitter.address.lower(), '0x', 21000))
+        # Nonce 5 no longer holds nonce 6 back
+        self.assertEqual(self.node.sent, [(6, 10), (5, 10)])
+        self.assertEqual(self.submitter.next_nonce, 7)
+
+    def test_refused_last_nonce_is_handed_out_again(self):
+        self.node.refusals[word(2)] = 'insufficient funds for gas * price + value'
+        self.queue(1, 2)
+        self.step()
+        self.assertEqual(self.submitter.next_nonce, 6)
+        self.assertFalse(PendingTx.objects.filter(kind=PendingTx.FILLER).exists())
+
+    def test_restart_finds_the_gap(self):
+        self.node.refusals[word(1)] = 'insufficient funds for gas * price + value'
+        self.node.refusals['0x'] = 'insufficient funds for gas * price + value'
+        self.queue(1, 2)
+        self.step()
+        # Stopped before the filler reached the node or the database
+        PendingTx.objects.filter(kind=PendingTx.FILLER).delete()
+        restarted = TxSubmitter(self.node.rpc(), self.submitter.account.key)
+        self.queue(3, 4)
+        async_to_sync(restarted.step)()
+        self.assertEqual(self.rows()[2:], [(3, PendingTx.SENT, 5), (4, PendingTx.SENT, 7)])
+
+    def test_nonce_too_low_queues_again_under_the_node_nonce(self):
+        self.node.refusals[word(1)] = 'nonce too low'
+        self.queue(1)
+        self.assertEqual(self.step(), 1)
+        self.assertEqual(self.rows(), [(1, PendingTx.QUEUED, None)])
+        self.assertIsNone(self.submitter.next_nonce)
+        # Someone else sent from the account meanwhile
+        del self.node.refusals[word(1)]
+        self.node.pending = 9
+        self.step()
+        self.assertEqual(self.rows(), [(1, PendingTx.SENT, 9)])
+        self.assertEqual(self.node.sent, [(9, 10)])
+
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from lastbidder.lobby.codec import group_frame
+from lastbidder.lobby.ledger import ledger
+from lastbidder.metrics import Counter, Histogram
+from .abi import decode_log
+from .rpc import JsonRpcClient, RpcError
+
+TX_HASH = re.compile(r'^0x[0-9a-fA-F]{64}$')
+
+logger = logging.getLogger(__name__)
+
+VERDICTS = Counter('chain_bid_verdicts_total', 'Bid transactions checked on chain', ['verdict'])
+ROUND = Histogram('chain_receipt_batch_seconds', 'Duration of one batched receipt lookup')
+
+class ReceiptVerifier:
+    """Checks bid transactions against LastBidderWin receipts, off the bid path.
+
+    Bids are queued with :meth:`submit` and extend the clock straight away.
+    The worker fetches every pending receipt with one batched
+    ``eth_getTransactionReceipt`` call per round, then tells the bidder's
+    channel whether the transaction really recorded its participation in that
+    clock. Verdicts on mined transactions are kept in an LRU, which also stops
+    one transaction from backing several bids while it is cached; beyond it,
+    the unique ``Bid.tx_hash`` does.
+
+    Every verdict is stored with the bid through the ledger, and a rejected
+    bid (reverted, not a participation, or not mined within ``timeout``)
+    cannot win its round. At most ``max_pending`` bids wait for a verdict;
+    past that, bids are refused until the node catches up. Bids still
+    unverified when the process stopped are checked again on start.
+    """
+
+    def __init__(self, rpc, contract_address, batch_size=100, interval=1.0, timeout=300, cache_size=10000,
+                 max_pending=10000):
+        self.rpc = rpc
+        self.contract_address = contract_address.lower()
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.max_pending = max_pending
+        self._pending = OrderedDict()  # tx hash -> (wallet, clock id, reply channel, give up at)
+        self._verdicts = OrderedDict()  # tx hash -> (ok, reason)
+        self._wakeup = None
+
+    def submit(self, tx_hash, wallet, clock_id, reply_channel):
+        """Queue a bid transaction for verification, never blocks.
+
+        Returns False when the transaction already backs another bid, raises
+        RuntimeError when too many bids are waiting for a verdict.
+        """
+        tx_hash = tx_hash.lower()
+        if tx_hash in self._pending or tx_hash in self._verdicts:
+            return False
+        if len(self._pending) >= self.max_pending:
+            VERDICTS.labels('overloaded').inc()
+            raise RuntimeError("Too many bids waiting for verification, bid again")
+        self._pending[tx_hash] = (wallet, clock_id, reply_channel, time.monotonic() + self.timeout)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    def withdraw(self, tx_hash):
+        """Forget a transaction whose bid did not go through, so it can back another."""
+        self._pending.pop(tx_hash.lower(), None)
+
+    def unverified(self):
+        """``(tx_hash, wallet, clock_id)`` of the stored bids still waiting for a verdict."""
+        from lastbidder.lobby.models import Bid
+        return list(Bid.objects.filter(tx_hash__isnull=False, verified__isnull=True)
+                    .order_by('id').values_list('tx_hash', 'wallet', 'clock_id')[:self.max_pending])
+
+    def prioritize(self, tx_hash):
+        """Check a pending transaction first in the next round."""
+        tx_hash = tx_hash.lower()
+        if tx_hash in self._pending:
+            self._pending.move_to_end(tx_hash, last=False)
+
+    def check_receipt(self, receipt, wallet, clock_id):
+        """Return ``(ok, reason)`` for a mined receipt."""
+        if int(receipt.get('status', '0x0'), 16) != 1:
+            return False, 'Transaction reverted'
+        for log in receipt.get('logs', []):
+            if log.get('address', '').lower() != self.contract_address:
+                continue
+            event = decode_log(log)
+            if event is None or event[0] != 'ParticipationRecorded':
+                continue
+            args = event[1]
+            if args['clockId'] == clock_id and args['participant'].lower() == wallet.lower():
+                return True, 'Participation recorded'
+        return False, 'No matching participation in transaction'
+
+    def _remember(self, tx_hash, verdict):
+        self._verdicts[tx_hash] = verdict
+        self._verdicts.move_to_end(tx_hash)
+        if len(self._verdicts) > self.cache_size:
+            self._verdicts.popitem(last=False)
+
+    async def verify_round(self):
+        """Resolve up to ``batch_size`` pending transactions."""
+        now = time.monotonic()
+        batch = []
+        for tx_hash, bid in list(self._pending.items()):
+            if len(batch) >= self.batch_size:
+                break
+            if bid[3] <= now:
+                del self._pending[tx_hash]
+                await self._answer(tx_hash, bid, (False, 'Transaction not mined in time'))
+            else:
+                batch.append(tx_hash)
+        if not batch:
+            return
+        with ROUND.time():
+            receipts = await self.rpc.batch([('eth_getTransactionReceipt', [tx_hash]) for tx_hash in batch])
+        for tx_hash, receipt in zip(batch, receipts):
+            if receipt is None or isinstance(receipt, RpcError):
+                # Not mined yet (or a transient node error): retry next round
+                if tx_hash in self._pending:
+                    self._pending.move_to_end(tx_hash)
+                continue
+            bid = self._pending.pop(tx_hash, None)
+            if bid is None:
+                # Withdrawn while the receipts were fetched: its bid never went through
+                continue
+            verdict = self.check_receipt(receipt, bid[0], bid[1])
+            self._remember(tx_hash, verdict)
+            await self._answer(tx_hash, bid, verdict)
+
+    async def _answer(self, tx_hash, bid, verdict):
+        wallet, clock_id, reply_channel, _ = bid
+        ok, reason = verdict
+        VERDICTS.labels('confirmed' if ok else 'rejected').inc()
+        ledger.record_verdict(tx_hash, ok)
+        if reply_channel is None:
+            # Recovered after a restart, the bidder's socket is gone
+            return
+        await get_channel_layer().send(reply_channel, group_frame({
+            "event": "transaction_confirmed" if ok else "bid_rejected",
+            "data": {
+                "message": reason,
+                "clock_id": clock_id,
+                "transaction_hash": tx_hash,
+            }
+        }))
+
+    async def run(self):
+        """Verification loop; sleeps while nothing is pending."""
+        self._wakeup = asyncio.Event()
+        try:
+            try:
+                deadline = time.monotonic() + self.timeout
+                for tx_hash, wallet, clock_id in await database_sync_to_async(self.unverified)():
+                    self._pending.setdefault(tx_hash, (wallet, clock_id, None, deadline))
+            except Exception:
+                logger.exception("unverified bids not recovered")
+            while True:
+                if not self._pending:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                try:
+                    await self.verify_round()
+                except Exception:
+                    logger.exception("receipt verification failed", extra={"pending": len(self._pending)})
+                await asyncio.sleep(self.interval)
+        finally:
+            self._wakeup = None
+
+_verifier = None
+
+def get_verifier():
+    """Return the receipt verifier, or None when no chain is configured."""
+    global _verifier
+    address = settings.CONTRACT_ADDRESS
+    if _verifier is None and settings.WEB3_PROVIDER_URL and address and int(address, 16):
+        _verifier = ReceiptVerifier(JsonRpcClient(settings.WEB3_PROVIDER_URL), settings.CONTRACT_ADDRESS)
+    return _verifier
+
+def is_tx_hash(value):
+    return isinstance(value, str) and TX_HASH.match(value) is not None
@@ -1,3 +1,13 @@
 from django.contrib import admin
+from .models import Bid, ClockRound
 
-# Register your models here.
+@admin.register(ClockRound)
+class ClockRoundAdmin(admin.ModelAdmin):
+    list_display = ('clock_id', 'started_at', 'ended_at', 'winner', 'confirmed')
+    list_filter = ('clock_id', 'confirmed')
+
+@admin.register(Bid)
+class BidAdmin(admin.ModelAdmin):
+    list_display = ('clock_id', 'bidder', 'wallet', 'placed_at', 'verified')
+    list_filter = ('verified',)
+    search_fields = ('bidder', 'wallet', 'tx_hash')
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import time
+from channels.layers import get_channel_layer
+from lastbidder.metrics import Histogram
+from .codec import group_frame
+
+logger = logging.getLogger(__name__)
+
+LOBBY_GROUP = "lobby"  # Every socket, whatever clock it watches
+
+# Shared by every producer of group frames, labelled by frame kind
+CHANNEL_SEND = Histogram('lobby_channel_send_seconds', 'Latency of one channel-layer fan-out', ['source'])
+FLUSH = Histogram('lobby_flush_seconds', 'Encoding and fan-out time of one coalesced tick', ['source'])
+
+async def group_send_many(channel_layer, messages):
+	"""Send ``(group, message)`` pairs, as one batch if the layer supports it."""
+	if not messages:
+		return
+	send_many = getattr(channel_layer, "group_send_many", None)
+	if send_many is not None:
+		await send_many(messages)
+		return
+	for group_name, message in messages:
+		await channel_layer.group_send(group_name, message)
+
+class Broadcaster:
+	"""Coalesces lobby state changes into at most one frame per group and tick.
+
+	Producers only mark what changed (a bid on a clock, the online count).
+	The flush task sleeps until something is dirty, waits one ``interval`` so
+	bursts collapse together, and sends a single ``update`` frame per group.
+	Frames carry an absolute ``deadline`` so clients run the countdown locally.
+	"""
+
+	def __init__(self, interval=0.1):
+		self.interval = interval
+		self._clocks = {}
+		self._users = None
+		self._wakeup = None
+
+	def mark_bid(self, clk):
+		"""Record a bid on ``clk`` for the next flush."""
+		self._clocks[clk.group_name] = (clk, self._clocks.get(clk.group_name, (clk, 0))[1] + 1)
+		self._wake()
+
+	def mark_users(self, num_connected_users):
+		"""Record a new online count for the next flush."""
+		self._users = num_connected_users
+		self._wake()
+
+	def _wake(self):
+		if self._wakeup is not None:
+			self._wakeup.set()
+
+	@staticmethod
+	def clock_state(clk):
+		"""Snapshot of ``clk`` as sent to clients."""
+		now = time.time()
+		remaining = clk.remaining_time
+		return {
+			"clock_id": clk.clock_id,
+			"is_active": clk.is_active,
+			"deadline": now + remaining,
+			"server_time": now,
+			"remaining_time": remaining,
+			"last_bidder": clk.last_bidder,
+			"bid_added": clk.bid_time,
+			"seq": clk.seq,
+		}
+
+	async def flush(self):
+		"""Send every pending change, one frame per group."""
+		clocks, self._clocks = self._clocks, {}
+		users, self._users = self._users, None
+		with FLUSH.labels("update").time():
+			messages = []
+			for group_name, (clk, bids) in clocks.items():
+				data = self.clock_state(clk)
+				data["bids"] = bids
+				messages.append((group_name, group_frame({"event": "update", "data": data}, key=group_name, seq=clk.seq)))
+			if users is not None:
+				messages.append((LOBBY_GROUP, group_frame({
+					"event": "update",
+					"data": {"num_connected_users": users},
+				}, key=LOBBY_GROUP)))
+			with CHANNEL_SEND.labels("update").time():
+				await group_send_many(get_channel_layer(), messages)
+
+	async def run(self):
+		"""Flush loop; idles without any work while nothing changes."""
+		self._wakeup = asyncio.Event()
+		if self._clocks or self._users is not None:
+			self._wakeup.set()
+		try:
+			while True:
+				await self._wakeup.wait()
+				await asyncio.sleep(self.interval)
+				self._wakeup.clear()
+				try:
+					await self.flush()
+				except Exception:
+					# Those frames are lost, later changes still go out
+					logger.exception("lobby broadcast flush failed")
+		finally:
+			self._wakeup = None
+
+broadcaster = Broadcaster()
@@ -0,0 +1,112 @@
+import asyncio
+import glob
+import heapq
+import itertools
+import logging
+import os
+import time
+import msgpack
+from django.conf import settings
+from lastbidder.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+DROPPED = Counter('lobby_capture_dropped_total', 'Captured records dropped because the log fell behind')
+
+# Record kinds
+OPEN, IN, OUT, CLOSE = range(4)
+
+class TrafficRecorder:
+	"""Append-only capture of the lobby's websocket traffic.
+
+	Each process writes its own log, ``path`` suffixed with its start time
+	and pid, so workers and restarts never share connection ids or a time
+	line. Records are msgpack arrays ``[time, connection, kind, data]``
+	written back to back, ``time`` being a wall-clock timestamp that moves
+	with the monotonic clock, so logs can be merged. ``data`` is the
+	identity and route of the socket for ``OPEN``, the raw frame for ``IN``
+	and ``OUT`` (str for text, bytes for binary) and the close code for
+	``CLOSE``. Records are packed into a memory buffer that a writer task
+	appends to the file from a thread, so capturing never blocks a socket;
+	past ``max_buffer`` bytes records are dropped rather than piling up.
+	"""
+
+	def __init__(self, path, interval=0.5, max_buffer=8 << 20):
+		self._epoch = time.time()
+		self._start = time.monotonic()
+		self.path = f"{path}.{int(self._epoch * 1000)}.{os.getpid()}"
+		self.interval = interval
+		self.max_buffer = max_buffer
+		self.dropped = 0
+		self._ids = itertools.count(1)
+		self._buffer = bytearray()
+		self._file = None
+		self._lock = asyncio.Lock()
+
+	def open(self, user_id, wallet, path, subprotocol):
+		"""Record a new socket and return its connection id."""
+		conn = next(self._ids)
+		self.record(conn, OPEN, {"user": user_id, "wallet": wallet, "path": path, "subprotocol": subprotocol})
+		return conn
+
+	def record(self, conn, kind, data):
+		if len(self._buffer) >= self.max_buffer:
+			self.dropped += 1
+			DROPPED.inc()
+			return
+		self._buffer += msgpack.packb([round(self._epoch + time.monotonic() - self._start, 6), conn, kind, data])
+
+	def _write(self, data):
+		if self._file is None:
+			self._file = open(self.path, 'ab')
+		self._file.write(data)
+		self._file.flush()
+
+	async def flush(self):
+		"""Append everything buffered to the log."""
+		async with self._lock:
+			if not self._buffer:
+				return
+			data, self._buffer = bytes(self._buffer), bytearray()
+			await asyncio.to_thread(self._write, data)
+
+	async def run(self):
+		"""Writer loop."""
+		while True:
+			await asyncio.sleep(self.interval)
+			try:
+				await self.flush()
+			except OSError:
+				logger.exception("capture write failed", extra={"path": self.path})
+
+def read_capture(path):
+	"""Yield the ``(time, connection, kind, data)`` records of a capture.
+
+	``path`` is one log, or the ``LOBBY_CAPTURE`` prefix: the logs of every
+	process are then merged in time order, their connection ids shifted so
+	they stay apart. Times are seconds since the first record.
+	"""
+	paths = [path] if os.path.isfile(path) else sorted(glob.glob(glob.escape(path) + '.*'))
+	if not paths:
+		raise FileNotFoundError(f"No capture log at {path}")
+	logs, offset = [], 0
+	for name in paths:
+		with open(name, 'rb') as f:
+			records = [tuple(record) for record in msgpack.Unpacker(f, raw=False)]
+		logs.append([(t, conn + offset, kind, data) for t, conn, kind, data in records])
+		offset += max((record[1] for record in records), default=0)
+	start = None
+	for t, conn, kind, data in heapq.merge(*logs, key=lambda record: record[0]):
+		if start is None:
+			start = t
+		yield (round(t - start, 6), conn, kind, data)
+
+_recorder = None
+
+def get_recorder():
+	"""Return the traffic recorder, or None when ``settings.LOBBY_CAPTURE`` is empty."""
+	global _recorder
+	path = getattr(settings, 'LOBBY_CAPTURE', '')
+	if _recorder is None and path:
+		_recorder = TrafficRecorder(path)
+	return _recorder
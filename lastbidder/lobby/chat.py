@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from channels.layers import get_channel_layer
+from lastbidder.metrics import Counter
+from .broadcast import CHANNEL_SEND, FLUSH, group_send_many
+from .codec import group_frame
+
+logger = logging.getLogger(__name__)
+
+MESSAGES = Counter('lobby_chat_messages_total', 'Chat messages accepted')
+
+class ChatHub:
+	"""Chat of every clock group, with a bounded history and batched delivery.
+
+	Each room keeps its last ``history`` messages in a ring buffer, replayed
+	to sockets when they join. New messages are sent to the room as one
+	``chat`` frame per ``interval``, however many were posted in between.
+	"""
+
+	def __init__(self, interval=0.1, history=50, max_length=280):
+		self.interval = interval
+		self.max_length = max_length
+		self.history_size = history
+		self._history = {}
+		self._pending = {}
+		self._wakeup = None
+
+	def post(self, group_name, user_id, text):
+		"""Queue a message for ``group_name``, ValueError if it is empty or too long."""
+		if not isinstance(text, str) or not text.strip():
+			raise ValueError("Empty message")
+		if len(text) > self.max_length:
+			raise ValueError(f"Message longer than {self.max_length} characters")
+		message = {"user": user_id, "message": text, "time": time.time()}
+		room = self._history.get(group_name)
+		if room is None:
+			room = self._history[group_name] = deque(maxlen=self.history_size)
+		room.append(message)
+		self._pending.setdefault(group_name, []).append(message)
+		MESSAGES.inc()
+		if self._wakeup is not None:
+			self._wakeup.set()
+
+	def history(self, group_name):
+		return list(self._history.get(group_name, ()))
+
+	def drop(self, group_name):
+		"""Forget a room whose clock is gone."""
+		self._history.pop(group_name, None)
+
+	async def flush(self):
+		pending, self._pending = self._pending, {}
+		with FLUSH.labels("chat").time():
+			frames = [
+				(group_name, group_frame({"event": "chat", "data": {"messages": messages}}, droppable=True))
+				for group_name, messages in pending.items()
+			]
+			with CHANNEL_SEND.labels("chat").time():
+				await group_send_many(get_channel_layer(), frames)
+
+	async def run(self):
+		"""Flush loop; idles while nobody talks."""
+		self._wakeup = asyncio.Event()
+		if self._pending:
+			self._wakeup.set()
+		try:
+			while True:
+				await self._wakeup.wait()
+				await asyncio.sleep(self.interval)
+				self._wakeup.clear()
+				try:
+					await self.flush()
+				except Exception:
+					# Those messages stay in the history for late joiners
+					logger.exception("chat flush failed")
+		finally:
+			self._wakeup = None
+
+chat = ChatHub()
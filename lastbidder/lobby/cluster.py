@@ -0,0 +1,405 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+import redis.asyncio as aioredis
+from channels.db import database_sync_to_async
+from django.conf import settings
+from lastbidder.chain.models import ClockCreation
+from lastbidder.metrics import Gauge
+from .broadcast import broadcaster
+from .chat import chat
+from .ledger import ledger
+from .models import clock, MAIN_CLOCK_ID
+from .proxy import proxy_book
+from .registry import registry
+
+logger = logging.getLogger(__name__)
+
+LEADER = Gauge('lobby_clock_leader', 'Whether this worker holds the clock lease')
+
+# Every key lives under one hash tag so the scripts can touch them atomically:
+#   leader        - lease, the token of the worker that expires clocks
+#   deadlines     - sorted set clock id -> deadline of the active rounds
+#   clock:<id>    - hash round, deadline, active, bidder, wallet, bids, seq
+#                   (seq counts every bid of the clock, across rounds, and
+#                   orders the update frames of different workers)
+# Times are taken from the Redis server so workers never compare clocks.
+
+NOW = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+"""
+
+# Create the clock unless it exists, then return its state.
+# ARGV: clock id, round id, duration, deadline or '', bidder, wallet, bids
+JOIN_SCRIPT = NOW + """
+local created = 0
+if redis.call('EXISTS', KEYS[1]) == 0 then
+	local deadline = tonumber(ARGV[4]) or now + tonumber(ARGV[3])
+	redis.call('HSET', KEYS[1], 'round', ARGV[2], 'deadline', tostring(deadline), 'active', '1',
+		'bidder', ARGV[5], 'wallet', ARGV[6], 'bids', ARGV[7])
+	redis.call('ZADD', KEYS[2], deadline, ARGV[1])
+	created = 1
+end
+local s = redis.call('HMGET', KEYS[1], 'round', 'deadline', 'active', 'bidder', 'wallet', 'bids', 'seq')
+return {created, s[1], tostring(tonumber(s[2]) - now), s[3], s[4], s[5], s[6], tostring(tonumber(s[7]) or 0)}
+"""
+
+# Compare-and-extend: move the deadline of a live round by ``extension`` if
+# the round and its bid count are still the ones the extension was computed
+# for, or start a new round. A stale bid gets the current state back to
+# retry with. A round whose deadline passed before the leader saw it is
+# closed here.
+# ARGV: clock id, round id for a new round, bidder, wallet,
+#       expected round, expected bids, extension, extension of a first bid
+BID_SCRIPT = NOW + """
+local s = redis.call('HMGET', KEYS[1], 'round', 'deadline', 'active', 'bidder', 'wallet', 'bids')
+local deadline = tonumber(s[2])
+local bids = tonumber(s[6]) or 0
+local closed = {'', '', ''}
+local active = s[3] == '1'
+if active and deadline <= now then
+	closed = {s[1], s[4], s[5]}
+	active = false
+end
+local round = s[1]
+local started = 0
+if active then
+	if round ~= ARGV[5] or bids ~= tonumber(ARGV[6]) then
+		return {-1, round, tostring(deadline - now), tostring(bids)}
+	end
+	deadline = deadline + tonumber(ARGV[7])
+	bids = bids + 1
+else
+	round = ARGV[2]
+	deadline = now + tonumber(ARGV[8])
+	bids = 1
+	started = 1
+end
+redis.call('HSET', KEYS[1], 'round', round, 'deadline', tostring(deadline), 'active', '1',
+	'bidder', ARGV[3], 'wallet', ARGV[4], 'bids', tostring(bids))
+redis.call('ZADD', KEYS[2], deadline, ARGV[1])
+local seq = redis.call('HINCRBY', KEYS[1], 'seq', 1)
+return {started, round, tostring(deadline - now), closed[1], closed[2], closed[3], tostring(seq)}
+"""
+
+# Leader only: close every round past its deadline.
+# ARGV: lease token, clock key prefix
+# Returns {held, delay to the next deadline or '', (id, round, bidder, wallet)...}
+EXPIRE_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+	return {0, ''}
+end
+""" + NOW + """
+local reply = {1, ''}
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+	local key = ARGV[2] .. id
+	local s = redis.call('HMGET', key, 'round', 'deadline', 'active', 'bidder', 'wallet')
+	redis.call('ZREM', KEYS[2], id)
+	if s[3] == '1' then
+		redis.call('HSET', key, 'active', '0')
+		for _, value in ipairs({id, s[1], s[4] or '', s[5] or ''}) do
+			table.insert(reply, value)
+		end
+	end
+end
+local first = redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')
+if first[2] then
+	reply[2] = tostring(tonumber(first[2]) - now)
+end
+return reply
+"""
+
+# Lease compare-and-extend and compare-and-delete, ARGV: token, ttl in ms
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+	return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+	return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class LocalClocks:
+	"""Clocks owned by this process: one worker, expiry on the local scheduler."""
+
+	distributed = False
+
+	async def join(self, clock_id):
+		return registry.acquire(clock_id)
+
+	def leave(self, clock_id):
+		registry.release(clock_id)
+
+	async def restore(self, clock_id, round_id, deadline, last_bidder, last_wallet=None, bids=0):
+		registry.restore(clock_id, round_id, deadline, last_bidder, last_wallet, bids)
+
+	async def bid(self, clk, bidder, wallet=None, tx_hash=None):
+		clk.add_time(bidder, wallet, tx_hash)
+
+	async def proxy(self, clk, bidder, wallet, budget, tx_hashes=()):
+		"""Place, replace or cancel (``budget`` 0) a standing order on ``clk``."""
+		if not clk.is_active and budget:
+			raise ValueError("The round is over, bid to start a new one")
+		proxy_book(clk).place(bidder, wallet, budget, tx_hashes)
+		# The order may have to answer before the current deadline
+		clk.start()
+
+class MirrorClock(clock):
+	"""Local copy of a clock held in Redis.
+
+	A round is over once its deadline passes, whether or not the leader
+	has closed it yet, so followers never show a dead round as running.
+	"""
+
+	@property
+	def is_active(self):
+		return self._active and self.deadline > time.monotonic()
+
+	@is_active.setter
+	def is_active(self, active):
+		self._active = active
+
+class RedisClocks:
+	"""Clocks shared by every worker through Redis.
+
+	The state of each clock lives in Redis and bids from any worker extend
+	it with one atomic compare-and-extend script, so workers never disagree
+	on the deadline or the winner. The extension is computed by the worker
+	with the clock's time curve; a bid that raced another worker's is
+	retried with the fresh state, up to ``retries`` times. Bids of one
+	worker on one clock are sent one at a time so they never race each other.
+
+	Expiry is done by a single leader holding a lease of ``lease_ttl``,
+	three quarters of a ``tick`` by default. Every worker looks at the lease
+	every third of its ttl: the leader renews it with a compare-and-extend,
+	the others try to take it. A leader that shuts down hands the lease over
+	at once and one that dies loses it when it lapses, so another worker
+	takes over within one tick either way. The expiry script checks the
+	lease too, a deposed leader cannot close a round.
+
+	Workers keep a local :class:`MirrorClock` per watched clock for snapshots
+	and broadcasts; mirrors are never scheduled. A mirror only catches up on
+	its own worker's bids, so its frames carry the clock's ``seq`` and
+	sockets drop any frame older than one they already have.
+	"""
+
+	distributed = True
+
+	def __init__(self, host='localhost', port=6379, prefix='clocks', tick=0.2, lease_ttl=None, duration=100, retries=5):
+		self.host = host
+		self.port = port
+		self.tick = tick
+		self.lease_ttl = lease_ttl if lease_ttl is not None else tick * 3 / 4
+		self.poll = self.lease_ttl / 3
+		self.duration = duration
+		self.retries = retries
+		tag = f"{{{prefix}}}"
+		self.lease_key = f"{tag}:leader"
+		self.deadlines_key = f"{tag}:deadlines"
+		self.clock_prefix = f"{tag}:clock:"
+		self.token = uuid.uuid4().hex
+		self.leading = False
+		self._clients = {}
+		self._mirrors = {}
+		self._watchers = {}
+		self._locks = {}
+
+	def _client(self):
+		# redis.asyncio connections are bound to the loop that opened them
+		loop = asyncio.get_running_loop()
+		client = self._clients.get(loop)
+		if client is None:
+			client = aioredis.Redis(host=self.host, port=self.port, decode_responses=True)
+			self._clients[loop] = client
+		return client
+
+	def _keys(self, clock_id):
+		return [f"{self.clock_prefix}{clock_id}", self.deadlines_key]
+
+	@staticmethod
+	def _apply(clk, round_id, remaining, active, bidder, wallet, bids, seq):
+		clk.round_id = uuid.UUID(round_id)
+		clk.deadline = time.monotonic() + float(remaining)
+		clk.is_active = active
+		clk.last_bidder = json.loads(bidder) if bidder else None
+		clk.last_wallet = wallet or None
+		clk.bids = int(bids)
+		clk.seq = int(seq)
+
+	async def _create(self, clock_id, round_id, deadline='', last_bidder=None, last_wallet=None, bids=0):
+		return await self._client().eval(JOIN_SCRIPT, 2, *self._keys(clock_id),
+			clock_id, str(round_id), self.duration, deadline,
+			json.dumps(last_bidder) if last_bidder is not None else '', last_wallet or '', bids)
+
+	async def join(self, clock_id):
+		"""Return the mirror of ``clock_id``, creating the clock in Redis if needed."""
+		created, round_id, remaining, active, bidder, wallet, bids, seq = await self._create(clock_id, uuid.uuid4())
+		clk = self._mirrors.get(clock_id)
+		if clk is None:
+			clk = self._mirrors[clock_id] = MirrorClock(clock_id, round_id=round_id)
+			self._locks[clock_id] = asyncio.Lock()
+		self._apply(clk, round_id, remaining, active == '1', bidder, wallet, bids, seq)
+		if created:
+			ledger.open_round(clk)
+		self._watchers[clock_id] = self._watchers.get(clock_id, 0) + 1
+		return clk
+
+	def leave(self, clock_id):
+		"""Drop a watcher; the mirror goes with the last one, Redis keeps the clock."""
+		count = self._watchers.get(clock_id, 0) - 1
+		if count > 0:
+			self._watchers[clock_id] = count
+			return
+		self._watchers.pop(clock_id, None)
+		clk = self._mirrors.pop(clock_id, None)
+		self._locks.pop(clock_id, None)
+		if clk is not None and clock_id != MAIN_CLOCK_ID:
+			chat.drop(clk.group_name)
+
+	async def restore(self, clock_id, round_id, deadline, last_bidder, last_wallet=None, bids=0):
+		"""Put a round recovered from the ledger back, unless Redis still has the clock."""
+		await self._create(clock_id, round_id, repr(deadline), last_bidder, last_wallet, bids)
+
+	async def bid(self, clk, bidder, wallet=None, tx_hash=None):
+		lock = self._locks.get(clk.clock_id)
+		if lock is None:
+			await self._bid(clk, bidder, wallet, tx_hash)
+			return
+		async with lock:
+			await self._bid(clk, bidder, wallet, tx_hash)
+
+	async def proxy(self, clk, bidder, wallet, budget, tx_hashes=()):
+		# Standing orders fire from the local scheduler, which mirrors never
+		# join; not supported with several workers (see LOBBY_CLOCKS)
+		raise ValueError("Auto-bidding is not available on this server")
+
+	async def _bid(self, clk, bidder, wallet, tx_hash):
+		curve = clk.curve
+		first = curve.opening()
+		round_id, remaining, bids = str(clk.round_id), clk.remaining_time, clk.bids
+		for _ in range(self.retries):
+			extension = curve.extension(remaining, bids)
+			reply = await self._client().eval(BID_SCRIPT, 2, *self._keys(clk.clock_id),
+				clk.clock_id, str(uuid.uuid4()), json.dumps(bidder), wallet or '',
+				round_id, bids, extension, first)
+			if int(reply[0]) >= 0:
+				break
+			# Another worker's bid got in first
+			_, round_id, remaining, bids = reply
+			remaining, bids = float(remaining), int(bids)
+		else:
+			raise RuntimeError("Clock is too busy, bid again")
+		started, round_id, remaining, closed_round, closed_bidder, closed_wallet, seq = reply
+		if closed_round:
+			# The deadline passed before the leader closed the round
+			self._close(clk.clock_id, closed_round, closed_bidder, closed_wallet)
+		started = int(started)
+		self._apply(clk, round_id, remaining, True, json.dumps(bidder), wallet, 1 if started else bids + 1, seq)
+		clk.bid_time = first if started else extension
+		if started:
+			ledger.open_round(clk)
+		ledger.record_bid(clk, bidder, wallet, tx_hash)
+		broadcaster.mark_bid(clk)
+
+	def _close(self, clock_id, round_id, bidder, wallet):
+		ended = clock(clock_id, duration=0, round_id=uuid.UUID(round_id))
+		ended.last_bidder = json.loads(bidder) if bidder else None
+		ended.last_wallet = wallet or None
+		mirror = self._mirrors.get(clock_id)
+		if mirror is not None and mirror.round_id == ended.round_id:
+			mirror.is_active = False
+		ended._finish(asyncio.get_running_loop())
+
+	async def _campaign(self):
+		client = self._client()
+		ttl = int(self.lease_ttl * 1000)
+		was_leading = self.leading
+		if self.leading:
+			self.leading = bool(await client.eval(RENEW_SCRIPT, 1, self.lease_key, self.token, ttl))
+		if not self.leading:
+			self.leading = bool(await client.set(self.lease_key, self.token, nx=True, px=ttl))
+		if self.leading != was_leading:
+			LEADER.set(int(self.leading))
+			logger.info("clock lease %s", "acquired" if self.leading else "lost", extra={"token": self.token})
+
+	async def _expire_due(self):
+		"""Close the rounds past their deadline, return the delay to the next one."""
+		reply = await self._client().eval(EXPIRE_SCRIPT, 2, self.lease_key, self.deadlines_key,
+			self.token, self.clock_prefix)
+		if not int(reply[0]):
+			self.leading = False
+			LEADER.set(0)
+			return self.poll
+		for i in range(2, len(reply), 4):
+			clock_id, round_id, bidder, wallet = reply[i:i + 4]
+			self._close(int(clock_id), round_id, bidder, wallet)
+		return float(reply[1]) if reply[1] else self.poll
+
+	async def run(self):
+		"""Lease and expiry loop, run by every worker."""
+		try:
+			while True:
+				delay = self.poll
+				try:
+					await self._campaign()
+					if self.leading:
+						delay = max(0.0, min(delay, await self._expire_due()))
+				except Exception:
+					logger.exception("clock lease loop failed")
+					if self.leading:
+						self.leading = False
+						LEADER.set(0)
+				await asyncio.sleep(delay)
+		finally:
+			if self.leading:
+				# Hand over now instead of waiting for the lease to lapse
+				self.leading = False
+				LEADER.set(0)
+				await self._client().eval(RELEASE_SCRIPT, 1, self.lease_key, self.token)
+
+_known = set()
+
+async def clock_exists(clock_id):
+	"""Whether sockets may open ``clock_id``.
+
+	The main clock, the clocks listed in ``settings.LOBBY_EXTRA_CLOCKS`` and
+	the clocks created on chain exist. Any other id is refused, or a client
+	could make the backend hold clocks without bound. A clock found on chain
+	is remembered, clocks are never deleted there.
+	"""
+	if clock_id == MAIN_CLOCK_ID or clock_id in _known or clock_id in getattr(settings, 'LOBBY_EXTRA_CLOCKS', ()):
+		return True
+	if await database_sync_to_async(ClockCreation.objects.filter(clock_id=clock_id).exists)():
+		_known.add(clock_id)
+		return True
+	return False
+
+_clocks = None
+
+def get_clocks():
+	"""Return the clock backend configured in ``settings.LOBBY_CLOCKS``.
+
+	The Redis backend defaults to the first host of the channel layer.
+	"""
+	global _clocks
+	if _clocks is None:
+		config = dict(getattr(settings, 'LOBBY_CLOCKS', {}))
+		backend = config.pop('BACKEND', 'memory')
+		options = {key.lower(): value for key, value in config.items()}
+		if backend == 'redis':
+			if 'host' not in options:
+				hosts = settings.CHANNEL_LAYERS['default'].get('CONFIG', {}).get('hosts', [])
+				if hosts and isinstance(hosts[0], (tuple, list)):
+					options['host'], options['port'] = hosts[0]
+			_clocks = RedisClocks(**options)
+		else:
+			_clocks = LocalClocks()
+	return _clocks
@@ -0,0 +1,77 @@
+import json
+import msgpack
+
+try:
+	import orjson
+except ImportError:  # orjson is an optional speedup for the JSON codec
+	orjson = None
+
+class JsonCodec:
+	"""Default text codec, backed by orjson when it is installed."""
+
+	name = "JSON"
+	binary = False
+
+	def encode(self, payload):
+		if orjson is not None:
+			return orjson.dumps(payload).decode()
+		return json.dumps(payload)
+
+	def decode(self, data):
+		if orjson is not None:
+			return orjson.loads(data)
+		return json.loads(data)
+
+class MsgpackCodec:
+	"""Binary codec, selected with the ``lastbidder.msgpack`` subprotocol."""
+
+	name = "msgpack"
+	binary = True
+
+	def encode(self, payload):
+		return msgpack.packb(payload)
+
+	def decode(self, data):
+		return msgpack.unpackb(data)
+
+json_codec = JsonCodec()
+msgpack_codec = MsgpackCodec()
+
+# Websocket subprotocol -> codec, in server preference order
+SUBPROTOCOLS = {
+	"lastbidder.msgpack": msgpack_codec,
+	"lastbidder.json": json_codec,
+}
+
+def negotiate(subprotocols):
+	"""Pick the codec for a socket from the subprotocols the client offered.
+
+	Returns ``(subprotocol, codec)``; the subprotocol is None when the client
+	did not ask for one, in which case plain JSON text frames are used.
+	"""
+	for subprotocol, codec in SUBPROTOCOLS.items():
+		if subprotocol in subprotocols:
+			return subprotocol, codec
+	return None, json_codec
+
+def group_frame(payload, key=None, droppable=False, seq=None):
+	"""Channel-layer message carrying ``payload`` encoded once per codec.
+
+	Every recipient forwards the pre-encoded frame matching its own codec,
+	so a broadcast costs one encode per codec instead of one per socket.
+	``key`` and ``droppable`` tell the socket outboxes how the frame may be
+	condensed when a client falls behind, and ``seq`` which frame of a key
+	is the newest (see :class:`Outbox`).
+	"""
+	message = {
+		"type": "lobby.frame",
+		"text": json_codec.encode(payload),
+		"bytes": msgpack_codec.encode(payload),
+	}
+	if key is not None:
+		message["key"] = key
+	if droppable:
+		message["droppable"] = True
+	if seq is not None:
+		message["seq"] = seq
+	return message
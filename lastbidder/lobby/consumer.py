@@ -1,257 +1,299 @@
 import asyncio
+import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
-from django.core.cache import cache
-import json
-from .models import clock
-import time
-from channels.layers import get_channel_layer	
+from django.conf import settings
+from .codec import negotiate, group_frame
+from .models import MAIN_CLOCK_ID
+from .cluster import clock_exists, get_clocks
+from .broadcast import broadcaster, Broadcaster, LOBBY_GROUP
+from .capture import get_recorder, IN, OUT, CLOSE
+from .chat import chat
+from .outbox import Outbox
+from .relay import relay
+from .presence import get_presence
+from .ratelimit import get_bid_limiter
+from lastbidder.chain.verifier import get_verifier, is_tx_hash
+from .service import service
+from lastbidder.logs import Sampler
+from lastbidder.metrics import Counter, Gauge
 
 import os	
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lastbidder.settings')
 
-my_clock = clock()  # Initialize the clock with 60 seconds
+logger = logging.getLogger(__name__)
+bid_log = Sampler(interval=1.0)  # One bid line per clock and second
+
+BIDS = Counter('lobby_bids_total', 'Bids received, by outcome', ['result'])
+SOCKETS = Gauge('lobby_sockets', 'Open lobby websockets in this process')
+
+PROXY_MAX_BIDS = getattr(settings, 'LOBBY_PROXY_BIDS', {}).get('MAX_BIDS', 1000)
+
+# Pre-encoded so rejecting a flood costs no serialization
+RATE_LIMITED = group_frame({
+	"event": "bid_error",
+	"data": {"message": "Too many bids, slow down"}
+})
 
 class LobbyConsumer(AsyncWebsocketConsumer):
+	# Traffic capture of this socket, when settings.LOBBY_CAPTURE is set
+	recorder = None
+	capture_id = None
+
 	async def connect(self):
-        # Add the user to the "lobby" group
-		await self.channel_layer.group_add("lobby", self.channel_name)
-		await self.accept()
+		# Identity comes from the access token checked by JWTAuthMiddleware
+		self.userId = self.scope.get('user_id')
+		self.wallet = self.scope.get('wallet')
+		if self.userId is None:
+			await self.close(code=4401)
+			return
+		# Daphne has no lifespan events: the first socket starts the lobby service
+		await service.ensure_started()
+		# Join the group of the clock named in the route (main clock by default)
+		self.clock_id = self.scope['url_route']['kwargs'].get('clock_id', MAIN_CLOCK_ID)
+		if not await clock_exists(self.clock_id):
+			await self.close(code=4404)
+			return
+		self.clock = await get_clocks().join(self.clock_id)
+		await self.channel_layer.group_add(self.clock.group_name, self.channel_name)
+		await self.channel_layer.group_add(LOBBY_GROUP, self.channel_name)
+		subprotocol, self.codec = negotiate(self.scope.get('subprotocols', []))
+		await self.accept(subprotocol=subprotocol)
+		SOCKETS.inc()
+		self.recorder = get_recorder()
+		if self.recorder is not None:
+			self.capture_id = self.recorder.open(self.userId, self.wallet, self.scope['path'], subprotocol)
+		# Everything sent to this socket goes through its outbox from now on
+		self.outbox = Outbox(self.write_frame, on_overflow=self.fell_behind)
+		self.writer = asyncio.ensure_future(self.outbox.run())
+		# Updates are only pushed on change, so start the socket from a snapshot
+		data = Broadcaster.clock_state(self.clock)
+		data["num_connected_users"] = await get_presence().count()
+		await self.send_frame({"event": "update", "data": data}, key=self.clock.group_name, seq=self.clock.seq)
+		history = chat.history(self.clock.group_name)
+		if history:
+			await self.send_frame({"event": "chat", "data": {"messages": history}})
+		await self.update_user_list({'action': 'add'})
 
 	async def disconnect(self, close_code):
-        # Remove the user from the "lobby" group
-		await self.channel_layer.group_discard("lobby", self.channel_name)
+		# A socket refused during the handshake never got a clock or a writer
+		clk = getattr(self, 'clock', None)
+		if getattr(self, 'userId', None) is None or clk is None:
+			return
+		# Leave the clock's group and let the clocks backend drop it if idle
+		await self.channel_layer.group_discard(clk.group_name, self.channel_name)
+		await self.channel_layer.group_discard(LOBBY_GROUP, self.channel_name)
+		get_clocks().leave(self.clock_id)
+		writer = getattr(self, 'writer', None)
+		if writer is None:
+			# Closed before accept: nothing else was registered
+			return
+		relay.leave(clk.group_name, self.userId)
 		await self.update_user_list({'action': 'remove'})
+		writer.cancel()
+		SOCKETS.dec()
+		if self.recorder is not None:
+			self.recorder.record(self.capture_id, CLOSE, close_code)
 		await self.close()
 
-	async def receive(self, text_data):
+	async def receive(self, text_data=None, bytes_data=None):
+		if self.recorder is not None:
+			self.recorder.record(self.capture_id, IN, text_data if text_data is not None else bytes_data)
 		try:
-			text_data_json = json.loads(text_data)
-			event = text_data_json['event']
-			data = text_data_json['data']
-
-            # Dictionary mapping events to handler functions
-			event_handlers = {
-                'paddle_moved': self.send_lobby_message,
-                'connect': self.first_msg,
-                'bid': self.bid,
-                'chat': self.send_lobby_message,
-            }
+			message = self.codec.decode(text_data if text_data is not None else bytes_data)
+		except Exception:
+			# Malformed input, or a text frame on a binary socket (and the reverse)
+			await self.send_frame({"error": f"Invalid {self.codec.name}"})
+			return
+		try:
+			event = message['event']
+			data = message['data']
 
-            # Get the handler function from the dictionary, default to handle_unknown_event
-			handler = event_handlers.get(event, self.handle_unknown_event)
+            # Get the handler function from the class table, default to handle_unknown_event
+			handler = self.event_handlers.get(event, LobbyConsumer.handle_unknown_event)
 
             # Call the handler function with the data
-			await handler(data)
-		except json.JSONDecodeError:
-			await self.send(text_data=json.dumps({"error": "Invalid JSON"}))
+			await handler(self, data)
 		except KeyError:
-			await self.send(text_data=json.dumps({"error": "Missing event or data"}))
+			await self.send_frame({"error": "Missing event or data"})
 		except Exception as e:
-			await self.send(text_data=json.dumps({"error": str(e)}))
+			await self.send_frame({"error": str(e)})
 
-	async def send_lobby_message(self, message):
-		# Send a message to the lobby group
-		await self.channel_layer.group_send(
-			"lobby",
-			{
-				"type": "chat_message",
-    			"message": message,
-			},
-		)
+	async def send_frame(self, payload, key=None, seq=None):
+		# Encode a frame for this socket only
+		if self.codec.binary:
+			self.outbox.put({"bytes": self.codec.encode(payload)}, key, seq=seq)
+		else:
+			self.outbox.put({"text": self.codec.encode(payload)}, key, seq=seq)
 
-	async def chat_message(self, event):
-        # Send the message to the WebSocket
-		message = event["message"]
-		await self.send(text_data=json.dumps({"type": "chat", "message": message}))
+	async def lobby_frame(self, event):
+		# Queue a group frame that was encoded once by its sender
+		self.outbox.put(event, event.get("key"), event.get("droppable", False), event.get("seq"))
 
-	async def handle_unknown_event(self, event, data):
-		await self.send(text_data=json.dumps({"error": "Unknown event"}))
+	def fell_behind(self):
+		# Too slow to keep up with the lobby: close with 1013 (try again later),
+		# the client reconnects and starts over from a snapshot
+		self.writer.cancel()
+		asyncio.ensure_future(self.close(code=1013))
+
+	async def write_frame(self, frame):
+		data = frame["bytes"] if self.codec.binary else frame["text"]
+		if self.recorder is not None:
+			self.recorder.record(self.capture_id, OUT, data)
+		if self.codec.binary:
+			await self.send(bytes_data=data)
+		else:
+			await self.send(text_data=data)
+
+	async def paddle_moved(self, data):
+		# Only the latest position is relayed, on the relay's next tick
+		try:
+			relay.move(self.clock.group_name, self.userId, data.get('x'), data.get('y'))
+		except (AttributeError, ValueError):
+			await self.send_frame({"error": "Invalid paddle position"})
+
+	async def send_chat(self, data):
+		# Batched with the room's other messages by the chat hub
+		text = data.get('message') if isinstance(data, dict) else data
+		try:
+			chat.post(self.clock.group_name, self.userId, text)
+		except ValueError as e:
+			await self.send_frame({"event": "chat_error", "data": {"message": str(e)}})
+
+	async def handle_unknown_event(self, data):
+		await self.send_frame({"error": "Unknown event"})
 
 	async def update_user_list(self, data):
+		presence = get_presence()
 		if data.get('action') == 'add':
-			cache.set(self.userId, self.wallet)
-			connected_user_ids = cache.get('connected_user_ids', set())
-			connected_user_ids.add(self.userId)
-			cache.set('connected_user_ids', connected_user_ids)
+			await presence.join(self.channel_name, str(self.userId))
 		elif data.get('action') == 'remove':
-            # Remove the user from the cache
-			cache.delete(self.userId)
-			connected_user_ids = cache.get('connected_user_ids', set())
-			connected_user_ids.discard(self.userId)
-			cache.set('connected_user_ids', connected_user_ids)
+			await presence.leave(self.channel_name, str(self.userId))
+		broadcaster.mark_users(await presence.count())
+
+	async def heartbeat(self, data):
+		# Keep this connection alive in the presence set; one reaped during a
+		# stall is counted again
+		presence = get_presence()
+		if await presence.heartbeat(self.channel_name, str(self.userId)):
+			broadcaster.mark_users(await presence.count())
 
 	async def first_msg(self, data):
-        # Store the wallet address in the consumer's scope
-		self.wallet = data.get('walletAddress')
-		self.userId = data.get('userId')
+		# The socket is registered at connect from its token: the client's
+		# userId and walletAddress are no longer trusted, just acknowledged
+		await self.send_frame({
+			"event": "connected",
+			"data": {"userId": self.userId, "walletAddress": self.wallet}
+		})
 
-		
-		if not self.userId:
-			await self.send(text_data=json.dumps({"error": "User ID is required"}))
-			return
-		if not self.wallet:
-			await self.send(text_data=json.dumps({"error": "Wallet address is required"}))
+	async def bid(self, data):
+		# Over-limit bids never reach the clock or the channel layer
+		if not await get_bid_limiter().allow(self.channel_name, self.wallet, self.clock_id):
+			BIDS.labels('rate_limited').inc()
+			await self.lobby_frame(RATE_LIMITED)
 			return
-		await self.update_user_list({'action': 'add'})
 
-	async def bid(self, data):
-		# Get userId from data if available, otherwise use the one from connection
-		userId = data.get('userId', self.userId) if isinstance(data, dict) else self.userId
+		# Bids are always made by the authenticated user of the connection
+		userId = self.userId
 		transactionHash = data.get('transactionHash') if isinstance(data, dict) else None
-		
-		print(f'User {userId} placed a bid' + (f' with tx: {transactionHash}' if transactionHash else ''))
-		
-		# Basic validation
-		if not userId:
-			await self.send(text_data=json.dumps({
-				"event": "bid_error",
-				"data": {"message": "Missing user ID"}
-			}))
-			return
-		
-		# Log the transaction hash if provided
-		if transactionHash:
-			print(f"Transaction hash: {transactionHash}")
-		
-		# Add time to the clock
-		old_time = my_clock.remaining_time
-		await my_clock.add_time(userId)
-		new_time = my_clock.remaining_time
-		
-		print(f"Time updated: {old_time} → {new_time}")
-		
-		# Reset the clock if it's not active
-		if not my_clock.is_active:
-			my_clock.is_active = True
-			# Start a new run_clock task
-			asyncio.create_task(my_clock.run_clock())
-		
-		# Send immediate feedback to all users
-		await self.channel_layer.group_send(
-			"lobby",
-			{
-				"type": "bid_notification",
-				"data": {
-					"bidder": userId,
-					"new_time": new_time,
-					"old_time": old_time,
-					"added_time": my_clock.bid_time,
-					"transaction_hash": transactionHash
-				}
-			}
-		)
-		
-		# Also send a direct confirmation to the bidder
-		await self.send(text_data=json.dumps({
+
+		# With a chain configured every bid needs a transaction, checked on chain
+		# in the background: the clock does not wait. A transaction can only
+		# back one bid, and a bid whose transaction is rejected cannot win.
+		verifier = get_verifier()
+		tx_hash = None
+		if verifier is not None:
+			if not is_tx_hash(transactionHash):
+				BIDS.labels('missing_tx').inc()
+				await self.send_frame({
+					"event": "bid_rejected",
+					"data": {"message": "A valid transactionHash is required to bid"}
+				})
+				return
+			tx_hash = transactionHash.lower()
+			if not verifier.submit(tx_hash, self.wallet, self.clock_id, self.channel_name):
+				BIDS.labels('duplicate_tx').inc()
+				await self.send_frame({
+					"event": "bid_rejected",
+					"data": {
+						"message": "Transaction already used for a bid",
+						"transaction_hash": transactionHash
+					}
+				})
+				return
+
+		# Add time to the clock, the lobby hears about it on the next broadcast tick
+		old_time = self.clock.remaining_time
+		try:
+			await get_clocks().bid(self.clock, userId, self.wallet, tx_hash)
+		except Exception:
+			if tx_hash is not None:
+				verifier.withdraw(tx_hash)
+			raise
+		new_time = self.clock.remaining_time
+		BIDS.labels('accepted').inc()
+
+		skipped = bid_log(self.clock_id)
+		if skipped is not None:
+			logger.info("bid", extra={
+				"clock_id": self.clock_id,
+				"user": userId,
+				"tx": transactionHash,
+				"old_time": round(old_time, 3),
+				"new_time": round(new_time, 3),
+				"skipped": skipped,
+			})
+
+		# Send a direct confirmation to the bidder
+		await self.send_frame({
 			"event": "bid_success",
 			"data": {
 				"message": "Your bid was successful",
 				"new_time": new_time,
 				"transaction_hash": transactionHash
 			}
-		}))
+		})
 
-	async def bid_notification(self, event):
-		# Send the bid notification to the WebSocket
-		await self.send(text_data=json.dumps({
-			"event": "bid_notification",
-			"data": event["data"],
-		}))
+	async def proxy_bid(self, data):
+		"""Let the server bid for this user on this clock, up to max_bids times.
+
+		With a chain configured, each of those bids is paid like a manual one:
+		transactionHashes lists one participation transaction per bid.
+		"""
+		max_bids = data.get('max_bids') if isinstance(data, dict) else None
+		if type(max_bids) is not int or not 0 <= max_bids <= PROXY_MAX_BIDS:
+			await self.send_frame({"error": f"max_bids must be an integer from 0 to {PROXY_MAX_BIDS}"})
+			return
+		tx_hashes = data.get('transactionHashes') or []
+		if (not isinstance(tx_hashes, list) or not all(is_tx_hash(tx_hash) for tx_hash in tx_hashes)
+				or len({tx_hash.lower() for tx_hash in tx_hashes}) != len(tx_hashes)):
+			await self.send_frame({"error": "transactionHashes must list distinct transaction hashes"})
+			return
+		# Without a chain nothing pays for bids, as for manual ones
+		tx_hashes = [tx_hash.lower() for tx_hash in tx_hashes] if get_verifier() is not None else []
+		await get_clocks().proxy(self.clock, self.userId, self.wallet, max_bids, tx_hashes)
+		await self.send_frame({
+			"event": "proxy_bid_set",
+			"data": {"clock_id": self.clock_id, "max_bids": max_bids}
+		})
 
 	async def transaction_confirmed(self, data):
 		"""Handle transaction confirmations"""
-		userId = data.get('userId')
 		transactionHash = data.get('transactionHash')
 		
-		print(f"Transaction confirmed for user {userId}: {transactionHash}")
-		
-		# Log the confirmation, but no need to update the clock again
-		# since we already did when the transaction was initiated
-		
-		# Notify the specific user if you want
-		await self.send(text_data=json.dumps({
-			"event": "transaction_confirmed",
-			"data": {
-				"message": "Your transaction has been confirmed on the blockchain",
-				"transaction_hash": transactionHash
-			}
-		}))
-
-	async def process_event(self, text_data):
-		try:
-			text_data_json = json.loads(text_data)
-			event = text_data_json['event']
-			data = text_data_json['data']
-
-			# Dictionary mapping events to handler functions
-			event_handlers = {
-				'paddle_moved': self.send_lobby_message,
-				'connect': self.first_msg,
-				'bid': self.bid,
-				'transaction_confirmed': self.transaction_confirmed
-			}
-
-			# Get the handler function from the dictionary, default to handle_unknown_event
-			handler = event_handlers.get(event, self.handle_unknown_event)
-
-			# Call the handler function with the data
-			await handler(data)
-		except json.JSONDecodeError:
-			await self.send(text_data=json.dumps({"error": "Invalid JSON"}))
-		except KeyError:
-			await self.send(text_data=json.dumps({"error": "Missing event or data"}))
-		except Exception as e:
-			await self.send(text_data=json.dumps({"error": str(e)}))
-
-	
-	async def update_event(self, event):
-        # Send the update event to the WebSocket
-		await self.send(text_data=json.dumps({
-			"event": "update",
-			"data": event["data"],
-		}))
-  
-	async def end_clock(self, event):
-		# Send the time expired event to the WebSocket
-		await self.send(text_data=json.dumps({
-			"event": "end_clock",
-			"data": event["data"],
-		}))
-
-async def run_infinite_loop():
-	while True:
-		# Example: Send an update event to all users every 0.5 seconds
-		connected_user_ids = cache.get('connected_user_ids', set())
-		num_connected_users = len(connected_user_ids)
-		async with my_clock.lock:
-			if my_clock.is_active:
-				cloc = my_clock.remaining_time
-		data = {
-			"num_connected_users": num_connected_users,
-			"remaining_time": cloc,
-		}
-
-		# Ensure this print statement is executed repeatedly
-		print(data)
-
-		# Broadcast the update event
-		await get_channel_layer().group_send(
-			"lobby",
-			{
-				"type": "update_event",
-				"data": data
-			}
-		)
-
-		# Wait for 0.5 seconds before the next iteration
-		await asyncio.sleep(0.5)
-
-async def run():
-    print("Starting the infinite loop...")
-    # Schedule both tasks and wait for them to run concurrently
-    await asyncio.gather(
-        run_infinite_loop(),
-        my_clock.run_clock()
-    )
+		# The client's word is not enough: the receipt is checked on chain and
+		# the verifier answers this socket with transaction_confirmed or
+		# bid_rejected. The client only tells us the receipt is worth fetching now.
+		verifier = get_verifier()
+		if verifier is not None and is_tx_hash(transactionHash):
+			verifier.prioritize(transactionHash)
 
-# Call run at startup
\ No newline at end of file
+	# Inbound events -> handlers, built once for the class instead of per frame
+	event_handlers = {
+		'paddle_moved': paddle_moved,
+		'connect': first_msg,
+		'bid': bid,
+		'proxy_bid': proxy_bid,
+		'chat': send_chat,
+		'heartbeat': heartbeat,
+		'transaction_confirmed': transaction_confirmed,
+	}
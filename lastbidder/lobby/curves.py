@@ -0,0 +1,91 @@
+import bisect
+from django.conf import settings
+
+try:
+	import numpy as np
+except ImportError:  # Only the simulator needs NumPy, the live clock does not
+	np = None
+
+class FixedCurve:
+	"""Every bid adds the same ``seconds``."""
+
+	def __init__(self, seconds=40):
+		if seconds < 0:
+			raise ValueError("A bid cannot remove time")
+		self.seconds = seconds
+
+	def extension(self, remaining, bids):
+		"""Seconds added by a bid made with ``remaining`` seconds left, after ``bids`` bids in the round."""
+		return self.seconds
+
+	def opening(self):
+		"""Seconds on the clock after a bid opens a new round."""
+		return self.seconds
+
+	def extensions(self, remaining, bids):
+		"""Vectorized :meth:`extension` over NumPy arrays, for the simulator."""
+		return np.full(np.shape(bids), float(self.seconds))
+
+	def __repr__(self):
+		return f"FixedCurve({self.seconds})"
+
+class TieredCurve:
+	"""Bids add less time as the pot grows ("paliers").
+
+	``tiers`` is a list of ``(bids, seconds)``: once the round has ``bids``
+	bids, a bid adds ``seconds``. When ``limit`` is set, a bid made with less
+	than ``limit`` seconds left adds ``below`` instead, so a clock close to
+	its end is cheaper to run out.
+	"""
+
+	def __init__(self, tiers=((0, 40),), limit=None, below=0):
+		tiers = sorted(tiers)
+		if not tiers or tiers[0][0] != 0:
+			raise ValueError("The first tier must start at 0 bids")
+		if any(seconds < 0 for _, seconds in tiers) or below < 0:
+			raise ValueError("A bid cannot remove time")
+		self.starts = [start for start, _ in tiers]
+		self.seconds = [seconds for _, seconds in tiers]
+		self.limit = limit
+		self.below = below
+
+	def extension(self, remaining, bids):
+		if self.limit is not None and remaining < self.limit:
+			return self.below
+		return self.seconds[bisect.bisect_right(self.starts, bids) - 1]
+
+	def opening(self):
+		# The first tier: ``limit`` is about a running clock close to its end
+		return self.seconds[0]
+
+	def extensions(self, remaining, bids):
+		seconds = np.asarray(self.seconds, dtype=float)[np.searchsorted(self.starts, bids, side='right') - 1]
+		if self.limit is not None:
+			seconds = np.where(remaining < self.limit, self.below, seconds)
+		return seconds
+
+	def __repr__(self):
+		tiers = list(zip(self.starts, self.seconds))
+		return f"TieredCurve({tiers}, limit={self.limit}, below={self.below})"
+
+CURVES = {
+	'fixed': FixedCurve,
+	'tiered': TieredCurve,
+}
+
+def make_time_curve(config):
+	"""Build a curve from a ``{'POLICY': name, OPTION: value...}`` dict."""
+	config = dict(config)
+	policy = config.pop('POLICY', 'fixed')
+	if policy not in CURVES:
+		raise ValueError(f"Unknown time curve {policy!r}")
+	return CURVES[policy](**{key.lower(): value for key, value in config.items()})
+
+_curve = None
+
+def get_time_curve():
+	"""Return the curve configured in ``settings.LOBBY_TIME_CURVE``."""
+	global _curve
+	if _curve is None:
+		_curve = make_time_curve(getattr(settings, 'LOBBY_TIME_CURVE', {}))
+	return _curve
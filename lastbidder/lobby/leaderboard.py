@@ -0,0 +1,255 @@
+import random
+import threading
+import redis
+from django.conf import settings
+
+# Boards kept up to date:
+#   wins   - lobby rounds won, counted when a clock expires
+#   prizes - prize won on chain in wei, from indexed ClockFinalized events
+BOARDS = ('wins', 'prizes')
+
+class SkipList:
+	"""Sorted keys with O(log n) insert, delete, rank and rank lookup.
+
+	Each link stores how many nodes it skips over (as in Redis' zset), so the
+	rank of a key is the sum of the spans crossed while searching for it.
+	"""
+
+	MAX_LEVEL = 32
+	P = 0.25
+
+	class _Node:
+		__slots__ = ('key', 'next', 'span')
+
+		def __init__(self, key, level):
+			self.key = key
+			self.next = [None] * level
+			self.span = [0] * level
+
+	def __init__(self):
+		self._head = self._Node(None, self.MAX_LEVEL)
+		self._level = 1
+		self._size = 0
+
+	def __len__(self):
+		return self._size
+
+	def _random_level(self):
+		level = 1
+		while level < self.MAX_LEVEL and random.random() < self.P:
+			level += 1
+		return level
+
+	def insert(self, key):
+		update = [None] * self.MAX_LEVEL
+		rank = [0] * self.MAX_LEVEL
+		node = self._head
+		for i in range(self._level - 1, -1, -1):
+			rank[i] = rank[i + 1] if i < self._level - 1 else 0
+			while node.next[i] is not None and node.next[i].key < key:
+				rank[i] += node.span[i]
+				node = node.next[i]
+			update[i] = node
+		level = self._random_level()
+		if level > self._level:
+			for i in range(self._level, level):
+				rank[i] = 0
+				update[i] = self._head
+				self._head.span[i] = self._size
+			self._level = level
+		new = self._Node(key, level)
+		for i in range(level):
+			new.next[i] = update[i].next[i]
+			update[i].next[i] = new
+			new.span[i] = update[i].span[i] - (rank[0] - rank[i])
+			update[i].span[i] = rank[0] - rank[i] + 1
+		for i in range(level, self._level):
+			update[i].span[i] += 1
+		self._size += 1
+
+	def remove(self, key):
+		update = [None] * self.MAX_LEVEL
+		node = self._head
+		for i in range(self._level - 1, -1, -1):
+			while node.next[i] is not None and node.next[i].key < key:
+				node = node.next[i]
+			update[i] = node
+		node = node.next[0]
+		if node is None or node.key != key:
+			return False
+		for i in range(self._level):
+			if update[i].next[i] is node:
+				update[i].span[i] += node.span[i] - 1
+				update[i].next[i] = node.next[i]
+			else:
+				update[i].span[i] -= 1
+		while self._level > 1 and self._head.next[self._level - 1] is None:
+			self._level -= 1
+		self._size -= 1
+		return True
+
+	def rank(self, key):
+		"""0-based position of ``key``, or None if absent."""
+		rank = 0
+		node = self._head
+		for i in range(self._level - 1, -1, -1):
+			while node.next[i] is not None and node.next[i].key <= key:
+				rank += node.span[i]
+				node = node.next[i]
+			if node.key == key:
+				return rank - 1
+		return None
+
+	def slice(self, start, stop):
+		"""Keys at positions ``start`` to ``stop - 1``."""
+		traversed = 0
+		node = self._head
+		for i in range(self._level - 1, -1, -1):
+			while node.next[i] is not None and traversed + node.span[i] <= start:
+				traversed += node.span[i]
+				node = node.next[i]
+		keys = []
+		node = node.next[0]
+		while node is not None and len(keys) < stop - start:
+			keys.append(node.key)
+			node = node.next[0]
+		return keys
+
+class BaseLeaderboard:
+	"""Per-board scores of wallets, highest first.
+
+	Boards are updated incrementally with :meth:`add` when a round ends, so
+	reading the top or the rank of a wallet never aggregates bids.
+	"""
+
+	def add(self, board, wallet, amount):
+		raise NotImplementedError
+
+	def top(self, board, limit=10):
+		"""``[(wallet, score), ...]`` of the ``limit`` best wallets."""
+		raise NotImplementedError
+
+	def rank(self, board, wallet):
+		"""``(rank, score)`` of ``wallet``, 1 for the best, or None if unranked."""
+		raise NotImplementedError
+
+	def reset(self, board):
+		raise NotImplementedError
+
+class InMemoryLeaderboard(BaseLeaderboard):
+	"""Process-local backend on skip lists, for tests and dev."""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._scores = {board: {} for board in BOARDS}
+		self._order = {board: SkipList() for board in BOARDS}
+
+	def add(self, board, wallet, amount):
+		with self._lock:
+			scores, order = self._scores[board], self._order[board]
+			score = scores.get(wallet)
+			if score is not None:
+				order.remove((-score, wallet))
+			score = (score or 0) + amount
+			if score:
+				scores[wallet] = score
+				order.insert((-score, wallet))
+			else:
+				scores.pop(wallet, None)
+
+	def top(self, board, limit=10):
+		with self._lock:
+			return [(wallet, -score) for score, wallet in self._order[board].slice(0, limit)]
+
+	def rank(self, board, wallet):
+		with self._lock:
+			score = self._scores[board].get(wallet)
+			if score is None:
+				return None
+			return self._order[board].rank((-score, wallet)) + 1, score
+
+	def reset(self, board):
+		with self._lock:
+			self._scores[board] = {}
+			self._order[board] = SkipList()
+
+class RedisLeaderboard(BaseLeaderboard):
+	"""One Redis sorted set per board, shared by the web and indexer processes.
+
+	Sorted set scores are doubles, exact only up to 2**53, and prizes are
+	counted in wei: the exact totals are kept as decimal strings in a hash
+	next to the set, and the set only orders wallets by the total divided by
+	the board's scale. Totals are updated in a WATCH transaction, since
+	HINCRBY stops at 2**63. Run ``rebuild_leaderboard`` once on boards
+	written before the hash existed.
+
+	The leaderboard is written from worker threads (ledger flushes, indexer
+	batches) and read by views, so it uses the blocking client.
+	"""
+
+	# Prizes are ranked in gwei
+	SCALES = {'prizes': 10 ** 9}
+
+	def __init__(self, host='localhost', port=6379, prefix='leaderboard'):
+		self.prefix = prefix
+		self._client = redis.Redis(host=host, port=port)
+
+	def _key(self, board):
+		return f"{self.prefix}:{board}"
+
+	def _totals_key(self, board):
+		return f"{self.prefix}:{board}:totals"
+
+	def add(self, board, wallet, amount):
+		key, totals = self._key(board), self._totals_key(board)
+		with self._client.pipeline() as pipe:
+			while True:
+				try:
+					pipe.watch(totals)
+					score = int(pipe.hget(totals, wallet) or 0) + amount
+					pipe.multi()
+					if score:
+						pipe.hset(totals, wallet, score)
+						pipe.zadd(key, {wallet: score / self.SCALES.get(board, 1)})
+					else:
+						pipe.hdel(totals, wallet)
+						pipe.zrem(key, wallet)
+					pipe.execute()
+					return
+				except redis.WatchError:
+					# Another writer changed a total of this board, read it again
+					continue
+
+	def top(self, board, limit=10):
+		wallets = self._client.zrevrange(self._key(board), 0, limit - 1)
+		if not wallets:
+			return []
+		scores = self._client.hmget(self._totals_key(board), wallets)
+		return [(wallet.decode(), int(score or 0)) for wallet, score in zip(wallets, scores)]
+
+	def rank(self, board, wallet):
+		with self._client.pipeline(transaction=False) as pipe:
+			pipe.zrevrank(self._key(board), wallet)
+			pipe.hget(self._totals_key(board), wallet)
+			rank, score = pipe.execute()
+		if rank is None:
+			return None
+		return rank + 1, int(score or 0)
+
+	def reset(self, board):
+		self._client.delete(self._key(board), self._totals_key(board))
+
+_leaderboard = None
+
+def get_leaderboard():
+	"""Return the leaderboard backend configured in ``settings.LEADERBOARD``."""
+	global _leaderboard
+	if _leaderboard is None:
+		config = dict(getattr(settings, 'LEADERBOARD', {}))
+		backend = config.pop('BACKEND', 'memory')
+		options = {key.lower(): value for key, value in config.items()}
+		if backend == 'redis':
+			_leaderboard = RedisLeaderboard(**options)
+		else:
+			_leaderboard = InMemoryLeaderboard()
+	return _leaderboard
@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from channels.db import database_sync_to_async
+from django.db import IntegrityError, transaction
+from lastbidder.metrics import Counter, Histogram
+from .leaderboard import get_leaderboard
+from .signals import rounds_closed
+
+logger = logging.getLogger(__name__)
+
+WRITE = Histogram('lobby_ledger_write_seconds', 'Duration of one ledger write transaction')
+ROWS = Counter('lobby_ledger_rows_total', 'Ledger rows written', ['kind'])
+
+def wall_clock(deadline):
+	"""Convert a monotonic deadline to an aware datetime."""
+	return datetime.fromtimestamp(time.time() + deadline - time.monotonic(), timezone.utc)
+
+class BidLedger:
+	"""Write-behind log of clock rounds and bids.
+
+	The clock only appends rows to an in-memory queue. The writer task stores
+	them with ``bulk_create`` once ``interval`` seconds have passed since the
+	first pending row, or as soon as ``max_rows`` are waiting, so a bid never
+	awaits the database. Rows that fail to be written are kept for the next
+	flush.
+
+	Verdicts of the receipt verifier go through the same queue, after the
+	bids they judge. A closed round's winner is its last bid by a wallet with
+	no rejected bid in the round; the win is confirmed, counted on the
+	leaderboard and settled on chain (``rounds_closed``) once that bid's
+	transaction is verified. Until then it waits for the verdict, and a
+	rejection passes the round to the bid before.
+	"""
+
+	def __init__(self, interval=0.2, max_rows=500):
+		self.interval = interval
+		self.max_rows = max_rows
+		self._rounds = []
+		self._bids = []
+		self._closed = []
+		self._verdicts = []
+		self._wakeup = None
+		self._full = None
+		self._writing = None  # Last write task
+
+	def __len__(self):
+		return len(self._rounds) + len(self._bids) + len(self._closed) + len(self._verdicts)
+
+	def open_round(self, clk):
+		self._rounds.append((clk.round_id, clk.clock_id, datetime.now(timezone.utc), wall_clock(clk.deadline)))
+		self._wake()
+
+	def record_bid(self, clk, bidder, wallet=None, tx_hash=None):
+		self._bids.append((clk.round_id, clk.clock_id, bidder, wallet, tx_hash,
+			datetime.now(timezone.utc), wall_clock(clk.deadline)))
+		self._wake()
+
+	def close_round(self, clk):
+		self._closed.append((clk.round_id, datetime.now(timezone.utc), clk.last_bidder, clk.last_wallet, clk.clock_id))
+		self._wake()
+
+	def record_verdict(self, tx_hash, ok):
+		"""Store the verifier's verdict on the bid backed by ``tx_hash``."""
+		self._verdicts.append((tx_hash, ok))
+		self._wake()
+
+	def _wake(self):
+		if self._wakeup is not None:
+			self._wakeup.set()
+			if len(self) >= self.max_rows:
+				self._full.set()
+
+	async def flush(self):
+		"""Write every pending row in one transaction."""
+		# Cancelling the writer does not stop a write under way in its thread:
+		# wait for it, so a shutdown returns once everything is stored
+		if self._writing is not None and not self._writing.done():
+			await asyncio.wait([self._writing])
+		if not len(self):
+			return
+		self._writing = asyncio.ensure_future(self._flush())
+		await asyncio.shield(self._writing)
+
+	async def _flush(self):
+		rounds, self._rounds = self._rounds, []
+		bids, self._bids = self._bids, []
+		closed, self._closed = self._closed, []
+		verdicts, self._verdicts = self._verdicts, []
+		try:
+			with WRITE.time():
+				# Also retires the thread's connection once past CONN_MAX_AGE or
+				# broken, as the request cycle does for views
+				await database_sync_to_async(self._write)(rounds, bids, closed, verdicts)
+		except Exception:
+			logger.exception("ledger write failed, retrying",
+				extra={"rows": len(rounds) + len(bids) + len(closed) + len(verdicts)})
+			self._rounds[:0] = rounds
+			self._bids[:0] = bids
+			self._closed[:0] = closed
+			self._verdicts[:0] = verdicts
+			raise
+		ROWS.labels("round").inc(len(rounds))
+		ROWS.labels("bid").inc(len(bids))
+		ROWS.labels("close").inc(len(closed))
+		ROWS.labels("verdict").inc(len(verdicts))
+
+	def _write(self, rounds, bids, closed, verdicts=()):
+		from .models import Bid, ClockRound
+		with transaction.atomic():
+			ClockRound.objects.bulk_create([
+				ClockRound(id=round_id, clock_id=clock_id, started_at=started_at, deadline=deadline)
+				for round_id, clock_id, started_at, deadline in rounds
+			], ignore_conflicts=True)
+			self._insert_bids([
+				Bid(round_id=round_id, clock_id=clock_id, bidder=bidder, wallet=wallet,
+					tx_hash=tx_hash, placed_at=placed_at, deadline=deadline)
+				for round_id, clock_id, bidder, wallet, tx_hash, placed_at, deadline in bids
+			])
+			for ok in (True, False):
+				hashes = [tx_hash for tx_hash, verdict in verdicts if verdict is ok]
+				if hashes:
+					Bid.objects.filter(tx_hash__in=hashes).update(verified=ok)
+			for round_id, ended_at, _, _, _ in closed:
+				ClockRound.objects.filter(id=round_id).update(ended_at=ended_at)
+			# Closed rounds waiting for one of these verdicts are decided again
+			waiting = Bid.objects.filter(
+				tx_hash__in=[tx_hash for tx_hash, _ in verdicts],
+				round__ended_at__isnull=False, round__confirmed=False,
+			).values_list('round_id', flat=True)
+			won = self._decide({round_id for round_id, _, _, _, _ in closed} | set(waiting))
+		self._count_wins(won)
+
+	def _insert_bids(self, bids):
+		"""Insert ``bids``; a reused transaction hash voids the bid that reuses it."""
+		from .models import Bid
+		try:
+			with transaction.atomic():
+				Bid.objects.bulk_create(bids, batch_size=self.max_rows)
+			return
+		except IntegrityError:
+			pass
+		# Rare: find the bids at fault one by one
+		for bid in bids:
+			bid.pk = None
+			try:
+				with transaction.atomic():
+					bid.save(force_insert=True)
+			except IntegrityError:
+				logger.warning("transaction reused for another bid", extra={"tx": bid.tx_hash, "wallet": bid.wallet})
+				ROWS.labels("replay").inc()
+				bid.pk = None
+				bid.tx_hash = None
+				bid.verified = False
+				bid.save(force_insert=True)
+
+	def _decide(self, round_ids):
+		"""Name the winners of the closed rounds ``round_ids``; return the ones now confirmed.
+
+		Confirmed rounds are ``(clock_id, round_id, wallet)`` and are announced
+		with ``rounds_closed`` in the current transaction.
+		"""
+		from .models import Bid, ClockRound
+		won = []
+		for rnd in ClockRound.objects.filter(id__in=round_ids, ended_at__isnull=False, confirmed=False):
+			bids = Bid.objects.filter(round=rnd)
+			barred = bids.filter(verified=False, wallet__isnull=False).values('wallet')
+			winning = bids.exclude(verified=False).exclude(wallet__in=barred).order_by('-id').first()
+			rnd.winner = winning.bidder if winning is not None else None
+			rnd.confirmed = winning is None or winning.tx_hash is None or bool(winning.verified)
+			rnd.save(update_fields=['winner', 'confirmed'])
+			if rnd.confirmed:
+				won.append((rnd.clock_id, rnd.id, winning.wallet if winning is not None else None))
+		if won:
+			# Settlement on chain is queued in the same transaction
+			rounds_closed.send(sender=BidLedger, rounds=won)
+		return won
+
+	def _count_wins(self, won):
+		try:
+			leaderboard = get_leaderboard()
+			for _, _, wallet in won:
+				if wallet is not None:
+					leaderboard.add('wins', wallet.lower(), 1)
+		except Exception:
+			# The rounds are stored, a leaderboard rebuild catches up
+			logger.exception("leaderboard update failed")
+
+	def recover(self):
+		"""Return ``(clock_id, round_id, deadline, last_bidder, last_wallet, bids)`` for every open round.
+
+		``deadline`` is a unix timestamp. Only the latest open round of a clock
+		is resumed; older ones left open by a crash are closed here.
+		"""
+		from .models import Bid, ClockRound
+		latest = {}
+		for rnd in ClockRound.objects.filter(ended_at__isnull=True).order_by('started_at'):
+			previous = latest.get(rnd.clock_id)
+			if previous is not None:
+				with transaction.atomic():
+					ClockRound.objects.filter(id=previous.id).update(ended_at=rnd.started_at)
+					won = self._decide([previous.id])
+				self._count_wins(won)
+			latest[rnd.clock_id] = rnd
+		states = []
+		for clock_id, rnd in latest.items():
+			bids = Bid.objects.filter(round=rnd)
+			last = bids.order_by('-id').first()
+			if last is None:
+				states.append((clock_id, rnd.id, rnd.deadline.timestamp(), None, None, 0))
+			else:
+				states.append((clock_id, rnd.id, last.deadline.timestamp(), last.bidder, last.wallet, bids.count()))
+		return states
+
+	async def run(self):
+		"""Writer loop; idles while nothing is queued."""
+		self._wakeup = asyncio.Event()
+		self._full = asyncio.Event()
+		if len(self):
+			self._wakeup.set()
+		try:
+			while True:
+				await self._wakeup.wait()
+				if len(self) < self.max_rows:
+					try:
+						await asyncio.wait_for(self._full.wait(), self.interval)
+					except asyncio.TimeoutError:
+						pass
+				self._wakeup.clear()
+				self._full.clear()
+				try:
+					await self.flush()
+				except Exception:
+					await asyncio.sleep(self.interval)
+					self._wakeup.set()
+		finally:
+			self._wakeup = None
+			self._full = None
+
+ledger = BidLedger()
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from channels_redis.core import RedisChannelLayer
+from django.core.management.base import BaseCommand, CommandError
+from lastbidder.lobby.broadcast import group_send_many
+from lastbidder.lobby.codec import group_frame
+from lastbidder.lobby.layers import PipelinedRedisChannelLayer
+
+LAYERS = {
+	'stock': RedisChannelLayer,
+	'pipelined': PipelinedRedisChannelLayer,
+}
+
+def percentile(values, q):
+	values = sorted(values)
+	return values[min(len(values) - 1, int(q * len(values)))]
+
+class Command(BaseCommand):
+	help = 'Compare broadcast ticks through the stock RedisChannelLayer and the pipelined one'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--redis', default='localhost:6379', metavar='HOST:PORT')
+		parser.add_argument('--groups', type=int, default=50, help='Groups written to on every tick')
+		parser.add_argument('--members', type=int, default=100, help='Channels per group')
+		parser.add_argument('--workers', type=int, default=4, help='Simulated server processes the channels are spread over')
+		parser.add_argument('--ticks', type=int, default=200)
+
+	def handle(self, *args, **options):
+		host, _, port = options['redis'].partition(':')
+		hosts = [(host, int(port or 6379))]
+		results = {}
+		for name, layer_class in LAYERS.items():
+			results[name] = asyncio.run(self.run(layer_class, hosts, options))
+			p50, p99, rate = results[name]
+			self.stdout.write(f'{name:10} p50 {p50:7.2f} ms  p99 {p99:7.2f} ms  {rate:8.1f} ticks/s')
+		self.stdout.write(f'speedup    {results["pipelined"][2] / results["stock"][2]:.2f}x')
+
+	async def run(self, layer_class, hosts, options):
+		prefix = f'bench-{layer_class.__name__}'
+		# One layer per simulated process: sockets of a process share its channel
+		# key, which receives one message per group and tick and is never drained
+		capacity = (options['ticks'] + 1) * options['groups']
+		layers = [layer_class(hosts=hosts, prefix=prefix, capacity=capacity) for _ in range(options['workers'])]
+		sender = layers[0]
+		groups = [f'bench_{i}' for i in range(options['groups'])]
+		channels = []
+		try:
+			for group in groups:
+				for i in range(options['members']):
+					layer = layers[i % len(layers)]
+					channel = await layer.new_channel()
+					await sender.group_add(group, channel)
+					channels.append((layer, channel))
+
+			def tick(n):
+				return [(group, group_frame({'event': 'update', 'data': {'tick': n, 'group': group}}, key=group)) for group in groups]
+
+			# Every channel must get the frame of its group before timing anything
+			await group_send_many(sender, tick(0))
+			for layer, channel in channels:
+				message = await asyncio.wait_for(layer.receive(channel), 10)
+				if message['type'] != 'lobby.frame':
+					raise CommandError(f'{layer_class.__name__} delivered {message!r}')
+
+			durations = []
+			start = time.perf_counter()
+			for n in range(1, options['ticks'] + 1):
+				messages = tick(n)
+				sent = time.perf_counter()
+				await group_send_many(sender, messages)
+				durations.append(time.perf_counter() - sent)
+			rate = options['ticks'] / (time.perf_counter() - start)
+		finally:
+			await sender.flush()
+			for layer in layers[1:]:
+				await layer.close_pools()
+		return percentile(durations, 0.5) * 1000, percentile(durations, 0.99) * 1000, rate
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from channels.db import database_sync_to_async
+from django.core.management.base import BaseCommand
+from django.db import connection
+from .bench_lobby import throwaway_database
+
+class Command(BaseCommand):
+	help = ('Measure signup and bid write throughput on the configured database. Save a run on '
+		'SQLite and compare a PostgreSQL one against it: '
+		'bench_database --save sqlite.json, then DATABASE_URL=postgres://... bench_database --compare sqlite.json')
+
+	def add_arguments(self, parser):
+		parser.add_argument('--signups', type=int, default=2000, help='New wallets registered')
+		parser.add_argument('--bids', type=int, default=20000, help='Bids written by each bid workload')
+		parser.add_argument('--workers', type=int, default=16, help='Request threads writing concurrently')
+		parser.add_argument('--clocks', type=int, default=10, help='Rounds the bids are spread over')
+		parser.add_argument('--batch', type=int, default=500, help='Bids per ledger flush')
+		parser.add_argument('--save', help='Write the metrics of this run to a JSON file')
+		parser.add_argument('--compare', help='JSON file of metrics saved from another database')
+
+	def handle(self, *args, **options):
+		self.stdout.write(f'{connection.vendor}, CONN_MAX_AGE={connection.settings_dict["CONN_MAX_AGE"]}, '
+			f'{options["workers"]} workers')
+		with throwaway_database():
+			metrics = {'vendor': connection.vendor}
+			metrics['signups_per_second'] = self.signups(options)
+			rounds = self.open_rounds(options['clocks'])
+			metrics['bid_inserts_per_second'] = self.bid_inserts(rounds, options)
+			metrics['ledger_bids_per_second'] = asyncio.run(self.ledger_bids(rounds, options))
+
+		other = None
+		if options['compare']:
+			with open(options['compare']) as f:
+				other = json.load(f)
+			self.stdout.write(f'{"":26} {metrics["vendor"]:>10} {other.get("vendor", "baseline"):>10}')
+		for name, value in metrics.items():
+			if name == 'vendor':
+				continue
+			line = f'{name:26} {value:10.0f}'
+			if other is not None and other.get(name):
+				line += f' {other[name]:10.0f} {value / other[name]:6.2f}x'
+			self.stdout.write(line)
+		if options['save']:
+			with open(options['save'], 'w') as f:
+				json.dump(metrics, f, indent=2)
+
+	def concurrently(self, work, items, workers):
+		"""Run ``work`` on every item from ``workers`` threads; return items per second."""
+		chunks = [items[i::workers] for i in range(workers)]
+
+		def run(chunk):
+			try:
+				for item in chunk:
+					work(item)
+			finally:
+				# Each thread has its own connection
+				connection.close()
+
+		start = time.perf_counter()
+		with ThreadPoolExecutor(max_workers=workers) as threads:
+			list(threads.map(run, chunks))
+		return len(items) / (time.perf_counter() - start)
+
+	def signups(self, options):
+		"""First logins: ConnectView registers every new wallet."""
+		from lastbidder.authService.models import CustomUser
+		wallets = ['0x' + os.urandom(20).hex() for _ in range(options['signups'])]
+		return self.concurrently(CustomUser.objects.get_or_create_wallet, wallets, options['workers'])
+
+	def open_rounds(self, count):
+		from lastbidder.lobby.models import ClockRound
+		now = datetime.now(timezone.utc)
+		return ClockRound.objects.bulk_create([
+			ClockRound(id=uuid.uuid4(), clock_id=clock_id, started_at=now, deadline=now)
+			for clock_id in range(count)
+		])
+
+	def bid_inserts(self, rounds, options):
+		"""One row and one transaction per bid, as a write-through ledger would do."""
+		from lastbidder.lobby.models import Bid
+		now = datetime.now(timezone.utc)
+
+		def insert(i):
+			rnd = rounds[i % len(rounds)]
+			Bid.objects.create(round=rnd, clock_id=rnd.clock_id, bidder=str(i), wallet=f'0x{i:040x}',
+				placed_at=now, deadline=now)
+
+		return self.concurrently(insert, list(range(options['bids'])), options['workers'])
+
+	async def ledger_bids(self, rounds, options):
+		"""Bids through the write-behind ledger, flushed every ``batch`` rows."""
+		from lastbidder.lobby.ledger import BidLedger
+		ledger = BidLedger(max_rows=options['batch'])
+		clocks = [SimpleNamespace(round_id=rnd.id, clock_id=rnd.clock_id, deadline=time.monotonic()) for rnd in rounds]
+		start = time.perf_counter()
+		for i in range(options['bids']):
+			ledger.record_bid(clocks[i % len(clocks)], str(i), f'0x{i:040x}')
+			if len(ledger) >= options['batch']:
+				await ledger.flush()
+		await ledger.flush()
+		elapsed = time.perf_counter() - start
+		# Release the writer thread's connection, the test database is dropped next
+		await database_sync_to_async(lambda: connection.close())()
+		return options['bids'] / elapsed
@@ -0,0 +1,263 @@
+import asyncio
+import contextlib
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from eth_account import Account
+from eth_account.messages import encode_defunct
+from lastbidder.authService.siwe import get_pool
+
+# Metrics compared against a baseline, and whether higher is better
+METRICS = {
+	'login_rate': True,
+	'connect_rate': True,
+	'frames_per_second': True,
+	'bid_latency_p50_ms': False,
+	'bid_latency_p99_ms': False,
+	'memory_per_connection_kb': False,
+}
+
+def rss():
+	"""Resident memory of the process in bytes."""
+	try:
+		with open('/proc/self/statm') as statm:
+			return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except OSError:
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def percentile(values, q):
+	if not values:
+		return 0.0
+	values = sorted(values)
+	return values[min(len(values) - 1, int(q * len(values)))]
+
+def use_backends(redis=None):
+	"""Point the lobby at in-memory backends, or at the Redis server ``host:port``.
+
+	Must run before the lobby backends are first created.
+	"""
+	if redis:
+		host, _, port = redis.partition(':')
+		port = int(port or 6379)
+		settings.CHANNEL_LAYERS = {'default': {
+			'BACKEND': 'lastbidder.lobby.layers.PipelinedRedisChannelLayer',
+			'CONFIG': {'hosts': [(host, port)], 'capacity': 10000},
+		}}
+		settings.LOBBY_PRESENCE = {'BACKEND': 'redis', 'HOST': host, 'PORT': port}
+		settings.LOBBY_RATE_LIMITS = {**settings.LOBBY_RATE_LIMITS, 'BACKEND': 'redis', 'HOST': host, 'PORT': port}
+		settings.LEADERBOARD = {'BACKEND': 'redis', 'HOST': host, 'PORT': port, 'PREFIX': 'bench:leaderboard'}
+		settings.LOBBY_CLOCKS = {'BACKEND': 'redis', 'HOST': host, 'PORT': port, 'PREFIX': 'bench:clocks'}
+		settings.CACHES['nonces'] = {**settings.CACHES['nonces'], 'LOCATION': f'redis://{host}:{port}'}
+	else:
+		settings.CHANNEL_LAYERS = {'default': {
+			'BACKEND': 'channels.layers.InMemoryChannelLayer',
+			'CONFIG': {'capacity': 10000},
+		}}
+		settings.LOBBY_PRESENCE = {'BACKEND': 'memory'}
+		settings.LOBBY_RATE_LIMITS = {**settings.LOBBY_RATE_LIMITS, 'BACKEND': 'memory'}
+		settings.LEADERBOARD = {'BACKEND': 'memory'}
+		settings.LOBBY_CLOCKS = {'BACKEND': 'memory'}
+		settings.CACHES['nonces'] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'TIMEOUT': 300}
+	settings.WEB3_PROVIDER_URL = ''
+	settings.LOBBY_CAPTURE = ''
+
+@contextlib.contextmanager
+def throwaway_database():
+	"""Run the block against a fresh test database, dropped afterwards."""
+	# SQLite's in-memory test database locks up across threads, use a file
+	tmpdir = tempfile.TemporaryDirectory()
+	if connection.vendor == 'sqlite':
+		connection.settings_dict['TEST']['NAME'] = os.path.join(tmpdir.name, 'bench.sqlite3')
+	old_name = connection.creation.create_test_db(verbosity=0)
+	try:
+		yield
+	finally:
+		connection.creation.destroy_test_db(old_name, verbosity=0)
+		tmpdir.cleanup()
+
+class BenchClient:
+	"""One simulated player: a websocket plus a task draining its frames."""
+
+	def __init__(self, communicator):
+		self.communicator = communicator
+		self.frames = 0
+		self.bid_sent = None
+		self.latencies = []
+		self.reader = None
+
+	async def read(self):
+		while True:
+			message = await self.communicator.output_queue.get()
+			if message['type'] != 'websocket.send':
+				return
+			self.frames += 1
+			if self.bid_sent is None:
+				continue
+			frame = json.loads(message['text'])
+			# The first clock update after our bid is the broadcast carrying it
+			if frame.get('event') == 'update' and 'bids' in frame['data']:
+				self.latencies.append(time.perf_counter() - self.bid_sent)
+				self.bid_sent = None
+
+	async def send(self, event, data):
+		await self.communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'event': event, 'data': data})})
+
+class Command(BaseCommand):
+	help = 'Load-test the lobby with simulated clients that log in, bid and chat'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--clients', type=int, default=1000)
+		parser.add_argument('--clocks', type=int, default=1, help='Clocks the clients are spread over')
+		parser.add_argument('--duration', type=float, default=10.0, help='Seconds of bidding and chatting')
+		parser.add_argument('--bid-interval', type=float, default=2.0, help='Mean seconds between bids of a client')
+		parser.add_argument('--chat-interval', type=float, default=5.0, help='Mean seconds between chat messages of a client')
+		parser.add_argument('--concurrency', type=int, default=64, help='Logins and connects in flight')
+		parser.add_argument('--redis', metavar='HOST:PORT',
+			help='Use Redis for the channel layer, presence, rate limits and leaderboard instead of memory')
+		parser.add_argument('--baseline', help='JSON file of metrics to compare against')
+		parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed regression against the baseline')
+		parser.add_argument('--save-baseline', help='Write the metrics of this run to a JSON file')
+
+	def handle(self, *args, **options):
+		use_backends(options['redis'])
+		# Measure the pipeline, not the bid limiter
+		settings.LOBBY_RATE_LIMITS.update({'CONNECTION': None, 'WALLET': None, 'CLOCK': None})
+		# The throwaway database has no clocks created on chain
+		settings.LOBBY_EXTRA_CLOCKS = [1000 + i for i in range(options['clocks'])]
+		with throwaway_database():
+			metrics = asyncio.run(self.run(options))
+
+		for name, value in metrics.items():
+			self.stdout.write(f'{name:26} {value:10.1f}')
+		if options['save_baseline']:
+			with open(options['save_baseline'], 'w') as f:
+				json.dump(metrics, f, indent=2)
+		if options['baseline']:
+			self.compare(metrics, options['baseline'], options['tolerance'])
+
+	def compare(self, metrics, path, tolerance):
+		with open(path) as f:
+			baseline = json.load(f)
+		failures = []
+		for name, higher_is_better in METRICS.items():
+			if name not in baseline:
+				continue
+			if higher_is_better:
+				regressed = metrics[name] < baseline[name] * (1 - tolerance)
+			else:
+				regressed = metrics[name] > baseline[name] * (1 + tolerance)
+			if regressed:
+				failures.append(f'{name}: {metrics[name]:.1f} (baseline {baseline[name]:.1f})')
+		if failures:
+			raise CommandError('Regressions against %s:\n  %s' % (path, '\n  '.join(failures)))
+		self.stdout.write(f'No regression against {path}')
+
+	async def login(self, application, account):
+		from channels.testing import HttpCommunicator
+
+		async def post(path, payload):
+			body = json.dumps(payload).encode()
+			communicator = HttpCommunicator(application, 'POST', path, body=body, headers=[
+				(b'host', b'localhost'),
+				(b'content-type', b'application/json'),
+				(b'content-length', str(len(body)).encode()),
+			])
+			response = await communicator.get_response(timeout=60)
+			if response['status'] != 200:
+				raise CommandError(f'{path} answered {response["status"]}: {response["body"][:200]}')
+			return json.loads(response['body'])
+
+		challenge = await post('/auth/nonce/', {'walletAddress': account.address})
+		signature = account.sign_message(encode_defunct(text=challenge['message'])).signature.hex()
+		session = await post('/auth/connect/', {
+			'walletAddress': account.address,
+			'nonce': challenge['nonce'],
+			'signature': signature,
+		})
+		return session['access']
+
+	async def connect(self, application, token, clock_id):
+		from channels.testing import WebsocketCommunicator
+		communicator = WebsocketCommunicator(application, f'/lobby/{clock_id}',
+			subprotocols=['lastbidder.json', 'bearer.' + token])
+		connected, _ = await communicator.connect(timeout=60)
+		if not connected:
+			raise CommandError('Websocket refused')
+		client = BenchClient(communicator)
+		client.reader = asyncio.ensure_future(client.read())
+		return client
+
+	async def play(self, client, options, stop):
+		# Exponential gaps so the load is not synchronized across clients
+		next_bid = time.perf_counter() + random.expovariate(1 / options['bid_interval'])
+		next_chat = time.perf_counter() + random.expovariate(1 / options['chat_interval'])
+		while time.perf_counter() < stop:
+			now = time.perf_counter()
+			if now >= next_bid:
+				if client.bid_sent is None:
+					client.bid_sent = now
+				await client.send('bid', {})
+				next_bid = now + random.expovariate(1 / options['bid_interval'])
+			if now >= next_chat:
+				await client.send('chat', {'message': 'gl hf'})
+				next_chat = now + random.expovariate(1 / options['chat_interval'])
+			await asyncio.sleep(min(next_bid, next_chat, stop) - time.perf_counter())
+
+	async def run(self, options):
+		from lastbidder.asgi import application
+		from lastbidder.lobby.service import service
+
+		count = options['clients']
+		limit = asyncio.Semaphore(options['concurrency'])
+		self.stdout.write(f'Creating {count} wallets...')
+		accounts = [Account.create() for _ in range(count)]
+		# Warm the signature pool up so worker startup is not measured
+		await asyncio.get_running_loop().run_in_executor(None, lambda: get_pool().submit(int).result())
+
+		async def limited(coro):
+			async with limit:
+				return await coro
+
+		start = time.perf_counter()
+		tokens = await asyncio.gather(*(limited(self.login(application, account)) for account in accounts))
+		login_rate = count / (time.perf_counter() - start)
+
+		memory = rss()
+		start = time.perf_counter()
+		clients = await asyncio.gather(*(
+			limited(self.connect(application, token, 1000 + i % options['clocks']))
+			for i, token in enumerate(tokens)
+		))
+		connect_rate = count / (time.perf_counter() - start)
+		memory_per_connection = (rss() - memory) / count
+
+		self.stdout.write(f'{count} clients connected, playing for {options["duration"]}s...')
+		frames = sum(client.frames for client in clients)
+		start = time.perf_counter()
+		stop = start + options['duration']
+		await asyncio.gather(*(self.play(client, options, stop) for client in clients))
+		# Let the last broadcast tick reach everyone
+		await asyncio.sleep(0.5)
+		elapsed = time.perf_counter() - start
+		frames = sum(client.frames for client in clients) - frames
+		latencies = [latency * 1000 for client in clients for latency in client.latencies]
+
+		for client in clients:
+			client.reader.cancel()
+			await client.communicator.disconnect()
+		await service.shutdown()
+
+		return {
+			'login_rate': login_rate,
+			'connect_rate': connect_rate,
+			'frames_per_second': frames / elapsed,
+			'bid_latency_p50_ms': percentile(latencies, 0.5),
+			'bid_latency_p99_ms': percentile(latencies, 0.99),
+			'memory_per_connection_kb': memory_per_connection / 1024,
+		}
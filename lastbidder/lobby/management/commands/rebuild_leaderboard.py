@@ -0,0 +1,33 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+from lastbidder.chain.models import ClockFinalization
+from lastbidder.lobby.leaderboard import get_leaderboard
+from lastbidder.lobby.models import ClockRound
+
+class Command(BaseCommand):
+	help = 'Recompute the leaderboards from the bid ledger and the indexed chain events'
+
+	def handle(self, *args, **options):
+		leaderboard = get_leaderboard()
+
+		wins = dict(
+			# Only rounds the ledger confirmed, as it counts them live
+			ClockRound.objects.filter(confirmed=True).exclude(winner=None).values_list('winner').annotate(count=Count('id'))
+		)
+		wallets = dict(
+			get_user_model().objects.filter(id__in=[int(user_id) for user_id in wins if user_id.isdigit()])
+			.values_list('id', 'wallet')
+		)
+		leaderboard.reset('wins')
+		for user_id, count in wins.items():
+			wallet = wallets.get(int(user_id)) if user_id.isdigit() else None
+			if wallet is not None:
+				leaderboard.add('wins', wallet.lower(), count)
+
+		leaderboard.reset('prizes')
+		prizes = ClockFinalization.objects.values_list('winner').annotate(total=Sum('prize'))
+		for wallet, total in prizes:
+			leaderboard.add('prizes', wallet, int(total))
+
+		self.stdout.write(f'{len(wins)} round winners, {len(prizes)} prize winners')
@@ -0,0 +1,206 @@
+import asyncio
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from lastbidder.authService.middleware import TOKEN_SUBPROTOCOL_PREFIX
+from lastbidder.lobby.capture import read_capture, OPEN, IN, OUT, CLOSE
+from lastbidder.lobby.codec import json_codec, msgpack_codec
+from .bench_lobby import use_backends, throwaway_database
+
+def decode(data):
+	"""Payload of a captured frame, whatever its codec."""
+	if isinstance(data, bytes):
+		return msgpack_codec.decode(data)
+	return json_codec.decode(data)
+
+def event_name(frame):
+	if not isinstance(frame, dict):
+		return '?'
+	if 'event' in frame:
+		return frame['event']
+	return 'error' if 'error' in frame else '?'
+
+def last_bidders(frames):
+	"""Last bidder seen for each clock in a stream of frames."""
+	winners = {}
+	for frame in frames:
+		data = frame.get('data') if isinstance(frame, dict) else None
+		if isinstance(data, dict) and 'clock_id' in data and 'last_bidder' in data:
+			winners[data['clock_id']] = data['last_bidder']
+	return winners
+
+def captured_clocks(records):
+	"""Ids of the clocks the captured sockets opened."""
+	clocks = set()
+	for _, _, kind, data in records:
+		if kind == OPEN:
+			name = data['path'].rstrip('/').rsplit('/', 1)[-1]
+			if name.isdigit():
+				clocks.add(int(name))
+	return sorted(clocks)
+
+class ReplayClient:
+	"""One captured socket, replaying its records in order."""
+
+	def __init__(self, application, received):
+		self.application = application
+		self.received = received
+		self.queue = asyncio.Queue()
+		self.communicator = None
+		self.reader = None
+
+	async def handle(self, kind, data):
+		"""Replay one record; returns False once the socket is gone."""
+		from channels.testing import WebsocketCommunicator
+		if kind == OPEN:
+			token = AccessToken()
+			token[api_settings.USER_ID_CLAIM] = data['user']
+			token['wallet'] = data['wallet']
+			subprotocols = [TOKEN_SUBPROTOCOL_PREFIX + str(token)]
+			if data['subprotocol']:
+				subprotocols.insert(0, data['subprotocol'])
+			self.communicator = WebsocketCommunicator(self.application, data['path'], subprotocols=subprotocols)
+			connected, _ = await self.communicator.connect(timeout=30)
+			if connected:
+				self.reader = asyncio.ensure_future(self.read())
+			return connected
+		if self.reader is None:
+			return False
+		if kind == IN:
+			key = 'bytes' if isinstance(data, bytes) else 'text'
+			await self.communicator.send_input({'type': 'websocket.receive', key: data})
+			return True
+		self.reader.cancel()
+		self.reader = None
+		await self.communicator.disconnect()
+		return False
+
+	async def delivered(self):
+		"""Wait until the consumer has taken every frame sent so far."""
+		while self.reader is not None and not self.communicator.input_queue.empty():
+			await asyncio.sleep(0)
+		# And give it a turn to handle the last one
+		await asyncio.sleep(0)
+
+	async def drive(self):
+		"""Replay the records put on :attr:`queue` as they come."""
+		while await self.handle(*await self.queue.get()):
+			pass
+
+	async def read(self):
+		while True:
+			message = await self.communicator.output_queue.get()
+			if message['type'] != 'websocket.send':
+				return
+			self.received.append(message.get('bytes') or message.get('text'))
+
+class Command(BaseCommand):
+	help = 'Replay a lobby traffic capture against a fresh server and compare the broadcasts'
+
+	def add_arguments(self, parser):
+		parser.add_argument('capture',
+			help='settings.LOBBY_CAPTURE, to merge the logs of every worker, or a single log')
+		parser.add_argument('--speed', type=float, default=1.0,
+			help='Replay speed, 1 for real time, 0 for as fast as possible (broadcasts then '
+				'coalesce into fewer frames than captured)')
+		parser.add_argument('--redis', metavar='HOST:PORT',
+			help='Use Redis for the channel layer and lobby backends instead of memory')
+		parser.add_argument('--settle', type=float, default=1.0,
+			help='Seconds to wait for the last broadcasts before closing the sockets')
+		parser.add_argument('--check', action='store_true',
+			help='Fail when the final last bidder of a clock differs from the capture')
+
+	def handle(self, *args, **options):
+		try:
+			records = list(read_capture(options['capture']))
+		except (OSError, ValueError) as e:
+			raise CommandError(f'Cannot read {options["capture"]}: {e}')
+		if not records:
+			raise CommandError('Empty capture')
+		use_backends(options['redis'])
+		# The captured server knew these clocks, the throwaway database does not
+		settings.LOBBY_EXTRA_CLOCKS = captured_clocks(records)
+		if not options['speed']:
+			# Rate limits are timing: compressing time would turn them on every bid
+			settings.LOBBY_RATE_LIMITS.update({'CONNECTION': None, 'WALLET': None, 'CLOCK': None})
+		with throwaway_database():
+			replayed, sent, elapsed = asyncio.run(self.replay(records, options))
+		self.report(records, replayed, sent, elapsed, options['check'])
+
+	async def replay(self, records, options):
+		from lastbidder.asgi import application
+		from lastbidder.lobby.service import service
+
+		speed = options['speed']
+		received = []  # Frames of every socket, in arrival order
+		clients = {}
+		tasks = []
+		sent = 0
+		start = time.perf_counter()
+		for t, conn, kind, data in records:
+			if speed:
+				delay = start + t / speed - time.perf_counter()
+				if delay > 0:
+					await asyncio.sleep(delay)
+			if kind == OPEN:
+				clients[conn] = ReplayClient(application, received)
+				if speed:
+					tasks.append(asyncio.ensure_future(clients[conn].drive()))
+			elif conn not in clients or kind == OUT:
+				continue
+			elif kind == IN:
+				sent += 1
+			elif not speed:
+				# Squeezed into no time, the socket would be gone before the
+				# broadcasts of its last frames: close it with the others
+				continue
+			client = clients[conn]
+			if speed:
+				# Each socket keeps pace on its own, a slow handshake does
+				# not hold the others back
+				client.queue.put_nowait((kind, data))
+			else:
+				# One record at a time, so frames reach the server in the
+				# captured order across sockets
+				await client.handle(kind, data)
+				await client.delivered()
+			if kind == CLOSE:
+				del clients[conn]
+
+		await asyncio.sleep(options['settle'])
+		for client in clients.values():
+			if speed:
+				client.queue.put_nowait((CLOSE, 1000))
+			else:
+				await client.handle(CLOSE, 1000)
+		await asyncio.gather(*tasks, return_exceptions=True)
+		elapsed = time.perf_counter() - start - options['settle']
+		await service.shutdown()
+		return [decode(data) for data in received], sent, elapsed
+
+	def report(self, records, replayed, sent, elapsed, check):
+		captured = [decode(data) for _, _, kind, data in records if kind == OUT]
+		span = records[-1][0] - records[0][0]
+		self.stdout.write(f'Replayed {span:.1f}s of traffic in {elapsed:.2f}s')
+		self.stdout.write(f'  inbound   {sent / elapsed:10.1f} frames/s')
+		self.stdout.write(f'  outbound  {len(replayed) / elapsed:10.1f} frames/s')
+
+		self.stdout.write(f'{"event":20} {"captured":>10} {"replayed":>10}')
+		captured_events = Counter(event_name(frame) for frame in captured)
+		replayed_events = Counter(event_name(frame) for frame in replayed)
+		for event in sorted(captured_events.keys() | replayed_events.keys()):
+			mark = '' if captured_events[event] == replayed_events[event] else '  *'
+			self.stdout.write(f'{event:20} {captured_events[event]:10} {replayed_events[event]:10}{mark}')
+
+		expected, actual = last_bidders(captured), last_bidders(replayed)
+		diverged = sorted(clock_id for clock_id in expected.keys() | actual.keys()
+			if expected.get(clock_id) != actual.get(clock_id))
+		for clock_id in diverged:
+			self.stdout.write(f'clock {clock_id}: last bidder {expected.get(clock_id)!r} captured, {actual.get(clock_id)!r} replayed')
+		if diverged and check:
+			raise CommandError(f'{len(diverged)} clocks diverged from the capture')
+		if not diverged:
+			self.stdout.write('Every clock ends on the captured last bidder')
@@ -0,0 +1,51 @@
+import json
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from lastbidder.lobby.curves import make_time_curve
+from lastbidder.lobby.simulator import np, simulate, summarize
+
+class Command(BaseCommand):
+	help = 'Simulate auction rounds under candidate time curves and compare them'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--curve', action='append', dest='curves', metavar='JSON',
+			help='Curve config like settings.LOBBY_TIME_CURVE, repeatable (default: the configured curve)')
+		parser.add_argument('--rounds', type=int, default=1000000)
+		parser.add_argument('--duration', type=float, default=100, help='Seconds on the clock when a round opens')
+		parser.add_argument('--rate', type=float, default=0.05, help='Bids per second at the start of a round')
+		parser.add_argument('--decay', type=float, default=0.99, help='Bid rate multiplier after each bid')
+		parser.add_argument('--players', type=int, default=1000)
+		parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of player activity')
+		parser.add_argument('--price', type=float, default=1.0, help='Ticket price of one bid')
+		parser.add_argument('--max-bids', type=int, default=10000, help='Cut rounds that never end')
+		parser.add_argument('--seed', type=int, default=0)
+
+	def handle(self, *args, **options):
+		if np is None:
+			raise CommandError('simulate_curves needs NumPy (pip install numpy)')
+		try:
+			configs = [json.loads(curve) for curve in options['curves'] or []]
+			curves = [make_time_curve(config) for config in configs] or [make_time_curve(getattr(settings, 'LOBBY_TIME_CURVE', {}))]
+		except (ValueError, TypeError) as e:
+			raise CommandError(f'Invalid curve: {e}')
+
+		for curve in curves:
+			start = time.perf_counter()
+			# Every curve starts from the same seed, but the draws follow the rounds
+			# each curve keeps alive: compare curves over enough rounds for that
+			# noise to average out
+			result = simulate(curve,
+				rounds=options['rounds'],
+				duration=options['duration'],
+				rate=options['rate'],
+				decay=options['decay'],
+				players=options['players'],
+				skew=options['skew'],
+				max_bids=options['max_bids'],
+				seed=options['seed'],
+			)
+			elapsed = time.perf_counter() - start
+			self.stdout.write(f'{curve!r}: {options["rounds"]} rounds in {elapsed:.1f}s')
+			for name, value in summarize(result, options['price'], options['players']).items():
+				self.stdout.write(f'  {name:22} {value:12.3f}')
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClockRound',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('clock_id', models.BigIntegerField(db_index=True)),
+                ('started_at', models.DateTimeField()),
+                ('deadline', models.DateTimeField()),
+                ('ended_at', models.DateTimeField(blank=True, null=True)),
+                ('winner', models.CharField(blank=True, max_length=255, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Bid',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clock_id', models.BigIntegerField(db_index=True)),
+                ('bidder', models.CharField(max_length=255)),
+                ('wallet', models.CharField(blank=True, db_index=True, max_length=255, null=True)),
+                ('tx_hash', models.CharField(blank=True, max_length=66, null=True)),
+                ('placed_at', models.DateTimeField()),
+                ('deadline', models.DateTimeField()),
+                ('round', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bids', to='lobby.clockround')),
+            ],
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:40
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def free_tx_hashes(apps, schema_editor):
+    # Hashes were stored unchecked before: keep the first bid of each one and
+    # the rounds already closed count as decided
+    Bid = apps.get_model('lobby', 'Bid')
+    ClockRound = apps.get_model('lobby', 'ClockRound')
+    Bid.objects.filter(tx_hash='').update(tx_hash=None)
+    reused = (Bid.objects.exclude(tx_hash=None).values('tx_hash')
+              .annotate(count=Count('id'), first=Min('id')).filter(count__gt=1))
+    for row in reused:
+        Bid.objects.filter(tx_hash=row['tx_hash']).exclude(id=row['first']).update(tx_hash=None)
+    ClockRound.objects.exclude(ended_at=None).update(confirmed=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lobby', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bid',
+            name='verified',
+            field=models.BooleanField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='clockround',
+            name='confirmed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(free_tx_hashes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='bid',
+            name='tx_hash',
+            field=models.CharField(blank=True, max_length=66, null=True, unique=True),
+        ),
+    ]
@@ -1,69 +1,168 @@
-import asyncio  # Import asyncio for Lock
-import datetime
-import time  # Import time module for sleep functionality
-from channels.layers import get_channel_layer	
+import asyncio
+import time
+import uuid
+from channels.layers import get_channel_layer
+from django.db import models
+from .broadcast import broadcaster, CHANNEL_SEND
+from .codec import group_frame
+from .curves import get_time_curve
+from .ledger import ledger
+from .proxy import PROXY_BIDS
+from .scheduler import scheduler as default_scheduler
+
+MAIN_CLOCK_ID = 1  # LastBidderWin creates the main clock with id 1
 
 class clock:
-	def __init__(self):
-		self.remaining_time = 100  # time in seconds
-		self.is_active = True
-		self.current_time = datetime.datetime.now()
-		self.bid_time = 40 				# 			5 ***********
+	"""Auction clock driven by an absolute monotonic deadline.
+
+	Remaining time is computed on read and a bid only moves ``deadline``
+	forward, by what the clock's time ``curve`` grants it. Expiry is driven
+	by a shared :class:`ClockScheduler`, so a clock costs one heap entry and
+	no coroutine while it is waiting.
+	"""
+
+	def __init__(self, clock_id=MAIN_CLOCK_ID, duration=100, curve=None, scheduler=None, on_expire=None, round_id=None):
+		self.clock_id = clock_id
+		self.group_name = f"lobby_{clock_id}"
+		self.curve = curve if curve is not None else get_time_curve()
+		self.bids = 0  # Bids in the current round
+		self.seq = 0  # Bids of every round, orders the clock's update frames
+		self.bid_time = self.curve.extension(duration, 0)  # Time added by the last bid
 		self.last_bidder = None
-		self.lock = asyncio.Lock()  # Initialize a lock
-
-	async def add_time(self, bidder):
-		"""Add bid_time to the remaining time."""
-		async with self.lock:  # Acquire the lock before modifying remaining_time
-			 # Store original time for logging
-			original_time = self.remaining_time
-			
-			# If timer already stopped, reset it to bid_time
-			if self.remaining_time <= 0:
-				self.remaining_time = self.bid_time
-				self.is_active = True
-				print(f"Clock restarted by {bidder}, new time: {self.remaining_time}s")
-			else:
-				# Otherwise add bid_time to the current time
-				self.remaining_time += self.bid_time
-				print(f"Time increased by {bidder}: {original_time}s → {self.remaining_time}s")
-			
-			self.last_bidder = bidder
-			
-			# Send an immediate update with the new time
+		self.last_wallet = None
+		self.deadline = time.monotonic() + duration
+		self.is_active = True
+		self.scheduler = scheduler if scheduler is not None else default_scheduler
+		self.on_expire = on_expire
+		self.proxies = None  # Standing orders of the round, see lastbidder.lobby.proxy
+		self._scheduled = None  # Live heap entry
+		# A clock restored from the ledger continues its round
+		self.round_id = round_id
+		if round_id is None:
+			self._new_round()
+
+	def _new_round(self):
+		self.round_id = uuid.uuid4()
+		ledger.open_round(self)
+
+	@property
+	def remaining_time(self):
+		"""Seconds left before expiry, never negative."""
+		if not self.is_active:
+			return 0
+		return max(0.0, self.deadline - time.monotonic())
+
+	@property
+	def wakeup(self):
+		"""Monotonic time the scheduler has to look at the clock.
+
+		The deadline, or the proxy lead before it while a standing order
+		would answer the last bidder.
+		"""
+		if self.proxies and self.proxies.next_bidder(self.last_bidder) is not None:
+			return self.deadline - self.proxies.lead
+		return self.deadline
+
+	def start(self):
+		"""Register the clock with its scheduler."""
+		if self.is_active:
+			self.scheduler.schedule(self)
+
+	def proxy_bid(self):
+		"""Bid for the standing order next in line; False when no order acted."""
+		order = self.proxies.next_bidder(self.last_bidder) if self.proxies else None
+		if order is None:
+			return False
+		if self.curve.extension(self.deadline - time.monotonic(), self.bids) <= 0:
+			# The bid would not move the deadline, orders would burn their budgets for nothing
+			return False
+		bidder, wallet = order
+		ok, tx_hash = self.proxies.spend(bidder, self.clock_id)
+		if ok:
+			PROXY_BIDS.inc()
+			self.add_time(bidder, wallet, tx_hash)
+		return True
+
+	def _finish(self, loop):
+		self.is_active = False
+		# Standing orders are for the round they were placed in
+		self.proxies = None
+		ledger.close_round(self)
+		loop.create_task(self.expire(self.last_bidder))
+
+	async def expire(self, winner):
+		"""Broadcast the end of the round to the clock's group."""
+		with CHANNEL_SEND.labels("end_clock").time():
 			await get_channel_layer().group_send(
-				"lobby",
-				{
-					"type": "update_event",
+				self.group_name,
+				group_frame({
+					"event": "end_clock",
 					"data": {
-						"remaining_time": self.remaining_time,
-						"last_bidder": self.last_bidder,
-						"bid_added": self.bid_time
+						"message": "Time has expired!",
+						"clock_id": self.clock_id,
+						"last_bidder": winner
 					}
-				}
-			)
-
-	async def run_clock(self):
-		"""Run the clock indefinitely, checking if time has expired."""
-		while self.is_active:
-			async with self.lock:  # Acquire the lock before reading/modifying remaining_time
-				if self.remaining_time <= 0:
-					self.is_active = False
-					await get_channel_layer().group_send(
-						"lobby",
-					{
-						"type": "end_clock",
-						"data": {
-							"message": "Time has expired!",
-							"last_bidder": self.last_bidder
-						}
-					})
-					break
-				self.remaining_time -= 1
-				print(f"Remaining time: {self.remaining_time} seconds")
-			await asyncio.sleep(1)  # Wait for 1 second
+				}))
+		if self.on_expire is not None:
+			self.on_expire(self)
+
+	def add_time(self, bidder, wallet=None, tx_hash=None):
+		"""Extend the remaining time by what the curve grants this bid."""
+		now = time.monotonic()
+		if self.is_active and self.deadline <= now:
+			# The deadline passed before the scheduler ran: close the round
+			# for the previous bidder before starting a new one.
+			self._finish(asyncio.get_running_loop())
+		if not self.is_active:
+			# Timer already stopped, the bid opens a new round
+			self.bids = 0
+			self.bid_time = self.curve.opening()
+			self.deadline = now + self.bid_time
+			self.is_active = True
+			self._new_round()
+		else:
+			self.bid_time = self.curve.extension(self.deadline - now, self.bids)
+			self.deadline += self.bid_time
+		self.bids += 1
+		self.seq += 1
+		self.last_bidder = bidder
+		self.last_wallet = wallet
+		self.start()
+		# Persisted in the background, the bid never waits for the database
+		ledger.record_bid(self, bidder, wallet, tx_hash)
+		# Coalesced with the other bids of this tick into one update frame
+		broadcaster.mark_bid(self)
 
 	def __str__(self):
 		# Return remaining time in seconds
 		return str(self.remaining_time)
 
+class ClockRound(models.Model):
+	"""One round of a clock, from its start to the expiry that names a winner."""
+	id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+	clock_id = models.BigIntegerField(db_index=True)
+	started_at = models.DateTimeField()
+	deadline = models.DateTimeField()  # Deadline when the round opened, bids move it
+	ended_at = models.DateTimeField(null=True, blank=True)
+	winner = models.CharField(max_length=255, null=True, blank=True)
+	# The winning bid's transaction is verified (or there is nothing to verify):
+	# the win counts and is settled on chain. Until then ``winner`` is provisional.
+	confirmed = models.BooleanField(default=False)
+
+	def __str__(self):
+		return f"clock {self.clock_id} round {self.id}"
+
+class Bid(models.Model):
+	round = models.ForeignKey(ClockRound, on_delete=models.CASCADE, related_name='bids')
+	clock_id = models.BigIntegerField(db_index=True)
+	bidder = models.CharField(max_length=255)
+	wallet = models.CharField(max_length=255, null=True, blank=True, db_index=True)
+	# Transaction backing the bid, when a verifier checks them. One transaction backs one bid.
+	tx_hash = models.CharField(max_length=66, null=True, blank=True, unique=True)
+	# None while unchecked; False voids the bid, and its bidder cannot win the round
+	verified = models.BooleanField(null=True, blank=True)
+	placed_at = models.DateTimeField()
+	deadline = models.DateTimeField()  # Deadline of the round after this bid
+
+	def __str__(self):
+		return f"{self.bidder} on clock {self.clock_id}"
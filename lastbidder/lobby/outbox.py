@@ -0,0 +1,77 @@
+import asyncio
+import itertools
+from collections import OrderedDict
+from lastbidder.metrics import Counter
+
+DROPPED = Counter('lobby_outbox_dropped_frames_total', 'Frames dropped for sockets that fell behind')
+OVERFLOWED = Counter('lobby_outbox_overflows_total', 'Sockets given up on with nothing left to drop')
+
+class Outbox:
+	"""Bounded queue of the frames waiting to be written to one socket.
+
+	Handlers only enqueue, and a writer task per socket sends, so a client
+	that reads slowly never holds up the consumer or the groups it is in.
+	While frames wait, a frame queued with the ``key`` of a pending one
+	replaces it (a newer clock state makes the older one useless), and once
+	``max_frames`` are pending the oldest droppable frames (chat) are
+	discarded. With nothing left to drop the socket is too far behind to
+	catch up: the queue is emptied, further frames are ignored and
+	``on_overflow`` is called, for the owner to close the socket.
+
+	A keyed frame may come with a ``seq``: one older than the last frame
+	queued for its key is stale (another worker's bid overtook it) and is
+	never queued.
+	"""
+
+	def __init__(self, write, max_frames=64, on_overflow=None):
+		self.write = write
+		self.max_frames = max_frames
+		self.on_overflow = on_overflow
+		self.dropped = 0
+		self.overflowed = False
+		self._frames = OrderedDict()  # key -> (frame, droppable)
+		self._seq = itertools.count()
+		self._latest = {}  # key -> seq of the newest frame queued for it
+		self._ready = asyncio.Event()
+
+	def __len__(self):
+		return len(self._frames)
+
+	def put(self, frame, key=None, droppable=False, seq=None):
+		if self.overflowed:
+			return
+		if key is None:
+			key = next(self._seq)
+		else:
+			if seq is not None:
+				if seq < self._latest.get(key, seq):
+					return
+				self._latest[key] = seq
+			self._frames.pop(key, None)
+		self._frames[key] = (frame, droppable)
+		if len(self._frames) > self.max_frames and not self._drop():
+			self.overflowed = True
+			self._frames.clear()
+			OVERFLOWED.inc()
+			if self.on_overflow is not None:
+				self.on_overflow()
+			return
+		self._ready.set()
+
+	def _drop(self):
+		for key, (_, droppable) in self._frames.items():
+			if droppable:
+				del self._frames[key]
+				self.dropped += 1
+				DROPPED.inc()
+				return True
+		return False
+
+	async def run(self):
+		"""Write pending frames in order until cancelled."""
+		while True:
+			await self._ready.wait()
+			self._ready.clear()
+			while self._frames:
+				_, (frame, _) = self._frames.popitem(last=False)
+				await self.write(frame)
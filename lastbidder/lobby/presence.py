@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import time
+import zlib
+import redis.asyncio as aioredis
+from django.conf import settings
+from .broadcast import broadcaster
+
+logger = logging.getLogger(__name__)
+
+# Presence is sharded by user id. Each shard keeps, under one hash tag so a
+# Lua script can touch them atomically:
+#   users  - set of online user ids (SCARD gives the shard's count)
+#   refs   - hash user id -> number of open connections
+#   hb     - sorted set "channel|user" -> heartbeat expiry timestamp
+
+# Also the heartbeat: it refreshes the expiry, and puts back a connection
+# the reaper dropped while it was still alive. Returns 1 if it was added.
+JOIN_SCRIPT = """
+if redis.call('ZADD', KEYS[3], ARGV[3], ARGV[1] .. '|' .. ARGV[2]) == 1 then
+	if redis.call('HINCRBY', KEYS[2], ARGV[2], 1) == 1 then
+		redis.call('SADD', KEYS[1], ARGV[2])
+	end
+	return 1
+end
+return 0
+"""
+
+LEAVE_SCRIPT = """
+if redis.call('ZREM', KEYS[3], ARGV[1] .. '|' .. ARGV[2]) == 1 then
+	if redis.call('HINCRBY', KEYS[2], ARGV[2], -1) <= 0 then
+		redis.call('HDEL', KEYS[2], ARGV[2])
+		redis.call('SREM', KEYS[1], ARGV[2])
+	end
+end
+"""
+
+REAP_SCRIPT = """
+local dead = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])
+for _, member in ipairs(dead) do
+	local user = string.match(member, '|(.*)$')
+	redis.call('ZREM', KEYS[3], member)
+	if redis.call('HINCRBY', KEYS[2], user, -1) <= 0 then
+		redis.call('HDEL', KEYS[2], user)
+		redis.call('SREM', KEYS[1], user)
+	end
+end
+return #dead
+"""
+
+class BasePresence:
+	"""Online users tracked per connection with heartbeats.
+
+	A user is online while at least one of its connections has sent a
+	heartbeat within ``ttl`` seconds. Connections that vanish without a
+	clean disconnect are dropped by :meth:`reap`.
+	"""
+
+	def __init__(self, shards=16, ttl=30):
+		self.shards = shards
+		self.ttl = ttl
+
+	def shard(self, user_id):
+		return zlib.crc32(str(user_id).encode()) % self.shards
+
+	async def join(self, channel_name, user_id):
+		raise NotImplementedError
+
+	async def leave(self, channel_name, user_id):
+		raise NotImplementedError
+
+	async def heartbeat(self, channel_name, user_id):
+		"""Keep a connection alive, True if it had been reaped and is back.
+
+		A connection reaped after a stall (an event loop blocked past
+		``ttl``) is still open: its next heartbeat joins it again.
+		"""
+		return await self.join(channel_name, user_id)
+
+	async def reap(self):
+		"""Drop expired connections, return how many were removed."""
+		raise NotImplementedError
+
+	async def count(self):
+		"""Number of online users."""
+		raise NotImplementedError
+
+class InMemoryPresence(BasePresence):
+	"""Process-local backend with the same semantics, for tests and dev."""
+
+	def __init__(self, **kwargs):
+		super().__init__(**kwargs)
+		self._users = [set() for _ in range(self.shards)]
+		self._refs = [{} for _ in range(self.shards)]
+		self._hb = [{} for _ in range(self.shards)]
+		self._count = 0
+
+	async def join(self, channel_name, user_id):
+		i = self.shard(user_id)
+		known = (channel_name, user_id) in self._hb[i]
+		self._hb[i][(channel_name, user_id)] = time.time() + self.ttl
+		if known:
+			return False
+		refs = self._refs[i]
+		refs[user_id] = refs.get(user_id, 0) + 1
+		if refs[user_id] == 1:
+			self._users[i].add(user_id)
+			self._count += 1
+		return True
+
+	async def leave(self, channel_name, user_id):
+		i = self.shard(user_id)
+		if self._hb[i].pop((channel_name, user_id), None) is not None:
+			self._release(i, user_id)
+
+	def _release(self, i, user_id):
+		refs = self._refs[i]
+		refs[user_id] -= 1
+		if refs[user_id] <= 0:
+			del refs[user_id]
+			self._users[i].discard(user_id)
+			self._count -= 1
+
+	async def reap(self):
+		now = time.time()
+		removed = 0
+		for i, hb in enumerate(self._hb):
+			for key in [key for key, expires in hb.items() if expires <= now]:
+				del hb[key]
+				self._release(i, key[1])
+				removed += 1
+		return removed
+
+	async def count(self):
+		return self._count
+
+class RedisPresence(BasePresence):
+	"""Redis backend, every update is a single atomic script call."""
+
+	def __init__(self, host='localhost', port=6379, prefix='presence', **kwargs):
+		super().__init__(**kwargs)
+		self.host = host
+		self.port = port
+		self.prefix = prefix
+		self._clients = {}
+
+	def _client(self):
+		# redis.asyncio connections are bound to the loop that opened them
+		loop = asyncio.get_running_loop()
+		client = self._clients.get(loop)
+		if client is None:
+			client = aioredis.Redis(host=self.host, port=self.port)
+			self._clients[loop] = client
+		return client
+
+	def _keys(self, i):
+		tag = f"{{{self.prefix}:{i}}}"
+		return [f"{tag}:users", f"{tag}:refs", f"{tag}:hb"]
+
+	async def join(self, channel_name, user_id):
+		keys = self._keys(self.shard(user_id))
+		return bool(await self._client().eval(JOIN_SCRIPT, 3, *keys, channel_name, user_id, time.time() + self.ttl))
+
+	async def leave(self, channel_name, user_id):
+		keys = self._keys(self.shard(user_id))
+		await self._client().eval(LEAVE_SCRIPT, 3, *keys, channel_name, user_id)
+
+	async def reap(self):
+		async with self._client().pipeline(transaction=False) as pipe:
+			now = time.time()
+			for i in range(self.shards):
+				pipe.eval(REAP_SCRIPT, 3, *self._keys(i), now)
+			return sum(await pipe.execute())
+
+	async def count(self):
+		async with self._client().pipeline(transaction=False) as pipe:
+			for i in range(self.shards):
+				pipe.scard(self._keys(i)[0])
+			return sum(await pipe.execute())
+
+_presence = None
+
+def get_presence():
+	"""Return the presence backend configured in ``settings.LOBBY_PRESENCE``."""
+	global _presence
+	if _presence is None:
+		config = dict(getattr(settings, 'LOBBY_PRESENCE', {}))
+		backend = config.pop('BACKEND', 'memory')
+		options = {key.lower(): value for key, value in config.items()}
+		if backend == 'redis':
+			_presence = RedisPresence(**options)
+		else:
+			_presence = InMemoryPresence(**options)
+	return _presence
+
+async def run_reaper(interval=10):
+	"""Periodically drop dead connections and publish the new online count."""
+	presence = get_presence()
+	while True:
+		await asyncio.sleep(interval)
+		try:
+			if await presence.reap():
+				broadcaster.mark_users(await presence.count())
+		except Exception:
+			# Dead sockets wait for the next pass
+			logger.exception("presence reap failed")
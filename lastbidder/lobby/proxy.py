@@ -0,0 +1,108 @@
+import heapq
+import itertools
+from collections import deque
+from django.conf import settings
+from lastbidder.metrics import Counter
+
+PROXY_BIDS = Counter('lobby_proxy_bids_total', 'Bids placed by standing orders')
+
+class ProxyBook:
+	"""Standing orders of one clock: bid for me, up to ``budget`` times.
+
+	Orders sit in a heap ordered by remaining budget, ties going to the
+	oldest order, so the engine always answers with the deepest pocket and
+	two auto-bidders fight until the smaller budget runs out. Replaced and
+	cancelled orders leave stale entries behind that are skipped when they
+	reach the top, so every operation costs O(log n).
+
+	The clock's scheduler wakes the clock ``lead`` seconds before its
+	deadline while an order could answer the last bidder (see
+	``clock.wakeup``): orders only spend a bid when they would otherwise lose.
+
+	With a receipt ``verifier``, orders are paid like bids: each bid of an
+	order spends one of the transactions it was placed with, handed to the
+	verifier as the bid is made, so a rejected one voids the bid.
+	"""
+
+	def __init__(self, lead=2.0, verifier=None):
+		self.lead = lead
+		self.verifier = verifier
+		self._heap = []
+		self._orders = {}  # bidder -> heap entry [-budget, seq, bidder, wallet, transactions]
+		self._seq = itertools.count()
+
+	def __len__(self):
+		return len(self._orders)
+
+	def __contains__(self, bidder):
+		return bidder in self._orders
+
+	def budget(self, bidder):
+		"""Bids left on the order of ``bidder``, 0 without one."""
+		entry = self._orders.get(bidder)
+		return -entry[0] if entry is not None else 0
+
+	def place(self, bidder, wallet, budget, tx_hashes=()):
+		"""Register or replace the order of ``bidder``; a budget of 0 cancels it.
+
+		With a verifier, the order needs one transaction per bid; without
+		one, transactions are ignored, as they are for manual bids.
+		"""
+		if self.verifier is None:
+			tx_hashes = ()
+		elif budget != len(tx_hashes):
+			raise ValueError("Auto-bidding needs one transactionHash per bid")
+		self._orders.pop(bidder, None)
+		if budget > 0:
+			self._push(bidder, wallet, budget, deque(tx_hashes))
+
+	def _push(self, bidder, wallet, budget, tx_hashes):
+		entry = [-budget, next(self._seq), bidder, wallet, tx_hashes]
+		self._orders[bidder] = entry
+		heapq.heappush(self._heap, entry)
+
+	def _top(self):
+		while self._heap and self._orders.get(self._heap[0][2]) is not self._heap[0]:
+			heapq.heappop(self._heap)
+		return self._heap[0] if self._heap else None
+
+	def next_bidder(self, last_bidder):
+		"""Return ``(bidder, wallet)`` of the order that answers ``last_bidder``, or None."""
+		top = self._top()
+		if top is None or top[2] != last_bidder:
+			return None if top is None else (top[2], top[3])
+		# The best order is already winning: look one below it
+		heapq.heappop(self._heap)
+		runner_up = self._top()
+		heapq.heappush(self._heap, top)
+		return None if runner_up is None else (runner_up[2], runner_up[3])
+
+	def spend(self, bidder, clock_id):
+		"""Take one bid off the order of ``bidder``, dropping it once empty.
+
+		Returns ``(ok, tx_hash)``: the transaction paying for the bid, None
+		without a verifier. ``ok`` is False when the verifier refuses the
+		transaction (already used, or too many waiting); the order is then
+		cancelled and no bid must be made.
+		"""
+		entry = self._orders.pop(bidder)
+		tx_hashes = entry[4]
+		# Nothing checks the transactions without a verifier: none pays
+		tx_hash = tx_hashes.popleft() if tx_hashes and self.verifier is not None else None
+		if tx_hash is not None:
+			try:
+				accepted = self.verifier.submit(tx_hash, entry[3], clock_id, None)
+			except RuntimeError:
+				accepted = False
+			if not accepted:
+				return False, tx_hash
+		if entry[0] < -1:
+			self._push(bidder, entry[3], -entry[0] - 1, tx_hashes)
+		return True, tx_hash
+
+def proxy_book(clk):
+	"""Return the standing orders of ``clk``, creating them on first use."""
+	if clk.proxies is None:
+		from lastbidder.chain.verifier import get_verifier
+		clk.proxies = ProxyBook(getattr(settings, 'LOBBY_PROXY_BIDS', {}).get('LEAD', 2.0), get_verifier())
+	return clk.proxies
@@ -0,0 +1,125 @@
+import asyncio
+import time
+from collections import OrderedDict
+import redis.asyncio as aioredis
+from django.conf import settings
+
+# Takes one token from every bucket in KEYS, or none at all.
+# ARGV: now, then (rate, burst) for each key.
+TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local tokens = {}
+for i, key in ipairs(KEYS) do
+	local rate = tonumber(ARGV[2 * i])
+	local burst = tonumber(ARGV[2 * i + 1])
+	local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+	local available = tonumber(bucket[1]) or burst
+	local ts = tonumber(bucket[2]) or now
+	available = math.min(burst, available + math.max(0, now - ts) * rate)
+	if available < 1 then
+		return 0
+	end
+	tokens[i] = available
+end
+for i, key in ipairs(KEYS) do
+	local rate = tonumber(ARGV[2 * i])
+	local burst = tonumber(ARGV[2 * i + 1])
+	redis.call('HSET', key, 'tokens', tokens[i] - 1, 'ts', now)
+	redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000))
+end
+return 1
+"""
+
+class InMemoryTokenBuckets:
+	"""Process-local token buckets.
+
+	At most ``max_keys`` buckets are kept, the least recently used go first:
+	a dropped bucket is full again, so only idle keys lose anything.
+	"""
+
+	def __init__(self, max_keys=100000):
+		self.max_keys = max_keys
+		self._buckets = OrderedDict()
+
+	def _refill(self, key, rate, burst, now):
+		tokens, ts = self._buckets.get(key, (burst, now))
+		return min(burst, tokens + (now - ts) * rate)
+
+	async def take(self, limits):
+		"""Take a token from every ``(key, rate, burst)`` bucket, all or nothing."""
+		now = time.monotonic()
+		refilled = [self._refill(key, rate, burst, now) for key, rate, burst in limits]
+		if any(tokens < 1 for tokens in refilled):
+			# Refused keys are in use too: churning others must not evict them
+			for key, _, _ in limits:
+				if key in self._buckets:
+					self._buckets.move_to_end(key)
+			return False
+		for (key, _, _), tokens in zip(limits, refilled):
+			self._buckets[key] = (tokens - 1, now)
+			self._buckets.move_to_end(key)
+		while len(self._buckets) > self.max_keys:
+			self._buckets.popitem(last=False)
+		return True
+
+class RedisTokenBuckets:
+	"""Token buckets shared by every worker, updated by one Lua call."""
+
+	def __init__(self, host='localhost', port=6379, prefix='ratelimit'):
+		self.host = host
+		self.port = port
+		self.prefix = prefix
+		self._clients = {}
+
+	def _client(self):
+		loop = asyncio.get_running_loop()
+		client = self._clients.get(loop)
+		if client is None:
+			client = aioredis.Redis(host=self.host, port=self.port)
+			self._clients[loop] = client
+		return client
+
+	async def take(self, limits):
+		keys = [f"{self.prefix}:{key}" for key, _, _ in limits]
+		args = [time.time()]
+		for _, rate, burst in limits:
+			args += [rate, burst]
+		return bool(await self._client().eval(TAKE_SCRIPT, len(keys), *keys, *args))
+
+class BidRateLimiter:
+	"""Limits bids per connection, per wallet and per clock.
+
+	Each of ``connection``, ``wallet`` and ``clock`` is a
+	``(tokens per second, burst)`` rule, or None to leave that scope unlimited.
+	"""
+
+	def __init__(self, buckets, connection=(2, 5), wallet=(2, 5), clock=(50, 200)):
+		self.buckets = buckets
+		self.rules = {'conn': connection, 'wallet': wallet, 'clock': clock}
+
+	async def allow(self, channel_name, wallet, clock_id):
+		ids = {'conn': channel_name, 'wallet': wallet, 'clock': clock_id}
+		# Without a wallet there is nothing to share a bucket with: every
+		# anonymous caller would be throttled together
+		limits = [
+			(f"{scope}:{ids[scope]}", rule[0], rule[1])
+			for scope, rule in self.rules.items() if rule is not None and ids[scope] is not None
+		]
+		return await self.buckets.take(limits)
+
+_limiter = None
+
+def get_bid_limiter():
+	"""Return the bid limiter configured in ``settings.LOBBY_RATE_LIMITS``."""
+	global _limiter
+	if _limiter is None:
+		config = dict(getattr(settings, 'LOBBY_RATE_LIMITS', {}))
+		backend = config.pop('BACKEND', 'memory')
+		host = config.pop('HOST', 'localhost')
+		port = config.pop('PORT', 6379)
+		if backend == 'redis':
+			buckets = RedisTokenBuckets(host=host, port=port)
+		else:
+			buckets = InMemoryTokenBuckets()
+		_limiter = BidRateLimiter(buckets, **{key.lower(): value for key, value in config.items()})
+	return _limiter
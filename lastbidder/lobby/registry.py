@@ -0,0 +1,75 @@
+import time
+from .chat import chat
+from .models import clock, MAIN_CLOCK_ID
+from .scheduler import scheduler as default_scheduler
+
+class ClockRegistry:
+	"""Live clocks keyed by clock id.
+
+	Clocks are created the first time a socket joins them and dropped once
+	they have expired and nobody is watching them anymore. The main clock is
+	never torn down.
+	"""
+
+	def __init__(self, scheduler=None):
+		self.scheduler = scheduler if scheduler is not None else default_scheduler
+		self._clocks = {}
+		self._watchers = {}
+
+	def __len__(self):
+		return len(self._clocks)
+
+	def __iter__(self):
+		return iter(list(self._clocks.values()))
+
+	def get(self, clock_id):
+		"""Return the clock for ``clock_id``, creating and starting it if needed."""
+		clk = self._clocks.get(clock_id)
+		if clk is None:
+			clk = clock(clock_id, scheduler=self.scheduler, on_expire=self._expired)
+			self._clocks[clock_id] = clk
+			clk.start()
+		return clk
+
+	def restore(self, clock_id, round_id, deadline, last_bidder, last_wallet=None, bids=0):
+		"""Resume a round recovered from the ledger; ``deadline`` is a unix timestamp.
+
+		A deadline that passed while the server was down expires on the next
+		scheduler tick and names ``last_bidder`` the winner.
+		"""
+		clk = clock(clock_id, scheduler=self.scheduler, on_expire=self._expired, round_id=round_id)
+		clk.deadline = time.monotonic() + deadline - time.time()
+		clk.last_bidder = last_bidder
+		clk.last_wallet = last_wallet
+		clk.bids = bids
+		self._clocks[clock_id] = clk
+		clk.start()
+		return clk
+
+	def acquire(self, clock_id):
+		"""Register a watcher on ``clock_id`` and return its clock."""
+		clk = self.get(clock_id)
+		self._watchers[clock_id] = self._watchers.get(clock_id, 0) + 1
+		return clk
+
+	def release(self, clock_id):
+		"""Drop a watcher, tearing the clock down if it is idle."""
+		count = self._watchers.get(clock_id, 0) - 1
+		if count > 0:
+			self._watchers[clock_id] = count
+			return
+		self._watchers.pop(clock_id, None)
+		clk = self._clocks.get(clock_id)
+		if clk is not None and not clk.is_active:
+			self._discard(clk)
+
+	def _expired(self, clk):
+		if not clk.is_active and clk.clock_id not in self._watchers:
+			self._discard(clk)
+
+	def _discard(self, clk):
+		if clk.clock_id != MAIN_CLOCK_ID and self._clocks.get(clk.clock_id) is clk:
+			del self._clocks[clk.clock_id]
+			chat.drop(clk.group_name)
+
+registry = ClockRegistry()
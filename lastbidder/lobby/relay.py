@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import math
+import struct
+from channels.layers import get_channel_layer
+from .broadcast import CHANNEL_SEND, FLUSH, group_send_many
+from .codec import json_codec, msgpack_codec
+
+logger = logging.getLogger(__name__)
+
+# One moved paddle in binary frames: user id, x, y
+PADDLE = struct.Struct('<Iff')
+FLOAT32_MAX = 3.4028234663852886e38
+UINT32_MAX = 0xFFFFFFFF
+
+class PaddleRelay:
+	"""Relays paddle positions to each clock group at a fixed tick rate.
+
+	Only the latest position of each sender is kept between ticks, and a
+	tick sends the positions that changed since the previous one, so the
+	fan-out costs at most ``rate`` frames per second per group whatever the
+	input rate. Binary clients get the positions packed as little-endian
+	``(uint32 user, float32 x, float32 y)`` records.
+	"""
+
+	def __init__(self, rate=20):
+		self.interval = 1 / rate
+		self._moved = {}
+		self._gone = {}
+		self._senders = {}  # group -> users whose paddle the group has seen
+		self._wakeup = None
+
+	def move(self, group_name, user_id, x, y):
+		"""Record the position of ``user_id``, replacing any pending one."""
+		# Anything PADDLE cannot pack is refused here: it would fail the
+		# whole tick otherwise
+		if not all(isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v)
+				and abs(v) <= FLOAT32_MAX for v in (x, y)):
+			raise ValueError("Invalid paddle position")
+		user_id = int(user_id)
+		if not 0 <= user_id <= UINT32_MAX:
+			raise ValueError("Invalid paddle user")
+		self._moved.setdefault(group_name, {})[user_id] = (x, y)
+		self._senders.setdefault(group_name, set()).add(user_id)
+		self._wake()
+
+	def leave(self, group_name, user_id):
+		"""Tell the group that ``user_id``'s paddle is gone."""
+		user_id = int(user_id)
+		senders = self._senders.get(group_name)
+		if senders is None or user_id not in senders:
+			return
+		senders.discard(user_id)
+		if not senders:
+			del self._senders[group_name]
+		self._moved.get(group_name, {}).pop(user_id, None)
+		self._gone.setdefault(group_name, set()).add(user_id)
+		self._wake()
+
+	def _wake(self):
+		if self._wakeup is not None:
+			self._wakeup.set()
+
+	@staticmethod
+	def frame(moved, gone):
+		"""Channel-layer message for one tick of a group."""
+		gone = sorted(gone)
+		packed = b''.join(PADDLE.pack(user_id, x, y) for user_id, (x, y) in moved.items())
+		return {
+			"type": "lobby.frame",
+			"text": json_codec.encode({
+				"event": "paddles",
+				"data": {"moved": [[user_id, x, y] for user_id, (x, y) in moved.items()], "gone": gone},
+			}),
+			"bytes": msgpack_codec.encode({
+				"event": "paddles",
+				"data": {"moved": packed, "gone": gone},
+			}),
+			# Positions are ephemeral: a lagging socket may skip ticks
+			"droppable": True,
+		}
+
+	async def flush(self):
+		moved_groups, self._moved = self._moved, {}
+		gone_groups, self._gone = self._gone, {}
+		with FLUSH.labels("paddles").time():
+			frames = []
+			for group_name in moved_groups.keys() | gone_groups.keys():
+				moved = moved_groups.get(group_name, {})
+				gone = gone_groups.get(group_name, set())
+				if moved or gone:
+					frames.append((group_name, self.frame(moved, gone)))
+			with CHANNEL_SEND.labels("paddles").time():
+				await group_send_many(get_channel_layer(), frames)
+
+	async def run(self):
+		"""Tick loop; idles while no paddle moves."""
+		self._wakeup = asyncio.Event()
+		if self._moved or self._gone:
+			self._wakeup.set()
+		try:
+			while True:
+				await self._wakeup.wait()
+				await asyncio.sleep(self.interval)
+				self._wakeup.clear()
+				try:
+					await self.flush()
+				except Exception:
+					# The tick's positions are lost; the next ones still go out
+					logger.exception("paddle relay flush failed")
+		finally:
+			self._wakeup = None
+
+relay = PaddleRelay()
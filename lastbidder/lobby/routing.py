@@ -2,5 +2,6 @@ from django.urls import path
 from .consumer import LobbyConsumer
 
 websocket_urlpatterns = [
-    path('lobby', LobbyConsumer.as_asgi()),
+    path('lobby', LobbyConsumer.as_asgi()),  # Main clock
+    path('lobby/<int:clock_id>', LobbyConsumer.as_asgi()),
 ]
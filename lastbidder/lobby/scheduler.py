@@ -0,0 +1,94 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from lastbidder.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_LAG = Histogram('lobby_clock_expiry_lag_seconds', 'How late clocks are closed after their deadline')
+
+class ClockScheduler:
+	"""One heap and one timer handle driving the expiry of every clock.
+
+	Each active clock has one live entry in the heap, at its ``wakeup``:
+	the deadline, or earlier when standing orders have to bid before it.
+	Bids only move ``clock.deadline`` forward; an entry that is early is
+	re-pushed with the current wakeup when it reaches the top, so a bid
+	never pays for a heap update. Only a wakeup that moves earlier pushes a
+	new entry, the one it replaces is skipped when it surfaces.
+	"""
+
+	def __init__(self):
+		self._heap = []
+		self._seq = itertools.count()
+		self._handle = None
+		self._handle_when = None
+		self._loop = None
+
+	def __len__(self):
+		return len(self._heap)
+
+	def schedule(self, clk):
+		"""Make sure ``clk`` has an entry in the heap, no later than its wakeup."""
+		when = clk.wakeup
+		if clk._scheduled is not None and clk._scheduled[0] <= when:
+			return
+		if self._loop is None:
+			self._loop = asyncio.get_running_loop()
+		self._push(clk, when)
+		self._rearm()
+
+	def _push(self, clk, when):
+		entry = (when, next(self._seq), clk)
+		clk._scheduled = entry
+		heapq.heappush(self._heap, entry)
+
+	def _rearm(self):
+		if not self._heap:
+			return
+		when = self._heap[0][0]
+		if self._handle is not None:
+			if self._handle_when <= when:
+				return
+			self._handle.cancel()
+		self._handle_when = when
+		self._handle = self._loop.call_later(max(0.0, when - time.monotonic()), self._fire)
+
+	def _fire(self):
+		self._handle = None
+		now = time.monotonic()
+		while self._heap and self._heap[0][0] <= now:
+			entry = heapq.heappop(self._heap)
+			clk = entry[2]
+			if clk._scheduled is not entry:
+				continue
+			try:
+				self._wake(clk, now)
+			except Exception:
+				# One clock must not stop the others: it still expires at its
+				# deadline, without the standing orders that failed
+				logger.exception("clock wakeup failed", extra={"clock_id": clk.clock_id})
+				clk.proxies = None
+				clk._scheduled = None
+				if clk.is_active and clk.deadline > now:
+					self._push(clk, clk.deadline)
+		self._rearm()
+
+	def _wake(self, clk, now):
+		if not clk.is_active:
+			clk._scheduled = None
+		elif clk.wakeup > now:
+			self._push(clk, clk.wakeup)
+		elif clk.deadline > now and clk.proxy_bid():
+			# An order bid, or was dropped: look at the orders again
+			self._push(clk, clk.wakeup)
+		elif clk.deadline > now:
+			self._push(clk, clk.deadline)
+		else:
+			clk._scheduled = None
+			EXPIRY_LAG.observe(now - clk.deadline)
+			clk._finish(self._loop)
+
+scheduler = ClockScheduler()
@@ -0,0 +1,108 @@
+import asyncio
+import sys
+from channels.db import database_sync_to_async
+from .broadcast import broadcaster
+from .capture import get_recorder
+from .chat import chat
+from .cluster import get_clocks
+from .ledger import ledger
+from .presence import run_reaper
+from .relay import relay
+from lastbidder.chain.verifier import get_verifier
+from lastbidder.metrics import watch_event_loop
+
+class LobbyService:
+	"""Background tasks of the lobby, run on the ASGI server's own loop.
+
+	Everything that touches clocks, presence or the channel layer lives on a
+	single loop, so no state is shared across threads and there is one
+	channel-layer connection pool per process.
+	"""
+
+	def __init__(self):
+		self._tasks = []
+		self._starting = None
+
+	@property
+	def running(self):
+		return bool(self._tasks)
+
+	async def ensure_started(self):
+		"""Recover the clocks and start the background tasks, once."""
+		if self._tasks:
+			return
+		if self._starting is None:
+			self._starting = asyncio.ensure_future(self._start())
+		try:
+			await asyncio.shield(self._starting)
+		except Exception:
+			# Let the next socket try again, e.g. once the database is up
+			self._starting = None
+			raise
+
+	async def _start(self):
+		# Resume the rounds that were running before a restart, before any
+		# socket can create a fresh clock
+		clocks = get_clocks()
+		for state in await database_sync_to_async(ledger.recover)():
+			await clocks.restore(*state)
+		loop = asyncio.get_running_loop()
+		self._tasks = [
+			loop.create_task(broadcaster.run()),
+			loop.create_task(chat.run()),
+			loop.create_task(relay.run()),
+			loop.create_task(ledger.run()),
+			loop.create_task(run_reaper()),
+			loop.create_task(watch_event_loop()),
+		]
+		if clocks.distributed:
+			self._tasks.append(loop.create_task(clocks.run()))
+		verifier = get_verifier()
+		if verifier is not None:
+			self._tasks.append(loop.create_task(verifier.run()))
+		recorder = get_recorder()
+		if recorder is not None:
+			self._tasks.append(loop.create_task(recorder.run()))
+		self._register_daphne_shutdown()
+
+	async def shutdown(self):
+		"""Stop the background tasks and send whatever is still pending."""
+		tasks, self._tasks = self._tasks, []
+		for task in tasks:
+			task.cancel()
+		await asyncio.gather(*tasks, return_exceptions=True)
+		self._starting = None
+		await broadcaster.flush()
+		await chat.flush()
+		await ledger.flush()
+		recorder = get_recorder()
+		if recorder is not None:
+			await recorder.flush()
+
+	def _register_daphne_shutdown(self):
+		# Daphne does not speak the ASGI lifespan protocol, but it runs on the
+		# Twisted asyncio reactor: hook the reactor shutdown instead.
+		reactor = sys.modules.get("twisted.internet.reactor")
+		if reactor is None or not reactor.running:
+			return
+		from twisted.internet import defer
+		reactor.addSystemEventTrigger(
+			"before", "shutdown",
+			lambda: defer.Deferred.fromFuture(asyncio.ensure_future(self.shutdown())),
+		)
+
+service = LobbyService()
+
+class LifespanApp:
+	"""ASGI lifespan handler for servers that support it (uvicorn, hypercorn)."""
+
+	async def __call__(self, scope, receive, send):
+		while True:
+			message = await receive()
+			if message["type"] == "lifespan.startup":
+				await service.ensure_started()
+				await send({"type": "lifespan.startup.complete"})
+			elif message["type"] == "lifespan.shutdown":
+				await service.shutdown()
+				await send({"type": "lifespan.shutdown.complete"})
+				return
@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+# Sent by the ledger, inside its transaction, once the winners of closed
+# rounds are confirmed (see BidLedger). ``rounds`` lists
+# ``(clock_id, round_id, wallet)``, ``wallet`` being the winner's, or None
+# when no valid bid was placed.
+rounds_closed = Signal()
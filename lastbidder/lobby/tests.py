@@ -1,3 +1,1153 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest import mock, skipIf
+import fakeredis
+import msgpack
+from asgiref.sync import async_to_sync
+from channels.layers import channel_layers
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from lastbidder.authService.tests import LOCAL_CACHES
+from lastbidder.chain.models import ClockCreation
+from lastbidder.metrics import Counter, Gauge, Histogram, Registry
+from lastbidder.settings import database_from_url
+from .capture import CLOSE, IN, OPEN, OUT, TrafficRecorder, read_capture
+from .broadcast import LOBBY_GROUP, Broadcaster, group_send_many
+from .chat import ChatHub
+from .cluster import BID_SCRIPT, RedisClocks, clock_exists
+from .codec import group_frame
+from .curves import FixedCurve, TieredCurve
+from .layers import PipelinedRedisChannelLayer
+from .management.commands.bench_lobby import METRICS, Command as BenchLobby
+from .management.commands.replay_lobby import captured_clocks, decode, last_bidders
+from .leaderboard import InMemoryLeaderboard, RedisLeaderboard
+from .ledger import BidLedger, ledger
+from .models import Bid, ClockRound, clock
+from .outbox import Outbox
+from .presence import InMemoryPresence, RedisPresence, run_reaper
+from .proxy import ProxyBook
+from .ratelimit import BidRateLimiter, InMemoryTokenBuckets, RedisTokenBuckets
+from .registry import registry
+from .relay import PADDLE, PaddleRelay
+from .routing import websocket_urlpatterns
+from .scheduler import ClockScheduler
+from .service import service
+from .signals import rounds_closed
+from .simulator import np, simulate, summarize
 
-# Create your tests here.
+IN_MEMORY_LAYER = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+def fake_redis():
+	"""A Redis client on its own in-process server, with Lua scripting (lupa)."""
+	return fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+
+class PipelinedLayerTests(SimpleTestCase):
+	def setUp(self):
+		self.layer = PipelinedRedisChannelLayer(hosts=[('localhost', 6379)])
+		redis = fake_redis()
+		self.layer.create_pool = lambda index: redis.connection_pool
+
+	def test_batch_order_kept_per_channel(self):
+		async def run():
+			channel = await self.layer.new_channel()
+			for group in ('g1', 'g2', 'g3'):
+				await self.layer.group_add(group, channel)
+			for _ in range(20):
+				await self.layer.group_send_many([(group, {'type': 'x', 'group': group}) for group in ('g1', 'g2', 'g3')])
+				received = [(await self.layer.receive(channel))['group'] for _ in range(3)]
+				self.assertEqual(received, ['g1', 'g2', 'g3'])
+			await self.layer.flush()
+		asyncio.run(run())
+
+	def test_group_send_reaches_every_member(self):
+		async def run():
+			channels = [await self.layer.new_channel() for _ in range(3)]
+			for channel in channels:
+				await self.layer.group_add('lobby', channel)
+			await self.layer.group_send('lobby', {'type': 'x', 'n': 1})
+			for channel in channels:
+				self.assertEqual((await self.layer.receive(channel))['n'], 1)
+			await self.layer.flush()
+		asyncio.run(run())
+
+class OutboxTests(SimpleTestCase):
+	def setUp(self):
+		self.written = []
+		self.overflows = []
+		self.outbox = Outbox(self.write, max_frames=3, on_overflow=lambda: self.overflows.append(True))
+
+	async def write(self, frame):
+		self.written.append(frame)
+
+	def drain(self):
+		async def run():
+			writer = asyncio.ensure_future(self.outbox.run())
+			await asyncio.sleep(0)
+			writer.cancel()
+		asyncio.run(run())
+
+	def test_keyed_frames_replace_pending_ones(self):
+		self.outbox.put('state 1', 'clock')
+		self.outbox.put('chat', droppable=True)
+		self.outbox.put('state 2', 'clock')
+		self.drain()
+		self.assertEqual(self.written, ['chat', 'state 2'])
+
+	def test_frames_older_than_the_latest_of_their_key_are_dropped(self):
+		self.outbox.put('state 3', 'clock', seq=3)
+		self.drain()
+		# Another worker's older state arrives after the newer one went out
+		self.outbox.put('state 2', 'clock', seq=2)
+		self.outbox.put('state 3 again', 'clock', seq=3)
+		self.outbox.put('other clock', 'clock 2', seq=1)
+		self.drain()
+		self.assertEqual(self.written, ['state 3', 'state 3 again', 'other clock'])
+
+	def test_droppable_frames_go_first(self):
+		self.outbox.put('a')
+		self.outbox.put('chat 1', droppable=True)
+		self.outbox.put('chat 2', droppable=True)
+		self.outbox.put('b')
+		self.drain()
+		self.assertEqual(self.written, ['a', 'chat 2', 'b'])
+		self.assertEqual((self.outbox.dropped, self.overflows), (1, []))
+
+	def test_overflow_without_droppable_frames(self):
+		for frame in 'abcd':
+			self.outbox.put(frame)
+		self.assertEqual(self.overflows, [True])
+		self.assertEqual(len(self.outbox), 0)
+		self.outbox.put('e')
+		self.drain()
+		self.assertEqual(self.written, [])
+
+class SendManyLayer:
+	"""Channel layer double recording each batch it is given."""
+
+	def __init__(self):
+		self.batches = []
+
+	async def group_send_many(self, messages):
+		self.batches.append(messages)
+
+class BroadcasterTests(SimpleTestCase):
+	def setUp(self):
+		self.layer = SendManyLayer()
+		patcher = mock.patch('lastbidder.lobby.broadcast.get_channel_layer', return_value=self.layer)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	@staticmethod
+	def clock(clock_id):
+		return SimpleNamespace(clock_id=clock_id, group_name=f'lobby_{clock_id}', is_active=True,
+			remaining_time=30.0, last_bidder='1', bid_time=10, seq=4)
+
+	def test_a_burst_collapses_into_one_frame_per_group(self):
+		async def run():
+			broadcaster = Broadcaster(interval=0.05)
+			task = asyncio.ensure_future(broadcaster.run())
+			await asyncio.sleep(0)
+			first, second = self.clock(1), self.clock(2)
+			for clk in (first, first, second, first):
+				broadcaster.mark_bid(clk)
+			broadcaster.mark_users(3)
+			broadcaster.mark_users(4)
+			await asyncio.sleep(0.1)
+			# Nothing changed since: the loop idles
+			await asyncio.sleep(0.1)
+			task.cancel()
+		asyncio.run(run())
+		self.assertEqual(len(self.layer.batches), 1)
+		frames = {group: json.loads(message['text'])['data'] for group, message in self.layer.batches[0]}
+		self.assertEqual(set(frames), {'lobby_1', 'lobby_2', LOBBY_GROUP})
+		self.assertEqual((frames['lobby_1']['bids'], frames['lobby_2']['bids']), (3, 1))
+		self.assertEqual(frames[LOBBY_GROUP], {'num_connected_users': 4})
+		self.assertAlmostEqual(frames['lobby_1']['deadline'] - frames['lobby_1']['server_time'], 30.0)
+		self.assertEqual(self.layer.batches[0][0][1]['key'], 'lobby_1')
+		self.assertEqual((self.layer.batches[0][0][1]['seq'], frames['lobby_1']['seq']), (4, 4))
+
+	def test_failed_flush_does_not_stop_the_loop(self):
+		async def run():
+			broadcaster = Broadcaster(interval=0.01)
+			task = asyncio.ensure_future(broadcaster.run())
+			with mock.patch.object(self.layer, 'group_send_many', side_effect=[RuntimeError('redis down'), None]) as send:
+				for _ in range(2):
+					broadcaster.mark_users(3)
+					await asyncio.sleep(0.05)
+			task.cancel()
+			return send.call_count
+		with self.assertLogs('lastbidder.lobby.broadcast', 'ERROR'):
+			self.assertEqual(asyncio.run(run()), 2)
+
+	def test_group_send_many_falls_back_to_one_send_per_group(self):
+		layer = mock.Mock(spec=['group_send'])
+		layer.group_send = mock.AsyncMock()
+		messages = [('a', {'type': 'x'}), ('b', {'type': 'y'})]
+		asyncio.run(group_send_many(layer, messages))
+		self.assertEqual(layer.group_send.await_args_list, [mock.call('a', {'type': 'x'}), mock.call('b', {'type': 'y'})])
+		asyncio.run(group_send_many(self.layer, messages))
+		asyncio.run(group_send_many(self.layer, []))
+		self.assertEqual(self.layer.batches, [messages])
+
+class PaddleRelayTests(SimpleTestCase):
+	def setUp(self):
+		self.layer = SendManyLayer()
+		patcher = mock.patch('lastbidder.lobby.relay.get_channel_layer', return_value=self.layer)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.relay = PaddleRelay()
+
+	def flush(self):
+		asyncio.run(self.relay.flush())
+		batches, self.layer.batches = self.layer.batches, []
+		return {group: message for batch in batches for group, message in batch}
+
+	def test_latest_position_wins_and_is_packed(self):
+		self.relay.move('lobby_1', '7', 0.5, 1)
+		self.relay.move('lobby_1', '7', 0.25, 2)
+		self.relay.move('lobby_1', 8, -1, 0)
+		message = self.flush()['lobby_1']
+		self.assertTrue(message['droppable'])
+		self.assertEqual(json.loads(message['text'])['data'], {'moved': [[7, 0.25, 2], [8, -1, 0]], 'gone': []})
+		packed = msgpack.unpackb(message['bytes'])['data']['moved']
+		self.assertEqual(len(packed), 2 * PADDLE.size)
+		self.assertEqual(list(PADDLE.iter_unpack(packed)), [(7, 0.25, 2.0), (8, -1.0, 0.0)])
+		# A tick only carries what moved since the previous one
+		self.assertEqual(self.flush(), {})
+
+	def test_leaving_is_announced_once(self):
+		self.relay.move('lobby_1', 7, 0, 0)
+		self.flush()
+		self.relay.leave('lobby_1', 7)
+		self.relay.leave('lobby_1', 7)
+		self.relay.leave('lobby_1', 9)
+		data = msgpack.unpackb(self.flush()['lobby_1']['bytes'])['data']
+		self.assertEqual(data, {'moved': b'', 'gone': [7]})
+
+	def test_invalid_positions_are_refused(self):
+		for x in (float('nan'), float('inf'), True, '1', None, 1e39, -1e39):
+			with self.assertRaises(ValueError):
+				self.relay.move('lobby_1', 7, x, 0)
+		for user_id in (-1, 2 ** 32):
+			with self.assertRaises(ValueError):
+				self.relay.move('lobby_1', user_id, 0, 0)
+		self.assertEqual(self.flush(), {})
+
+	def test_failed_tick_does_not_stop_the_relay(self):
+		async def run():
+			task = asyncio.ensure_future(self.relay.run())
+			with mock.patch.object(self.relay, 'flush', side_effect=[RuntimeError('layer down'), None]) as flush:
+				for _ in range(2):
+					self.relay.move('lobby_1', 7, 0, 0)
+					await asyncio.sleep(self.relay.interval * 3)
+			task.cancel()
+			return flush.call_count
+		self.relay.interval = 0.01
+		with self.assertLogs('lastbidder.lobby.relay', 'ERROR'):
+			self.assertEqual(asyncio.run(run()), 2)
+
+class ChatHubTests(SimpleTestCase):
+	def setUp(self):
+		self.layer = SendManyLayer()
+		patcher = mock.patch('lastbidder.lobby.chat.get_channel_layer', return_value=self.layer)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_failed_flush_does_not_stop_the_chat(self):
+		async def run():
+			hub = ChatHub(interval=0.01)
+			task = asyncio.ensure_future(hub.run())
+			await asyncio.sleep(0)
+			with mock.patch.object(self.layer, 'group_send_many', side_effect=[RuntimeError('redis down'), None]) as send:
+				for text in ('lost', 'delivered'):
+					hub.post('lobby_1', 7, text)
+					await asyncio.sleep(0.05)
+			task.cancel()
+			return hub, send
+		with self.assertLogs('lastbidder.lobby.chat', 'ERROR'):
+			hub, send = asyncio.run(run())
+		self.assertEqual(send.call_count, 2)
+		self.assertEqual([m['message'] for m in hub.history('lobby_1')], ['lost', 'delivered'])
+
+class MetricsTests(SimpleTestCase):
+	def setUp(self):
+		patcher = mock.patch('lastbidder.metrics.registry', Registry())
+		self.registry = patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_counters_and_gauges(self):
+		bids = Counter('bids_total', 'Bids', ['result'])
+		sockets = Gauge('sockets', 'Open sockets')
+		bids.labels('ok').inc()
+		bids.labels('ok').inc(2)
+		bids.labels('say "hi"').inc()
+		sockets.inc(3)
+		sockets.dec()
+		self.assertEqual(self.registry.render().splitlines(), [
+			'# HELP bids_total Bids',
+			'# TYPE bids_total counter',
+			'bids_total{result="ok"} 3.0',
+			'bids_total{result="say \\"hi\\""} 1.0',
+			'# HELP sockets Open sockets',
+			'# TYPE sockets gauge',
+			'sockets 2.0',
+		])
+
+	def test_histogram_buckets_are_cumulative(self):
+		latency = Histogram('latency_seconds', 'Latency', ['source'], buckets=(0.1, 0.01))
+		for value in (0.005, 0.01, 0.05, 3):
+			latency.labels('bid').observe(value)
+		with mock.patch('lastbidder.metrics.time.perf_counter', side_effect=[1.0, 1.5]):
+			with latency.labels('chat').time():
+				pass
+		lines = self.registry.render().splitlines()
+		self.assertEqual(lines[2:7], [
+			'latency_seconds_bucket{source="bid",le="0.01"} 2',
+			'latency_seconds_bucket{source="bid",le="0.1"} 3',
+			'latency_seconds_bucket{source="bid",le="+Inf"} 4',
+			'latency_seconds_sum{source="bid"} 3.065',
+			'latency_seconds_count{source="bid"} 4',
+		])
+		self.assertIn('latency_seconds_sum{source="chat"} 0.5', lines)
+
+	@override_settings(METRICS_TOKEN='s3cret')
+	def test_scrape_needs_the_token(self):
+		Counter('bids_total', 'Bids').inc()
+		self.assertEqual(self.client.get('/metrics/').status_code, 401)
+		response = self.client.get('/metrics/', headers={'Authorization': 'Bearer s3cret'})
+		self.assertEqual(response.status_code, 200)
+		self.assertIn(b'bids_total 1.0', response.content)
+
+class DatabaseUrlTests(SimpleTestCase):
+	def test_postgres_url(self):
+		config = database_from_url('postgres://bidder:p%40ss@db:6543/last%20bidder')
+		self.assertEqual(config['ENGINE'], 'django.db.backends.postgresql')
+		self.assertEqual((config['NAME'], config['USER'], config['PASSWORD']), ('last bidder', 'bidder', 'p@ss'))
+		self.assertEqual((config['HOST'], config['PORT']), ('db', 6543))
+		self.assertEqual(config['CONN_MAX_AGE'], 60)
+		self.assertTrue(config['CONN_HEALTH_CHECKS'])
+		self.assertFalse(config['DISABLE_SERVER_SIDE_CURSORS'])
+		self.assertEqual(database_from_url('postgresql://db/lastbidder')['PORT'], 5432)
+
+	def test_connection_options(self):
+		self.assertIsNone(database_from_url('postgres://db/x', conn_max_age='None')['CONN_MAX_AGE'])
+		self.assertEqual(database_from_url('postgres://db/x', conn_max_age='0')['CONN_MAX_AGE'], 0)
+		self.assertTrue(database_from_url('postgres://db/x', pooler='pgbouncer')['DISABLE_SERVER_SIDE_CURSORS'])
+
+	def test_sqlite_without_url(self):
+		config = database_from_url('')
+		self.assertEqual(config['ENGINE'], 'django.db.backends.sqlite3')
+		self.assertNotIn('CONN_MAX_AGE', config)
+		with self.assertRaises(ImproperlyConfigured):
+			database_from_url('mysql://db/x')
+
+class RedisLeaderboardTests(SimpleTestCase):
+	def setUp(self):
+		self.leaderboard = RedisLeaderboard()
+		self.leaderboard._client = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+
+	def test_prizes_stay_exact(self):
+		wei = 10 ** 18 + 1
+		self.leaderboard.add('prizes', '0xa', wei)
+		self.leaderboard.add('prizes', '0xa', 2 ** 70)
+		self.leaderboard.add('prizes', '0xb', wei)
+		self.assertEqual(self.leaderboard.top('prizes'), [('0xa', wei + 2 ** 70), ('0xb', wei)])
+		self.assertEqual(self.leaderboard.rank('prizes', '0xb'), (2, wei))
+
+	def test_zero_totals_leave_the_board(self):
+		self.leaderboard.add('wins', '0xa', 2)
+		self.leaderboard.add('wins', '0xb', 1)
+		self.leaderboard.add('wins', '0xa', -2)
+		self.assertEqual(self.leaderboard.top('wins'), [('0xb', 1)])
+		self.assertIsNone(self.leaderboard.rank('wins', '0xa'))
+		self.leaderboard.reset('wins')
+		self.assertEqual(self.leaderboard.top('wins'), [])
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class RedisClocksTests(SimpleTestCase):
+	"""Two workers sharing one Redis server."""
+
+	def setUp(self):
+		for module, name in (('cluster', 'ledger'), ('cluster', 'broadcaster'), ('models', 'ledger'), ('models', 'broadcaster')):
+			patcher = mock.patch(f'lastbidder.lobby.{module}.{name}')
+			setattr(self, f'{module}_{name}', patcher.start())
+			self.addCleanup(patcher.stop)
+		server = fakeredis.FakeServer()
+		self.workers = []
+		for _ in range(2):
+			worker = RedisClocks(duration=0.3, tick=0.05, retries=2)
+			redis = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+			worker._client = lambda redis=redis: redis
+			self.workers.append(worker)
+
+	async def join(self, clock_id=5):
+		clocks = [await worker.join(clock_id) for worker in self.workers]
+		for clk in clocks:
+			clk.curve = FixedCurve(0)
+		return clocks
+
+	def test_join_creates_the_clock_once(self):
+		async def run():
+			a, b = await self.join()
+			self.assertEqual(a.round_id, b.round_id)
+			self.cluster_ledger.open_round.assert_called_once_with(a)
+		asyncio.run(run())
+
+	def test_stale_bid_is_retried_with_the_current_state(self):
+		async def run():
+			a, b = await self.join()
+			await self.workers[0].bid(a, 'x', '0xx')
+			# b's mirror has not seen x's bid: the script refuses, the retry goes through
+			self.assertEqual(b.bids, 0)
+			await self.workers[1].bid(b, 'y', '0xy')
+			self.assertEqual((b.bids, b.last_bidder), (2, 'y'))
+			# a's mirror still holds x's bid, its frames are marked older
+			self.assertEqual((a.seq, b.seq), (1, 2))
+		asyncio.run(run())
+
+	def test_bid_gives_up_after_its_retries(self):
+		async def run():
+			a, b = await self.join()
+			client = self.workers[1]._client()
+			send = client.eval
+
+			async def racing_eval(script, *args):
+				# Another worker's bid gets in before every attempt
+				if script == BID_SCRIPT:
+					await self.workers[0].bid(a, 'x', '0xx')
+				return await send(script, *args)
+
+			client.eval = racing_eval
+			with self.assertRaises(RuntimeError):
+				await self.workers[1].bid(b, 'y', '0xy')
+			self.assertEqual(a.bids, 2)
+		asyncio.run(run())
+
+	def test_leader_expires_the_round_once(self):
+		async def run():
+			a, _ = await self.join()
+			await self.workers[0].bid(a, 'x', '0xx')
+			for worker in self.workers:
+				await worker._campaign()
+			leader = self.workers[0]
+			self.assertEqual([worker.leading for worker in self.workers], [True, False])
+			await asyncio.sleep(0.4)
+			# Nobody else campaigned while the lease lapsed
+			await leader._campaign()
+			await leader._expire_due()
+			await leader._expire_due()
+			self.models_ledger.close_round.assert_called_once()
+			self.assertEqual(self.models_ledger.close_round.call_args[0][0].last_bidder, 'x')
+			self.assertFalse(a.is_active)
+		asyncio.run(run())
+
+	def test_lease_is_taken_over_when_the_leader_stops_renewing(self):
+		async def run():
+			old, new = self.workers
+			# A lease long enough that it cannot lapse between two campaigns
+			old.lease_ttl = new.lease_ttl = 0.25
+			await old._campaign()
+			await new._campaign()
+			self.assertFalse(new.leading)
+			await asyncio.sleep(0.3)
+			await new._campaign()
+			self.assertTrue(new.leading)
+			# The deposed leader finds out on its next expiry and closes nothing
+			self.assertEqual(await old._expire_due(), old.poll)
+			self.assertFalse(old.leading)
+		asyncio.run(run())
+
+	def test_dead_leader_is_replaced_within_a_tick(self):
+		async def run():
+			old, new = self.workers
+			running = [asyncio.ensure_future(old.run())]
+			await asyncio.sleep(0.02)
+			running.append(asyncio.ensure_future(new.run()))
+			try:
+				await asyncio.sleep(0.1)
+				self.assertEqual([old.leading, new.leading], [True, False])
+				# Redis drops the leader: it can neither renew nor hand the lease over
+				old._client = mock.Mock(return_value=mock.Mock(
+					eval=mock.AsyncMock(side_effect=ConnectionError), set=mock.AsyncMock(side_effect=ConnectionError)))
+				died = time.monotonic()
+				with self.assertLogs('lastbidder.lobby.cluster', 'ERROR'):
+					while not new.leading:
+						await asyncio.sleep(0.001)
+				# Scheduling noise on top of the bound
+				self.assertLess(time.monotonic() - died, new.tick + 0.02)
+			finally:
+				for task in running:
+					task.cancel()
+				await asyncio.gather(*running, return_exceptions=True)
+		asyncio.run(run())
+
+	def test_followers_see_the_round_end_at_its_deadline(self):
+		async def run():
+			a, b = await self.join()
+			await self.workers[0].bid(a, 'x', '0xx')
+			self.assertTrue(b.is_active)
+			await asyncio.sleep(0.35)
+			# No leader has closed the round, no state was pushed to the mirrors
+			self.models_ledger.close_round.assert_not_called()
+			self.assertEqual([a.is_active, b.is_active], [False, False])
+			self.assertEqual(b.remaining_time, 0)
+		asyncio.run(run())
+
+class RedisPresenceTests(SimpleTestCase):
+	def test_backends_agree(self):
+		async def run():
+			redis = fake_redis()
+			backends = [InMemoryPresence(shards=4), RedisPresence(shards=4)]
+			backends[1]._client = lambda: redis
+			for presence in backends:
+				# One user on two sockets is online once
+				await presence.join('c1', '1')
+				await presence.join('c2', '1')
+				await presence.join('c3', '2')
+				self.assertEqual(await presence.count(), 2)
+				await presence.leave('c1', '1')
+				await presence.leave('c1', '1')
+				self.assertEqual(await presence.count(), 2)
+				await presence.leave('c2', '1')
+				self.assertEqual(await presence.count(), 1)
+				# A socket that stops beating is reaped
+				presence.ttl = -1
+				self.assertFalse(await presence.heartbeat('c3', '2'))
+				self.assertEqual(await presence.reap(), 1)
+				self.assertEqual(await presence.count(), 0)
+				# Reaped while still open (a stalled loop): the next beat brings it back
+				presence.ttl = 30
+				self.assertTrue(await presence.heartbeat('c3', '2'))
+				self.assertFalse(await presence.heartbeat('c3', '2'))
+				self.assertEqual(await presence.count(), 1)
+		asyncio.run(run())
+
+	def test_reaper_survives_a_failed_pass(self):
+		async def run():
+			presence = InMemoryPresence()
+			presence.reap = mock.AsyncMock(side_effect=[ConnectionError('redis down'), 1] + [0] * 100)
+			with mock.patch('lastbidder.lobby.presence.get_presence', return_value=presence), \
+					mock.patch('lastbidder.lobby.presence.broadcaster') as broadcaster:
+				task = asyncio.ensure_future(run_reaper(interval=0.01))
+				with self.assertLogs('lastbidder.lobby.presence', 'ERROR'):
+					await asyncio.sleep(0.05)
+				task.cancel()
+			broadcaster.mark_users.assert_called_once_with(0)
+		asyncio.run(run())
+
+class RedisRateLimitTests(SimpleTestCase):
+	def test_buckets_take_all_or_nothing(self):
+		async def run():
+			redis = fake_redis()
+			buckets = RedisTokenBuckets()
+			buckets._client = lambda: redis
+			for buckets in (InMemoryTokenBuckets(), buckets):
+				limiter = BidRateLimiter(buckets, connection=(0.001, 2), wallet=(0.001, 3), clock=None)
+				self.assertTrue(await limiter.allow('c1', '0xa', 1))
+				self.assertTrue(await limiter.allow('c1', '0xa', 1))
+				self.assertFalse(await limiter.allow('c1', '0xa', 1))
+				# The refused bid took nothing from the wallet bucket
+				self.assertTrue(await limiter.allow('c2', '0xa', 1))
+				self.assertFalse(await limiter.allow('c3', '0xa', 1))
+		asyncio.run(run())
+
+class TokenBucketTests(SimpleTestCase):
+	def test_full_table_evicts_the_least_recent_bucket(self):
+		async def run():
+			buckets = InMemoryTokenBuckets(max_keys=2)
+			limits = lambda key: [(key, 0.001, 1)]
+			self.assertTrue(await buckets.take(limits('a')))
+			self.assertTrue(await buckets.take(limits('b')))
+			self.assertFalse(await buckets.take(limits('a')))
+			# A new key pushes out b, a stays empty
+			self.assertTrue(await buckets.take(limits('c')))
+			self.assertFalse(await buckets.take(limits('a')))
+			self.assertTrue(await buckets.take(limits('b')))
+		asyncio.run(run())
+
+	def test_bids_without_wallet_do_not_share_a_bucket(self):
+		async def run():
+			limiter = BidRateLimiter(InMemoryTokenBuckets(), connection=(0.001, 1), wallet=(0.001, 1), clock=None)
+			self.assertTrue(await limiter.allow('c1', None, 1))
+			self.assertTrue(await limiter.allow('c2', None, 1))
+			self.assertFalse(await limiter.allow('c1', None, 1))
+		asyncio.run(run())
+
+class LedgerVerificationTests(TestCase):
+	"""Winners of closed rounds, as the receipt verifier's verdicts come in."""
+
+	def setUp(self):
+		self.ledger = BidLedger()
+		self.leaderboard = InMemoryLeaderboard()
+		patcher = mock.patch('lastbidder.lobby.ledger.get_leaderboard', return_value=self.leaderboard)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.won = []
+		def on_closed(sender, rounds, **kwargs):
+			self.won.extend(rounds)
+		rounds_closed.connect(on_closed, weak=False, dispatch_uid='tests')
+		self.addCleanup(rounds_closed.disconnect, dispatch_uid='tests')
+		self.now = datetime.now(timezone.utc)
+		self.round_id = uuid.uuid4()
+		self.ledger._write([(self.round_id, 1, self.now, self.now)], [], [])
+
+	def bid(self, bidder, tx_hash=None):
+		self.ledger._write([], [(self.round_id, 1, bidder, f'0x{bidder}', tx_hash, self.now, self.now)], [])
+
+	def close(self, verdicts=()):
+		self.ledger._write([], [], [(self.round_id, self.now, None, None, 1)], list(verdicts))
+
+	def verdict(self, tx_hash, ok):
+		self.ledger._write([], [], [], [(tx_hash, ok)])
+
+	def round(self):
+		return ClockRound.objects.get(id=self.round_id)
+
+	def test_win_waits_for_the_verdict(self):
+		self.bid('a', '0x1')
+		self.close()
+		self.assertEqual((self.round().winner, self.round().confirmed), ('a', False))
+		self.assertEqual(self.won, [])
+		self.verdict('0x1', True)
+		self.assertTrue(self.round().confirmed)
+		self.assertEqual(self.won, [(1, self.round_id, '0xa')])
+		self.assertEqual(self.leaderboard.rank('wins', '0xa'), (1, 1))
+
+	def test_rejected_bid_passes_the_round_back(self):
+		self.bid('a')
+		self.bid('b', '0x2')
+		self.close()
+		self.verdict('0x2', False)
+		self.assertEqual((self.round().winner, self.round().confirmed), ('a', True))
+		self.assertEqual(self.won, [(1, self.round_id, '0xa')])
+
+	def test_rejected_bidder_is_barred_from_the_round(self):
+		self.bid('b', '0x1')
+		self.bid('a')
+		self.bid('b', '0x2')
+		self.verdict('0x1', False)
+		self.close()
+		# b's later bid is valid on its own, but b cheated in this round
+		self.assertEqual(self.round().winner, 'a')
+
+	def test_reused_transaction_voids_the_bid(self):
+		self.bid('a', '0x1')
+		self.bid('b', '0x1')
+		replay = Bid.objects.get(bidder='b')
+		self.assertEqual((replay.tx_hash, replay.verified), (None, False))
+		self.verdict('0x1', True)
+		self.close()
+		self.assertEqual(self.round().winner, 'a')
+
+	def test_nothing_to_verify(self):
+		self.bid('a')
+		self.close()
+		self.assertTrue(self.round().confirmed)
+		self.assertEqual(self.won, [(1, self.round_id, '0xa')])
+
+class LedgerRecoveryTests(TestCase):
+	"""Rounds a crash left open, or closed and waiting for a verdict."""
+
+	def setUp(self):
+		self.ledger = BidLedger()
+		self.leaderboard = InMemoryLeaderboard()
+		patcher = mock.patch('lastbidder.lobby.ledger.get_leaderboard', return_value=self.leaderboard)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.won = []
+		def on_closed(sender, rounds, **kwargs):
+			self.won.extend(rounds)
+		rounds_closed.connect(on_closed, weak=False, dispatch_uid='tests')
+		self.addCleanup(rounds_closed.disconnect, dispatch_uid='tests')
+		self.start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+	def open_round(self, clock_id, minute, bids=()):
+		round_id = uuid.uuid4()
+		started_at = self.start + timedelta(minutes=minute)
+		self.ledger._write([(round_id, clock_id, started_at, started_at + timedelta(seconds=100))], [
+			(round_id, clock_id, bidder, f'0x{bidder}', tx_hash, started_at, started_at + timedelta(seconds=140 + n))
+			for n, (bidder, tx_hash) in enumerate(bids)
+		], [])
+		return round_id
+
+	def test_stale_rounds_are_closed_once(self):
+		# Clock 1 crashed twice before its last round; clock 2 before a verdict
+		old = self.open_round(1, 0, [('a', None)])
+		older_unverified = self.open_round(2, 0, [('b', '0x1')])
+		middle = self.open_round(1, 5, [('c', None), ('a', None)])
+		latest = self.open_round(1, 10, [('b', None), ('c', None)])
+		idle = self.open_round(2, 10)
+		# Closed before the crash, still waiting for its verdict
+		waiting = self.open_round(3, 0, [('d', '0x2')])
+		self.ledger._write([], [], [(waiting, self.start, None, None, 3)])
+
+		states = self.ledger.recover()
+		self.assertEqual(sorted(states), sorted([
+			(1, latest, (self.start + timedelta(minutes=10, seconds=141)).timestamp(), 'c', '0xc', 2),
+			(2, idle, (self.start + timedelta(minutes=10, seconds=100)).timestamp(), None, None, 0),
+		]))
+		rounds = {rnd.id: rnd for rnd in ClockRound.objects.all()}
+		self.assertEqual(rounds[old].ended_at, rounds[middle].started_at)
+		self.assertEqual(rounds[middle].ended_at, rounds[latest].started_at)
+		self.assertEqual([(rounds[r].winner, rounds[r].confirmed) for r in (old, middle, older_unverified, waiting)],
+			[('a', True), ('a', True), ('b', False), ('d', False)])
+		self.assertIsNone(rounds[latest].ended_at)
+		self.assertEqual(sorted(self.won), sorted([(1, old, '0xa'), (1, middle, '0xa')]))
+		self.assertEqual(self.leaderboard.rank('wins', '0xa'), (1, 2))
+
+		# A second restart finds nothing left to close
+		self.assertEqual(sorted(self.ledger.recover()), sorted(states))
+		self.assertEqual(len(self.won), 2)
+		self.assertEqual(self.leaderboard.rank('wins', '0xa'), (1, 2))
+		self.assertIsNone(self.leaderboard.rank('wins', '0xb'))
+
+@override_settings(CACHES=LOCAL_CACHES)
+class RebuildLeaderboardTests(TestCase):
+	def test_only_confirmed_wins_count(self):
+		leaderboard = InMemoryLeaderboard()
+		users = [get_user_model().objects.create(wallet=f'0x{n}') for n in ('a', 'b')]
+		now = datetime.now(timezone.utc)
+		for user, confirmed in ((users[0], True), (users[0], False), (users[1], False)):
+			ClockRound.objects.create(clock_id=1, started_at=now, deadline=now, ended_at=now,
+				winner=str(user.id), confirmed=confirmed)
+		with mock.patch('lastbidder.lobby.management.commands.rebuild_leaderboard.get_leaderboard',
+				return_value=leaderboard):
+			call_command('rebuild_leaderboard', stdout=io.StringIO())
+		self.assertEqual(leaderboard.top('wins'), [('0xa', 1)])
+
+class ProxyBookTests(SimpleTestCase):
+	def setUp(self):
+		self.book = ProxyBook()
+		for bidder, budget in (('a', 3), ('b', 5), ('c', 5)):
+			self.book.place(bidder, f'0x{bidder}', budget)
+
+	def test_deepest_budget_answers(self):
+		# Ties go to the oldest order
+		self.assertEqual(self.book.next_bidder(None), ('b', '0xb'))
+		self.assertEqual(self.book.next_bidder('x'), ('b', '0xb'))
+
+	def test_winning_order_does_not_answer_itself(self):
+		self.assertEqual(self.book.next_bidder('b'), ('c', '0xc'))
+		# Looking below the top leaves the heap as it was
+		self.assertEqual(self.book.next_bidder(None), ('b', '0xb'))
+
+	def test_replaced_and_cancelled_orders_are_skipped(self):
+		self.book.place('b', '0xb', 1)
+		self.book.place('c', '0xc', 0)
+		self.assertEqual(self.book.next_bidder(None), ('a', '0xa'))
+		self.assertEqual((self.book.budget('b'), self.book.budget('c')), (1, 0))
+		self.assertEqual(len(self.book), 2)
+
+	def test_spend_drops_empty_orders(self):
+		for _ in range(3):
+			self.assertEqual(self.book.spend('a', 1), (True, None))
+		self.assertNotIn('a', self.book)
+		self.assertEqual(self.book.budget('b'), 5)
+
+	def test_orders_are_paid_with_transactions(self):
+		verifier = mock.Mock()
+		verifier.submit.return_value = True
+		book = ProxyBook(verifier=verifier)
+		with self.assertRaises(ValueError):
+			book.place('a', '0xa', 2, ['0x1'])
+		book.place('a', '0xa', 2, ['0x1', '0x2'])
+		self.assertEqual(book.spend('a', 7), (True, '0x1'))
+		verifier.submit.assert_called_once_with('0x1', '0xa', 7, None)
+		# A transaction the verifier refuses cancels the order
+		verifier.submit.return_value = False
+		self.assertEqual(book.spend('a', 7), (False, '0x2'))
+		self.assertNotIn('a', book)
+
+	def test_transactions_are_ignored_without_a_verifier(self):
+		self.book.place('d', '0xd', 2, ['0x1', '0x2'])
+		self.assertEqual(self.book.spend('d', 7), (True, None))
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class ClockSchedulerTests(SimpleTestCase):
+	def setUp(self):
+		for name in ('ledger', 'broadcaster'):
+			patcher = mock.patch(f'lastbidder.lobby.models.{name}')
+			setattr(self, name, patcher.start())
+			self.addCleanup(patcher.stop)
+		self.scheduler = ClockScheduler()
+		self.expired = []
+
+	def clock(self, duration, seconds, lead=0.05):
+		clk = clock(5, duration=duration, curve=FixedCurve(seconds), scheduler=self.scheduler,
+			on_expire=lambda clk: self.expired.append(clk.last_bidder))
+		clk.proxies = ProxyBook(lead)
+		return clk
+
+	def test_expiry_fires_once(self):
+		async def run():
+			clk = self.clock(0.05, 1)
+			for _ in range(3):
+				clk.start()
+			await asyncio.sleep(0.2)
+			self.assertEqual(self.expired, [None])
+			self.assertFalse(clk.is_active)
+			self.assertEqual(len(self.scheduler), 0)
+			self.ledger.close_round.assert_called_once_with(clk)
+		asyncio.run(run())
+
+	def test_bids_push_expiry_back(self):
+		async def run():
+			clk = self.clock(0.05, 0.15)
+			clk.start()
+			await asyncio.sleep(0.02)
+			clk.add_time('x', '0xx')
+			await asyncio.sleep(0.1)
+			self.assertEqual(self.expired, [])
+			await asyncio.sleep(0.2)
+			self.assertEqual(self.expired, ['x'])
+		asyncio.run(run())
+
+	def test_standing_orders_fight_until_a_budget_runs_out(self):
+		async def run():
+			clk = self.clock(0.1, 0.1)
+			clk.add_time('x', '0xx')
+			clk.proxies.place('a', '0xa', 2)
+			clk.proxies.place('b', '0xb', 3)
+			clk.start()
+			await asyncio.sleep(1.0)
+			# b answers x, a answers b twice and b has the last word
+			self.assertEqual(self.expired, ['b'])
+			self.assertEqual(clk.bids, 1 + 3 + 2)
+		asyncio.run(run())
+
+	def test_order_placed_with_transactions_and_no_verifier_ends_the_round(self):
+		async def run():
+			clk = self.clock(0.1, 0.1)
+			clk.add_time('x', '0xx')
+			clk.proxies.place('a', '0xa', 1, ['0x' + '1' * 64])
+			clk.start()
+			await asyncio.sleep(0.5)
+			self.assertEqual(self.expired, ['a'])
+			self.assertEqual(len(self.scheduler), 0)
+		asyncio.run(run())
+
+	def test_a_failing_clock_does_not_stop_the_others(self):
+		async def run():
+			broken, healthy = self.clock(0.1, 0.1), self.clock(0.15, 0.1)
+			broken.add_time('x', '0xx')
+			broken.proxies.place('a', '0xa', 1)
+			broken.proxy_bid = mock.Mock(side_effect=AttributeError('boom'))
+			healthy.start()
+			broken.start()
+			with self.assertLogs('lastbidder.lobby.scheduler', 'ERROR'):
+				await asyncio.sleep(0.4)
+			# The broken clock still expires, without its standing orders
+			self.assertEqual(sorted(self.expired, key=str), [None, 'x'])
+			self.assertIsNone(broken.proxies)
+			self.assertEqual(len(self.scheduler), 0)
+		asyncio.run(run())
+
+	def test_no_standing_order_bids_without_extension(self):
+		async def run():
+			clk = self.clock(0.1, 0)
+			clk.add_time('x', '0xx')
+			clk.proxies = ProxyBook(0.05)
+			clk.proxies.place('a', '0xa', 5)
+			clk.proxies.place('b', '0xb', 5)
+			clk.start()
+			await asyncio.sleep(0.3)
+			self.assertEqual(self.expired, ['x'])
+			self.assertEqual(clk.bids, 1)
+		asyncio.run(run())
+
+	def test_bid_on_a_stopped_clock_opens_with_the_first_tier(self):
+		async def run():
+			clk = clock(5, duration=0.01, curve=TieredCurve([(0, 30), (10, 5)], limit=60, below=0),
+				scheduler=self.scheduler)
+			clk.start()
+			await asyncio.sleep(0.05)
+			self.assertFalse(clk.is_active)
+			clk.add_time('x', '0xx')
+			self.assertTrue(clk.is_active)
+			self.assertEqual(clk.bid_time, 30)
+			# Under the limit the next bid adds nothing
+			clk.add_time('y', '0xy')
+			self.assertEqual(clk.bid_time, 0)
+		asyncio.run(run())
+
+@skipIf(np is None, 'The simulator needs NumPy')
+class SimulatorTests(SimpleTestCase):
+	def test_vectorized_extensions_match_the_live_curve(self):
+		curve = TieredCurve([(0, 40), (10, 20), (50, 5)], limit=30, below=2)
+		remaining = np.array([100, 100, 100, 100, 10, 29.9])
+		bids = np.array([0, 9, 10, 60, 0, 50])
+		self.assertEqual(list(curve.extensions(remaining, bids)),
+			[curve.extension(r, b) for r, b in zip(remaining, bids)])
+		self.assertEqual(list(FixedCurve(40).extensions(remaining, bids)), [40.0] * 6)
+
+	def test_rounds(self):
+		result = simulate(FixedCurve(40), rounds=2000, duration=100, rate=0.05, decay=0.9, players=50, seed=1)
+		self.assertEqual(set(result), {'length', 'bids', 'winner', 'finished'})
+		self.assertTrue(result['finished'].all())
+		# A round lasts its duration plus what its bids added
+		self.assertTrue(np.allclose(result['length'], 100 + 40 * result['bids']))
+		nobody = result['bids'] == 0
+		self.assertTrue(nobody.any() and not nobody.all())
+		self.assertTrue((result['winner'][nobody] == -1).all())
+		self.assertTrue(((result['winner'][~nobody] >= 0) & (result['winner'][~nobody] < 50)).all())
+		again = simulate(FixedCurve(40), rounds=2000, duration=100, rate=0.05, decay=0.9, players=50, seed=1)
+		self.assertTrue(all((result[key] == again[key]).all() for key in result))
+
+	def test_endless_rounds_are_cut(self):
+		# A bid every 10 s on average, each adding a day: nobody ever runs out
+		result = simulate(FixedCurve(86400), rounds=10, rate=0.1, decay=1, max_bids=20)
+		self.assertEqual(list(result['bids']), [20] * 10)
+		self.assertFalse(result['finished'].any())
+
+	def test_summary(self):
+		result = {
+			'length': np.array([100.0, 140.0, 180.0, 220.0]),
+			'bids': np.array([0, 1, 2, 3]),
+			'winner': np.array([-1, 0, 0, 5]),
+			'finished': np.array([True, True, True, False]),
+		}
+		summary = summarize(result, price=2.0, players=10)
+		self.assertEqual(summary['length_mean'], 160.0)
+		self.assertEqual(summary['revenue_mean'], 3.0)
+		self.assertEqual(summary['no_bid_share'], 0.25)
+		self.assertAlmostEqual(summary['top_decile_win_share'], 2 / 3)
+		self.assertEqual(summary['distinct_winners'], 2)
+		self.assertEqual(summary['unfinished_share'], 0.25)
+
+@override_settings(LOBBY_EXTRA_CLOCKS=[7], CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class KnownClockTests(TestCase):
+	async def test_only_known_clocks_exist(self):
+		self.assertTrue(await clock_exists(1))
+		self.assertTrue(await clock_exists(7))
+		self.assertFalse(await clock_exists(42))
+		await ClockCreation.objects.acreate(block_number=1, block_hash='0x1', tx_hash='0x1', log_index=0,
+			clock_id=42, prize=1)
+		self.assertTrue(await clock_exists(42))
+
+	async def test_unknown_clock_is_refused(self):
+		communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/lobby/99')
+		communicator.scope['user_id'] = 1
+		try:
+			connected, code = await communicator.connect()
+		finally:
+			await service.shutdown()
+		self.assertEqual((connected, code), (False, 4404))
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER, CACHES=LOCAL_CACHES, LOBBY_CAPTURE='', WEB3_PROVIDER_URL='')
+class CodecTests(TestCase):
+	def setUp(self):
+		for target, value in (
+			('lastbidder.lobby.presence._presence', InMemoryPresence()),
+			('lastbidder.lobby.leaderboard._leaderboard', InMemoryLeaderboard()),
+		):
+			patcher = mock.patch(target, value)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	async def first_frame(self, subprotocols):
+		communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/lobby', subprotocols=subprotocols)
+		communicator.scope['user_id'] = '1'
+		try:
+			connected, subprotocol = await communicator.connect()
+			self.assertTrue(connected)
+			frame = await communicator.receive_output()
+			await communicator.disconnect()
+		finally:
+			await service.shutdown()
+		return subprotocol, frame
+
+	async def test_json_subprotocol_sends_text(self):
+		subprotocol, frame = await self.first_frame(['lastbidder.json'])
+		self.assertEqual(subprotocol, 'lastbidder.json')
+		self.assertEqual(json.loads(frame['text'])['event'], 'update')
+		self.assertIsNone(frame.get('bytes'))
+
+	async def test_msgpack_subprotocol_sends_bytes(self):
+		subprotocol, frame = await self.first_frame(['lastbidder.json', 'lastbidder.msgpack'])
+		self.assertEqual(subprotocol, 'lastbidder.msgpack')
+		self.assertEqual(msgpack.unpackb(frame['bytes'])['event'], 'update')
+		self.assertIsNone(frame.get('text'))
+
+	async def test_no_subprotocol_falls_back_to_json(self):
+		subprotocol, frame = await self.first_frame([])
+		self.assertIsNone(subprotocol)
+		self.assertEqual(json.loads(frame['text'])['event'], 'update')
+
+	def test_group_frame_is_encoded_once_per_codec(self):
+		payload = {'event': 'chat', 'data': {'message': 'gl hf'}}
+		message = group_frame(payload, key='clock_1', droppable=True)
+		self.assertEqual(message['type'], 'lobby.frame')
+		self.assertEqual(json.loads(message['text']), payload)
+		self.assertEqual(msgpack.unpackb(message['bytes']), payload)
+		self.assertEqual((message['key'], message['droppable']), ('clock_1', True))
+		self.assertNotIn('key', group_frame(payload))
+		self.assertNotIn('droppable', group_frame(payload))
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER, CACHES=LOCAL_CACHES, LOBBY_EXTRA_CLOCKS=[1000], LOBBY_CAPTURE='',
+	WEB3_PROVIDER_URL='', ALLOWED_HOSTS=['localhost'], DEBUG_PROPAGATE_EXCEPTIONS=True)
+class BenchLobbyTests(TestCase):
+	def setUp(self):
+		pool = ThreadPoolExecutor(max_workers=1)
+		self.addCleanup(pool.shutdown)
+		for target, value in (
+			('lastbidder.authService.siwe.get_pool', mock.Mock(return_value=pool)),
+			('lastbidder.lobby.management.commands.bench_lobby.get_pool', mock.Mock(return_value=pool)),
+			('lastbidder.lobby.presence._presence', InMemoryPresence()),
+			('lastbidder.lobby.leaderboard._leaderboard', InMemoryLeaderboard()),
+		):
+			patcher = mock.patch(target, value)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+		self.command = BenchLobby(stdout=io.StringIO())
+
+	async def test_clients_log_in_bid_and_hear_back(self):
+		# One login at a time: each request gets its own thread, and those lock
+		# each other out of the in-memory SQLite test database
+		metrics = await self.command.run({'clients': 3, 'clocks': 1, 'duration': 0.5, 'bid_interval': 0.05,
+			'chat_interval': 0.2, 'concurrency': 1})
+		self.assertEqual(set(metrics), set(METRICS))
+		self.assertGreater(metrics['frames_per_second'], 0)
+		self.assertGreater(metrics['bid_latency_p50_ms'], 0)
+
+	def test_regressions_fail_the_run(self):
+		baseline = {'connect_rate': 100, 'bid_latency_p99_ms': 10}
+		with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+			json.dump(baseline, f)
+			f.flush()
+			self.command.compare({'connect_rate': 90, 'bid_latency_p99_ms': 11}, f.name, 0.2)
+			with self.assertRaises(CommandError):
+				self.command.compare({'connect_rate': 70, 'bid_latency_p99_ms': 11}, f.name, 0.2)
+			with self.assertRaises(CommandError):
+				self.command.compare({'connect_rate': 100, 'bid_latency_p99_ms': 13}, f.name, 0.2)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER, LOBBY_EXTRA_CLOCKS=[2000], LOBBY_CAPTURE='', WEB3_PROVIDER_URL='')
+class CaptureTests(TransactionTestCase):
+	# Transactions are not wrapped around each test: the replay reaches the
+	# database from its own event loop's threads
+	def setUp(self):
+		tmpdir = tempfile.TemporaryDirectory()
+		self.addCleanup(tmpdir.cleanup)
+		self.path = os.path.join(tmpdir.name, 'lobby.capture')
+		self.fresh_backends()
+
+	def fresh_backends(self):
+		for target, value in (
+			('lastbidder.lobby.presence._presence', InMemoryPresence()),
+			('lastbidder.lobby.leaderboard._leaderboard', InMemoryLeaderboard()),
+			('lastbidder.lobby.cluster._clocks', None),
+			('lastbidder.lobby.ratelimit._limiter', None),
+		):
+			patcher = mock.patch(target, value)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+		# The in-memory channel layer is bound to the loop it first ran on
+		patcher = mock.patch.dict(channel_layers.backends, clear=True)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		# Nor should the clocks of other runs, or the rows they queued
+		for target, values in (
+			(registry, {'_clocks': {}, '_watchers': {}}),
+			(ledger, {'_rounds': [], '_bids': [], '_closed': [], '_verdicts': [], '_writing': None}),
+		):
+			patcher = mock.patch.multiple(target, **values)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	async def record(self):
+		recorder = TrafficRecorder(self.path)
+		with mock.patch('lastbidder.lobby.capture._recorder', recorder):
+			communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/lobby/2000',
+				subprotocols=['lastbidder.json'])
+			communicator.scope.update({'user_id': '1', 'wallet': '0xa'})
+			self.assertTrue((await communicator.connect())[0])
+			await communicator.send_json_to({'event': 'bid', 'data': {}})
+			while 'bid_success' not in (await communicator.receive_output())['text']:
+				pass
+			# Let the broadcast of the bid go out
+			await asyncio.sleep(0.2)
+			await communicator.disconnect()
+			await service.shutdown()
+
+	def test_capture_round_trips(self):
+		recorder = TrafficRecorder(self.path)
+		conn = recorder.open('1', '0xa', '/lobby/2000', 'lastbidder.msgpack')
+		recorder.record(conn, IN, b'\x80')
+		recorder.record(conn, OUT, '{"event": "update"}')
+		recorder.record(conn, CLOSE, 1000)
+		asyncio.run(recorder.flush())
+		records = list(read_capture(self.path))
+		self.assertEqual([record[1:] for record in records], [
+			(conn, OPEN, {'user': '1', 'wallet': '0xa', 'path': '/lobby/2000', 'subprotocol': 'lastbidder.msgpack'}),
+			(conn, IN, b'\x80'),
+			(conn, OUT, '{"event": "update"}'),
+			(conn, CLOSE, 1000),
+		])
+		self.assertEqual(captured_clocks(records), [2000])
+		self.assertEqual(last_bidders([
+			{'event': 'update', 'data': {'clock_id': 2000, 'last_bidder': '0xa'}},
+			{'event': 'chat', 'data': {'messages': []}},
+			{'event': 'update', 'data': {'clock_id': 2000, 'last_bidder': '0xb'}},
+		]), {2000: '0xb'})
+
+	def test_logs_of_every_process_are_merged(self):
+		recorders = []
+		for pid in (101, 102):
+			with mock.patch('os.getpid', return_value=pid):
+				recorders.append(TrafficRecorder(self.path))
+		first, second = recorders
+		# Each process numbers its sockets from 1; the second log's ids are
+		# shifted past the first's
+		first.record(first.open('1', '0xa', '/lobby/2000', None), CLOSE, 1000)
+		time.sleep(0.01)
+		second.record(second.open('2', '0xb', '/lobby/2000', None), CLOSE, 1000)
+		time.sleep(0.01)
+		first.record(first.open('3', '0xc', '/lobby/2000', None), CLOSE, 1000)
+		for recorder in recorders:
+			asyncio.run(recorder.flush())
+		self.assertEqual(len({recorder.path for recorder in recorders}), 2)
+		records = list(read_capture(self.path))
+		self.assertEqual([(conn, kind) for _, conn, kind, _ in records],
+			[(1, OPEN), (1, CLOSE), (3, OPEN), (3, CLOSE), (2, OPEN), (2, CLOSE)])
+		times = [t for t, _, _, _ in records]
+		self.assertEqual((times[0], times), (0, sorted(times)))
+		# One process's log can be read on its own
+		self.assertEqual(len(list(read_capture(second.path))), 2)
+
+	@mock.patch('lastbidder.lobby.management.commands.replay_lobby.throwaway_database', contextlib.nullcontext)
+	def test_replay_ends_on_the_captured_last_bidder(self):
+		async_to_sync(self.record)()
+		self.assertEqual(last_bidders(decode(data) for _, _, kind, data in read_capture(self.path)
+			if kind == OUT), {2000: '1'})
+		# Replay against a clean slate, as on a throwaway database
+		ClockRound.objects.all().delete()
+		self.fresh_backends()
+		out = io.StringIO()
+		with override_settings(CACHES={**LOCAL_CACHES}):
+			call_command('replay_lobby', self.path, speed=0, settle=0.2, check=True, stdout=out)
+		self.assertIn('Every clock ends on the captured last bidder', out.getvalue())
+
+	@mock.patch('lastbidder.lobby.management.commands.replay_lobby.throwaway_database', contextlib.nullcontext)
+	def test_check_fails_on_a_diverging_clock(self):
+		recorder = TrafficRecorder(self.path)
+		conn = recorder.open('1', '0xa', '/lobby/2000', None)
+		recorder.record(conn, OUT, json.dumps({'event': 'update', 'data': {'clock_id': 2000, 'last_bidder': '0xb'}}))
+		asyncio.run(recorder.flush())
+		out = io.StringIO()
+		with override_settings(CACHES={**LOCAL_CACHES}), self.assertRaises(CommandError):
+			call_command('replay_lobby', self.path, speed=0, settle=0, check=True, stdout=out)
+		self.assertIn("clock 2000: last bidder '0xb' captured, None replayed", out.getvalue())
@@ -0,0 +1,70 @@
+"""
+Structured logging that never blocks the event loop.
+
+Records are put on a queue by :class:`BackgroundHandler` and written as JSON
+lines by a listener thread. :class:`Sampler` keeps per-event logs (one per
+bid, per frame...) down to one line per interval, with a count of what was
+skipped.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# LogRecord attributes that are not user supplied ``extra`` fields
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RESERVED)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class BackgroundHandler(QueueHandler):
+    """Hands records to a thread that formats and writes them to stderr."""
+
+    def __init__(self, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        stream = logging.StreamHandler(sys.stderr)
+        stream.setFormatter(JsonFormatter())
+        self.listener = QueueListener(self.queue, stream, respect_handler_level=False)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass  # Drop rather than stall the caller
+
+    def prepare(self, record):
+        # Formatting happens in the listener thread
+        return record
+
+class Sampler:
+    """Lets one event per ``key`` through every ``interval`` seconds."""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._next = {}
+        self._skipped = {}
+
+    def __call__(self, key):
+        """Return None to skip, or how many events were skipped since the last one."""
+        now = time.monotonic()
+        if now < self._next.get(key, 0):
+            self._skipped[key] = self._skipped.get(key, 0) + 1
+            return None
+        self._next[key] = now + self.interval
+        return self._skipped.pop(key, 0)
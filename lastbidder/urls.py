@@ -16,8 +16,10 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from lastbidder.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('auth/', include('lastbidder.authService.urls')),  # Include auth app URLs
+    path('metrics/', metrics_view, name='metrics'),  # Prometheus scrape endpoint
 ]
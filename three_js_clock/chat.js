@@ -8,7 +8,11 @@ export function newChatMessage(message) {
     }
     console.log('Chat msg', message);
     messageElement.classList.add('message');
-    messageElement.innerHTML = `<span class="username">Ano:</span> ${message}`;
+    // Chat text comes from other users: never parse it as HTML
+    const username = document.createElement('span');
+    username.classList.add('username');
+    username.textContent = 'Ano:';
+    messageElement.append(username, ' ' + message);
     chatBox.appendChild(messageElement);
     chatBox.scrollTop = chatBox.scrollHeight;
 };
\ No newline at end of file
@@ -38,6 +38,28 @@ const CONTRACT_ADDRESS = "0xeBa9c2c94a1Fc2e2A486D91ee1E6cC79ce7370e0";
     "event ClockFinalized(uint256 indexed clockId, address winner, uint256 prize)"
     ];
 
+// Local countdown extrapolated from the deadline sent by the server
+let countdownTimer = null;
+let heartbeatTimer = null;
+
+function startCountdown(state) {
+    // Correct for clock skew between the browser and the server
+    const deadline = state.deadline - state.server_time + Date.now() / 1000;
+    const tick = () => {
+        const remaining = Math.max(0, deadline - Date.now() / 1000);
+        if (window.updateClockTimeUI) {
+            window.updateClockTimeUI(remaining);
+        }
+        if (remaining <= 0 || !state.is_active) {
+            clearInterval(countdownTimer);
+            countdownTimer = null;
+        }
+    };
+    clearInterval(countdownTimer);
+    countdownTimer = setInterval(tick, 250);
+    tick();
+}
+
 document.addEventListener('DOMContentLoaded', () => {
     const connectBtn = document.getElementById('connect-wallet');
     
@@ -97,7 +119,8 @@ document.addEventListener('DOMContentLoaded', () => {
             connectBtn.textContent = 'Wallet Connecté';
             connectBtn.style.backgroundColor = '#21ba45';
             
-            const response = await fetch('http://localhost:8000/auth/connect/', {
+            // Ask the server for a challenge and sign it to prove we own the wallet
+            const challenge = await fetch('http://localhost:8000/auth/nonce/', {
                 method: 'POST',
                 headers: {
                   'Content-Type': 'application/json',
@@ -105,6 +128,22 @@ document.addEventListener('DOMContentLoaded', () => {
                 body: JSON.stringify({
                   walletAddress: account
                 }),
+            }).then((response) => response.json());
+            const signature = await window.ethereum.request({
+                method: 'personal_sign',
+                params: [challenge.message, account],
+            });
+
+            const response = await fetch('http://localhost:8000/auth/connect/', {
+                method: 'POST',
+                headers: {
+                  'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                  walletAddress: account,
+                  nonce: challenge.nonce,
+                  signature: signature
+                }),
             }).then((response) => {
                 if (!response.ok) {
                     throw new Error('Network response was not ok');
@@ -119,7 +158,10 @@ document.addEventListener('DOMContentLoaded', () => {
             sessionStorage.setItem('refreshToken', data.refresh);
             sessionStorage.setItem('userId', data.userId);
 
-            wsSocket = new WebSocket('ws://localhost:8000/lobby');
+            // The access token authenticates the socket, passed as a subprotocol
+            wsSocket = new WebSocket('ws://localhost:8000/lobby', ['lastbidder.json', 'bearer.' + data.access]);
+            // Newest clock state seen on this socket, frames from other workers may arrive out of order
+            let lastSeq = -1;
             
             wsSocket.onopen = function(event) {
                 wsSocket.send(JSON.stringify({
@@ -130,8 +172,25 @@ document.addEventListener('DOMContentLoaded', () => {
                     }
                 }));
                 console.log("Connecté au serveur WebSocket");
+                
+                // Keep our presence alive, the server reaps silent sockets
+                heartbeatTimer = setInterval(() => {
+                    if (wsSocket && wsSocket.readyState === WebSocket.OPEN) {
+                        wsSocket.send(JSON.stringify({ event: 'heartbeat', data: {} }));
+                    }
+                }, 10000);
             };
 
+            const chatInput = document.getElementById('chat-input');
+            if (chatInput) {
+                chatInput.onkeydown = function(e) {
+                    if (e.key === 'Enter' && chatInput.value.trim() && wsSocket && wsSocket.readyState === WebSocket.OPEN) {
+                        wsSocket.send(JSON.stringify({ event: 'chat', data: { message: chatInput.value } }));
+                        chatInput.value = '';
+                    }
+                };
+            }
+
             wsSocket.onmessage = function(event) {
                 try {
                     const data = JSON.parse(event.data);
@@ -139,40 +198,34 @@ document.addEventListener('DOMContentLoaded', () => {
                     
                     // Check for event types and handle properly
                     if (data.event === 'update') {
-                        console.log("Update received:", data.data);
-                        
-                        // Update clock time if window.updateClockTimeUI is available
-                        if (window.updateClockTimeUI && data.data.remaining_time !== undefined) {
-                            console.log("Calling updateClockTimeUI with:", data.data.remaining_time);
-                            window.updateClockTimeUI(data.data.remaining_time);
-                        } else {
-                            console.warn("Cannot update clock UI - missing function or data", {
-                                hasFunction: !!window.updateClockTimeUI,
-                                hasData: data.data.remaining_time !== undefined,
-                                remainingTime: data.data.remaining_time
-                            });
+                        if (data.data.seq !== undefined) {
+                            if (data.data.seq < lastSeq) {
+                                return;
+                            }
+                            lastSeq = data.data.seq;
                         }
-                    }
-                    else if (data.event === 'bid_notification') {
-                        console.log("Bid notification received:", data.data);
+                        console.log("Update received:", data.data);
                         
-                        // Update clock time if notification includes new time
-                        if (window.updateClockTimeUI && data.data.new_time !== undefined) {
-                            console.log("Updating clock from bid notification with time:", data.data.new_time);
-                            window.updateClockTimeUI(data.data.new_time);
+                        // The server only pushes changes: run the countdown locally from the deadline
+                        if (data.data.deadline !== undefined) {
+                            startCountdown(data.data);
                         }
                         
                         // Show notification about who bid
-                        if (data.data.bidder) {
-                            const isCurrentUser = data.data.bidder === sessionStorage.getItem('userId');
-                            console.log(`Bid by ${isCurrentUser ? 'you' : data.data.bidder}`);
+                        if (data.data.bids && data.data.last_bidder) {
+                            const isCurrentUser = data.data.last_bidder === sessionStorage.getItem('userId');
+                            console.log(`Bid by ${isCurrentUser ? 'you' : data.data.last_bidder}`);
                             
                             // Maybe show a toast notification
                             if (!isCurrentUser) {
-                                alert(`User ${data.data.bidder} placed a bid!`);
+                                alert(`User ${data.data.last_bidder} placed a bid!`);
                             }
                         }
                     }
+                    else if (data.event === 'chat') {
+                        // Messages arrive batched, and the room history on connect
+                        data.data.messages.forEach(msg => newChatMessage(msg.message));
+                    }
                     else if (data.event === 'end_clock') {
                         console.log("L'horloge est terminée:", data.data);
                         alert(`L'horloge est terminée! Dernier enchérisseur: ${data.data.last_bidder || 'Aucun'}`);
@@ -192,6 +245,7 @@ document.addEventListener('DOMContentLoaded', () => {
             };
 
             wsSocket.onclose = function(event) {
+                clearInterval(heartbeatTimer);
                 wsSocket = null;
             };
             // Connexion au contrat (si ethers.js est disponible)